@@ -0,0 +1,314 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Routes low-confidence Amazon Lookout for Vision detections to human review
+with Amazon Augmented AI (A2I), in batches instead of one human loop per
+prediction as in the integration notebook.
+
+"submit" reads detections in the results.jsonl format that
+evaluation/evaluate.py writes, and:
+- Keeps the detections below the confidence threshold.
+- Drops images that are near-duplicates, by perceptual hash, of each other or
+  of images already sent for review.
+- Samples at most --per-class images for each predicted class.
+- Uploads the images and starts the human loops concurrently, through one
+  rate limiter.
+
+"collect" lists the completed human loops of the flow definition in pages,
+fetches the outputs of the loops still pending in the local index, and
+records the reviewers' labels.
+
+The local index is an append-only JSON Lines file with one record per image
+event, so runs can be interrupted and resumed. Pass --a2i-endpoint-url to use
+local-service/mock_a2i.py instead of A2I, and leave out --bucket to send
+local file:// URIs instead of uploading the images.
+"""
+
+import logging
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse, unquote
+
+import boto3
+from boto3.exceptions import S3UploadFailedError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from PIL import Image
+
+# The rate limiter is shared with the automation scripts and the perceptual hash and its
+# near-duplicate index with validate_dataset.py.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'automation'))
+sys.path.insert(0, str(ROOT / 'computer-vision-defect-detection' / 'cookie-dataset'))
+
+from waiters import RateLimiter
+from validate_dataset import HashBands, perceptual_hash as image_hash
+
+DEFAULT_INDEX = "review-index.jsonl"
+DEFAULT_THRESHOLD = 0.70
+DEFAULT_MAX_DISTANCE = 4
+DEFAULT_RATE = 5
+DEFAULT_MAX_WORKERS = 8
+MAX_ATTEMPTS = 5
+RETRY_ERRORS = ("ThrottlingException", "ServiceUnavailable", "InternalServerError")
+
+
+logger = logging.getLogger(__name__)
+
+
+def call_with_retry(limiter, function, **kwargs):
+    """
+    Calls function through the rate limiter, retrying throttling errors with backoff.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        limiter.acquire()
+        try:
+            return function(**kwargs)
+        except ClientError as error:
+            if error.response["Error"]["Code"] not in RETRY_ERRORS or attempt == MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, min(30, 2 ** attempt)))
+
+
+def perceptual_hash(image_path):
+    """
+    Gets the 64-bit difference hash of an image file. Near-identical images have
+    hashes that differ in a few bits.
+    """
+    with Image.open(image_path) as image:
+        return image_hash(image)
+
+
+def predicted_class(detection):
+    """
+    Gets the class a detection is sampled by: the defect class with the largest
+    area for anomalous segmentation results, otherwise anomaly or normal.
+    """
+    if not detection["is_anomalous"]:
+        return "normal"
+    defects = {name: anomaly["area"] for name, anomaly in detection.get("anomalies", {}).items()
+               if name != "background"}
+    return max(defects, key=defects.get) if defects else "anomaly"
+
+
+class ReviewIndex:
+    """
+    The local index of images sent for review and their review results.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.records = {}
+        self.lock = threading.Lock()
+        if self.path.exists():
+            with open(self.path) as index_file:
+                for line in index_file:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records.setdefault(record["image"], {}).update(record)
+
+    def record(self, image, **fields):
+        """Updates the record of an image and appends the change to the index file."""
+        with self.lock:
+            self.records.setdefault(image, {"image": image}).update(fields)
+            with open(self.path, "a") as index_file:
+                index_file.write(json.dumps({"image": image, **fields}) + "\n")
+
+    def pending(self):
+        return {record["loop"]: record for record in self.records.values()
+                if record.get("status") == "InProgress"}
+
+    def hashes(self):
+        return {image: record["hash"] for image, record in self.records.items() if "hash" in record}
+
+
+def select_for_review(detections, image_folder, index, threshold=DEFAULT_THRESHOLD,
+                      per_class=None, max_distance=DEFAULT_MAX_DISTANCE, seed=None):
+    """
+    Selects the low-confidence detections to review, without near-duplicates
+    and with at most per_class images per predicted class.
+    Returns a list of (detection, image hash, class) tuples.
+    """
+    candidates = [detection for detection in detections
+                  if detection["confidence"] < threshold and detection["image"] not in index.records]
+    random.Random(seed).shuffle(candidates)
+    # Lower confidence first, so the least certain images are kept when sampling.
+    candidates.sort(key=lambda detection: detection["confidence"])
+
+    with ThreadPoolExecutor() as executor:
+        hashes = list(executor.map(
+            lambda detection: perceptual_hash(Path(image_folder) / detection["image"]), candidates))
+
+    # Only hashes that share a band with a candidate are compared, see validate_dataset.HashBands.
+    known = HashBands(max_distance)
+    for image, known_hash in index.hashes().items():
+        known.add(image, known_hash)
+    per_class_count = {}
+    selected = []
+    for detection, candidate_hash in zip(candidates, hashes):
+        if next(known.matches(candidate_hash), None) is not None:
+            continue
+        name = predicted_class(detection)
+        if per_class is not None and per_class_count.get(name, 0) >= per_class:
+            continue
+        per_class_count[name] = per_class_count.get(name, 0) + 1
+        known.add(detection["image"], candidate_hash)
+        selected.append((detection, candidate_hash, name))
+    return selected
+
+
+def submit_reviews(selected, image_folder, index, a2i_client, flow_definition_arn, s3_client=None,
+                   bucket=None, prefix="a2i-input", rate=DEFAULT_RATE, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Uploads the selected images and starts a human loop for each, concurrently.
+    Returns the number of human loops started.
+    """
+    limiter = RateLimiter(rate)
+
+    def submit(item):
+        detection, image_hash, name = item
+        image_path = Path(image_folder) / detection["image"]
+        if bucket:
+            key = f"{prefix}/{image_hash:016x}{image_path.suffix}"
+            try:
+                s3_client.upload_file(str(image_path), bucket, key)
+            except (S3UploadFailedError, ClientError, BotoCoreError, OSError) as error:
+                logger.error("Couldn't upload %s: %s", detection["image"], error)
+                return False
+            task_object = f"s3://{bucket}/{key}"
+        else:
+            task_object = image_path.resolve().as_uri()
+        loop_name = f"l4v-{uuid.uuid4()}"
+        try:
+            call_with_retry(limiter, a2i_client.start_human_loop, HumanLoopName=loop_name,
+                            FlowDefinitionArn=flow_definition_arn,
+                            HumanLoopInput={"InputContent": json.dumps({"taskObject": task_object})})
+        except (ClientError, BotoCoreError) as error:
+            logger.error("Couldn't start a human loop for %s: %s", detection["image"], error)
+            return False
+        index.record(detection["image"], hash=image_hash, predicted_class=name,
+                     confidence=detection["confidence"], task_object=task_object,
+                     loop=loop_name, status="InProgress", submitted=time.time())
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(submit, selected))
+
+
+def read_output(output_uri, s3_client):
+    """Reads a human loop output from S3, or from a file:// URI written by a local stand-in."""
+    url = urlparse(output_uri)
+    if url.scheme == "file":
+        with open(unquote(url.path)) as output_file:
+            return json.load(output_file)
+    response = s3_client.get_object(Bucket=url.netloc, Key=url.path.lstrip("/"))
+    return json.loads(response["Body"].read())
+
+
+def collect_reviews(index, a2i_client, flow_definition_arn, s3_client=None,
+                    rate=DEFAULT_RATE, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Records the results of pending human loops that have completed.
+    Returns the number of results recorded.
+    """
+    limiter = RateLimiter(rate)
+    pending = index.pending()
+    if not pending:
+        return 0
+    # One list call returns many loop statuses; only completed loops are described.
+    oldest = min(record.get("submitted", 0) for record in pending.values())
+    finished = {}
+    kwargs = {"FlowDefinitionArn": flow_definition_arn, "MaxResults": 100}
+    if oldest:
+        kwargs["CreationTimeAfter"] = oldest - 60
+    while True:
+        response = call_with_retry(limiter, a2i_client.list_human_loops, **kwargs)
+        for summary in response["HumanLoopSummaries"]:
+            if summary["HumanLoopName"] in pending and summary["HumanLoopStatus"] != "InProgress":
+                finished[summary["HumanLoopName"]] = summary["HumanLoopStatus"]
+        if "NextToken" not in response:
+            break
+        kwargs["NextToken"] = response["NextToken"]
+
+    def collect(loop_name):
+        record = pending[loop_name]
+        if finished[loop_name] != "Completed":
+            index.record(record["image"], status=finished[loop_name])
+            return False
+        try:
+            description = call_with_retry(limiter, a2i_client.describe_human_loop, HumanLoopName=loop_name)
+            output = read_output(description["HumanLoopOutput"]["OutputS3Uri"], s3_client)
+            label = output["humanAnswers"][0]["answerContent"]["crowd-image-classifier"]["label"]
+        except (ClientError, BotoCoreError, OSError, ValueError, KeyError, IndexError) as error:
+            # The loop stays pending in the index, so the next collect tries it again.
+            logger.error("Couldn't collect the review of %s from %s: %s", record["image"], loop_name, error)
+            return False
+        index.record(record["image"], status="Completed", label=label)
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(collect, finished))
+
+
+def read_detections(detections_file):
+    with open(detections_file) as detections:
+        return [json.loads(line) for line in detections if line.strip()]
+
+
+def main():
+    """
+    Entry point for the review router.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Sends low-confidence detections to A2I human review in batches.")
+    parser.add_argument("command", choices=["submit", "collect"],
+                        help="submit: start human loops for detections, collect: record completed reviews.")
+    parser.add_argument("--flow-definition-arn", required=True, help="The A2I flow definition.")
+    parser.add_argument("--index", default=DEFAULT_INDEX, help="The local review index file.")
+    parser.add_argument("--detections", help="submit only, results.jsonl file with the detections.")
+    parser.add_argument("--images", help="submit only, the folder the detection image paths are relative to.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="submit only, review detections with a lower confidence.")
+    parser.add_argument("--per-class", type=int, help="submit only, the maximum number of images per class.")
+    parser.add_argument("--max-distance", type=int, default=DEFAULT_MAX_DISTANCE,
+                        help="submit only, images with hashes this many bits apart or fewer are duplicates.")
+    parser.add_argument("--bucket", help="submit only, the bucket to upload images to.")
+    parser.add_argument("--prefix", default="a2i-input", help="submit only, the key prefix for uploaded images.")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="The maximum API calls per second.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help="The number of concurrent calls.")
+    parser.add_argument("--region", help="The AWS Region.")
+    parser.add_argument("--a2i-endpoint-url", help="An A2I runtime endpoint to use instead of AWS.")
+    parser.add_argument("--s3-endpoint-url", help="An S3 endpoint to use instead of AWS.")
+    args = parser.parse_args()
+
+    config = Config(max_pool_connections=args.workers * 2, retries={"max_attempts": 1, "mode": "standard"})
+    a2i_client = boto3.client("sagemaker-a2i-runtime", args.region,
+                              endpoint_url=args.a2i_endpoint_url, config=config)
+    s3_client = boto3.client("s3", args.region, endpoint_url=args.s3_endpoint_url, config=config)
+    index = ReviewIndex(args.index)
+
+    if args.command == "submit":
+        if not args.detections or not args.images:
+            parser.error("submit needs --detections and --images")
+        selected = select_for_review(read_detections(args.detections), args.images, index,
+                                     args.threshold, args.per_class, args.max_distance)
+        started = submit_reviews(selected, args.images, index, a2i_client, args.flow_definition_arn,
+                                 s3_client, args.bucket, args.prefix, args.rate, args.workers)
+        print(f"Started {started} human loops for {len(selected)} selected detections")
+    else:
+        collected = collect_reviews(index, a2i_client, args.flow_definition_arn, s3_client,
+                                    args.rate, args.workers)
+        print(f"Recorded {collected} completed reviews, {len(index.pending())} still pending")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Brings many Amazon Lookout for Vision projects to a declared state, running
+the steps from the Lab notebook (create_project, create_dataset,
+create_model, start_model, stop_model) for all projects concurrently.
+
+Projects are described in a YAML file:
+
+    defaults:
+      min_inference_units: 1
+    projects:
+      - name: sku-1234
+        datasets:
+          train: s3://my-bucket/sku-1234/train.manifest
+          test: s3://my-bucket/sku-1234/test.manifest
+        output: s3://my-bucket/sku-1234/model/
+        state: hosted
+
+state is one of trained (train only), hosted (train and start the model) or
+stopped (train and stop the model). Every step checks the current state
+first and passes a deterministic ClientToken, so re-running the file, or
+retrying after a failure, doesn't create duplicates. API calls from all
+projects share one rate limiter and throttled calls are retried.
+"""
+
+import logging
+import argparse
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import yaml
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from waiters import (
+    model_wait, dataset_wait, wait_for_status, backoff_delay, RateLimiter, WaiterError,
+    DEFAULT_TIMEOUT
+)
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_RATE = 5
+MAX_ATTEMPTS = 6
+
+RETRY_ERRORS = ("ThrottlingException", "TooManyRequestsException", "InternalServerException")
+STATES = ("trained", "hosted", "stopped")
+# The namespace for ClientToken values, so that retried calls are idempotent.
+TOKEN_NAMESPACE = uuid.UUID("6b0e4f3c-1f4e-4d53-9a9e-6f1c9c1b7a21")
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProjectOrchestrator:
+    """
+    Runs the lifecycle steps for projects with a shared client and rate limiter.
+    """
+    def __init__(self, client, rate=DEFAULT_RATE, timeout=DEFAULT_TIMEOUT):
+        self.client = client
+        self.limiter = RateLimiter(rate)
+        self.timeout = timeout
+
+    def call(self, operation, **kwargs):
+        """
+        Calls a lookoutvision operation through the rate limiter, retrying
+        throttling, internal and connection errors with backoff.
+        """
+        for attempt in range(MAX_ATTEMPTS):
+            self.limiter.acquire()
+            try:
+                return getattr(self.client, operation)(**kwargs)
+            except ClientError as error:
+                if error.response["Error"]["Code"] not in RETRY_ERRORS or attempt == MAX_ATTEMPTS - 1:
+                    raise
+                delay = backoff_delay(attempt, base_delay=1, max_delay=30)
+                logger.info("%s throttled, retrying in %.1fs", operation, delay)
+                time.sleep(delay)
+            except BotoCoreError as error:
+                # botocore's own retries are turned off, so connection errors and timeouts are retried here.
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                delay = backoff_delay(attempt, base_delay=1, max_delay=30)
+                logger.info("%s failed (%s), retrying in %.1fs", operation, error, delay)
+                time.sleep(delay)
+
+    def wait(self, status_wait):
+        # Describe calls made while waiting go through the rate limiter too.
+        describe = status_wait.describe
+
+        def limited_describe():
+            self.limiter.acquire()
+            return describe()
+        status_wait.describe = limited_describe
+        return wait_for_status(status_wait, timeout=self.timeout)
+
+    @staticmethod
+    def token(*parts):
+        return str(uuid.uuid5(TOKEN_NAMESPACE, "/".join(str(part) for part in parts)))
+
+    def ensure_project(self, name):
+        try:
+            self.call("describe_project", ProjectName=name)
+            logger.info("Project %s exists", name)
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "ResourceNotFoundException":
+                raise
+            logger.info("Creating project %s", name)
+            self.call("create_project", ProjectName=name, ClientToken=self.token(name, "project"))
+
+    def ensure_dataset(self, name, dataset_type, manifest):
+        try:
+            self.call("describe_dataset", ProjectName=name, DatasetType=dataset_type)
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "ResourceNotFoundException":
+                raise
+            bucket, key = manifest.replace("s3://", "").split("/", 1)
+            logger.info("Creating %s dataset for %s", dataset_type, name)
+            self.call("create_dataset", ProjectName=name, DatasetType=dataset_type,
+                      DatasetSource={"GroundTruthManifest": {"S3Object": {"Bucket": bucket, "Key": key}}},
+                      ClientToken=self.token(name, dataset_type, manifest))
+        self.wait(dataset_wait(self.client, name, dataset_type))
+
+    def ensure_model(self, name, output):
+        """Returns the latest model version, training a new one if the project has none."""
+        models = self.call("list_models", ProjectName=name)["Models"]
+        if models:
+            version = max(models, key=lambda model: int(model["ModelVersion"]))["ModelVersion"]
+        else:
+            bucket, prefix = output.replace("s3://", "").split("/", 1)
+            logger.info("Training model for %s", name)
+            version = self.call("create_model", ProjectName=name,
+                                OutputConfig={"S3Location": {"Bucket": bucket, "Prefix": prefix}},
+                                ClientToken=self.token(name, "model", output))["ModelMetadata"]["ModelVersion"]
+        status = self.call("describe_model", ProjectName=name,
+                           ModelVersion=version)["ModelDescription"]["Status"]
+        if status == "TRAINING":
+            self.wait(model_wait(self.client, name, version, "TRAINED"))
+        elif status == "TRAINING_FAILED":
+            raise WaiterError(f"{name}/{version}", status, "Model training failed")
+        return version
+
+    def ensure_hosted(self, name, version, min_inference_units):
+        status = self.call("describe_model", ProjectName=name,
+                           ModelVersion=version)["ModelDescription"]["Status"]
+        if status == "STOPPING_HOSTING":
+            self.wait(model_wait(self.client, name, version, "TRAINED"))
+            status = "TRAINED"
+        if status in ("TRAINED", "HOSTING_FAILED"):
+            logger.info("Starting model %s/%s", name, version)
+            # The token covers retries within the hour, a later run can start the model again.
+            self.call("start_model", ProjectName=name, ModelVersion=version,
+                      MinInferenceUnits=min_inference_units,
+                      ClientToken=self.token(name, version, "start", time.strftime("%Y%m%d%H")))
+        if status != "HOSTED":
+            self.wait(model_wait(self.client, name, version, "HOSTED"))
+
+    def ensure_stopped(self, name, version):
+        status = self.call("describe_model", ProjectName=name,
+                           ModelVersion=version)["ModelDescription"]["Status"]
+        if status == "STARTING_HOSTING":
+            self.wait(model_wait(self.client, name, version, "HOSTED"))
+            status = "HOSTED"
+        if status == "HOSTED":
+            logger.info("Stopping model %s/%s", name, version)
+            self.call("stop_model", ProjectName=name, ModelVersion=version,
+                      ClientToken=self.token(name, version, "stop", time.strftime("%Y%m%d%H")))
+        if status != "TRAINED":
+            self.wait(model_wait(self.client, name, version, "TRAINED"))
+
+    def apply(self, project):
+        """
+        Brings a project to its declared state. Returns a status row.
+        """
+        name = project["name"]
+        state = project.get("state", "trained")
+        if state not in STATES:
+            raise ValueError(f"Unknown state {state} for project {name}")
+        self.ensure_project(name)
+        for dataset_type, manifest in project.get("datasets", {}).items():
+            self.ensure_dataset(name, dataset_type, manifest)
+        version = self.ensure_model(name, project["output"])
+        if state == "hosted":
+            self.ensure_hosted(name, version, project.get("min_inference_units", 1))
+        elif state == "stopped":
+            self.ensure_stopped(name, version)
+        return self.status(name)
+
+    def status(self, name):
+        row = {"project": name, "version": "-", "status": "-", "error": ""}
+        try:
+            models = self.call("list_models", ProjectName=name)["Models"]
+        except ClientError as error:
+            row["error"] = error.response["Error"]["Code"]
+            return row
+        except BotoCoreError as error:
+            row["error"] = str(error)
+            return row
+        if models:
+            latest = max(models, key=lambda model: int(model["ModelVersion"]))
+            row["version"] = latest["ModelVersion"]
+            row["status"] = latest["Status"]
+        return row
+
+
+def load_projects(config_file):
+    with open(config_file, encoding="utf-8") as file:
+        config = yaml.safe_load(file)
+    defaults = config.get("defaults", {})
+    return [{**defaults, **project} for project in config["projects"]]
+
+
+def run_all(function, projects, max_workers):
+    """
+    Runs function for every project concurrently. Returns status rows, with
+    the error for projects that failed.
+    """
+    def run(project):
+        try:
+            return function(project)
+        except (ClientError, BotoCoreError, WaiterError, ValueError, KeyError) as error:
+            logger.error("%s failed: %s", project["name"], error)
+            return {"project": project["name"], "version": "-", "status": "FAILED", "error": str(error)}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, projects))
+
+
+def print_table(rows):
+    headers = ("project", "version", "status", "error")
+    widths = [max([len(header)] + [len(str(row[header])) for row in rows]) for header in headers]
+    print("  ".join(header.upper().ljust(width) for header, width in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(row[header]).ljust(width) for header, width in zip(headers, widths)))
+
+
+def main():
+    """
+    Entry point for the orchestration script.
+    """
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)s: %(threadName)s: %(message)s")
+    parser = argparse.ArgumentParser(
+        description="Creates, trains, starts and stops many Lookout for Vision projects.")
+    parser.add_argument("command", choices=["apply", "status"],
+                        help="apply: bring projects to their declared state, status: show the status table.")
+    parser.add_argument("config", help="The YAML file describing the projects.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS,
+                        help="The number of projects processed concurrently.")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help="The maximum number of API calls per second, across all projects.")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="The maximum time to wait for each dataset or model, in seconds.")
+    parser.add_argument("--region", help="The AWS Region.")
+    parser.add_argument("--endpoint-url", help="A lookoutvision endpoint to use instead of AWS, such as a local stand-in.")
+    args = parser.parse_args()
+
+    client = boto3.client("lookoutvision", args.region, endpoint_url=args.endpoint_url,
+                          config=Config(max_pool_connections=args.workers * 2,
+                                        retries={"max_attempts": 1, "mode": "standard"}))
+    orchestrator = ProjectOrchestrator(client, args.rate, args.timeout)
+    try:
+        projects = load_projects(args.config)
+    except FileNotFoundError as file_error:
+        print(f"Couldn't open file: {file_error.filename}")
+        sys.exit(1)
+
+    if args.command == "apply":
+        rows = run_all(orchestrator.apply, projects, args.workers)
+    else:
+        rows = run_all(lambda project: orchestrator.status(project["name"]), projects, args.workers)
+    print_table(rows)
+    if any(row["error"] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
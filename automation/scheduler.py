@@ -0,0 +1,263 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Starts and stops hosted Amazon Lookout for Vision models to save costs.
+For each model the scheduler watches the request rate from a request log
+and its shift calendar, then:
+- Starts the model ahead of a shift, leaving time for it to warm up, with
+  enough inference units for the expected load.
+- Keeps the model running while requests are arriving.
+- Stops the model once it has been idle, outside a shift, for idle_minutes.
+
+Models are described in a YAML file:
+
+    models:
+      - project: sku-1234
+        version: "1"
+        request_log: /var/log/l4v/sku-1234.log
+        tps_per_inference_unit: 4.5
+        expected_tps: 6
+        max_inference_units: 4
+        warmup_minutes: 20
+        idle_minutes: 30
+        shifts:
+          - days: mon-fri
+            start: "06:00"
+            end: "22:00"
+
+The request log has one line per detect_anomalies call, starting with the
+Unix time of the call. tps_per_inference_unit is the max TPS that tps.py
+measured for the model with one inference unit.
+"""
+
+import logging
+import argparse
+import math
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import boto3
+import yaml
+from botocore.exceptions import BotoCoreError, ClientError
+
+from orchestrate import ProjectOrchestrator
+
+DEFAULT_INTERVAL = 60
+DEFAULT_WARMUP_MINUTES = 20
+DEFAULT_IDLE_MINUTES = 30
+RATE_WINDOW = 5 * 60
+# Extra capacity over the observed peak, so bursts don't throttle.
+HEADROOM = 1.25
+
+DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_days(days):
+    """
+    Parses days such as "mon-fri" or "sat,sun" into a set of weekday numbers.
+    """
+    weekdays = set()
+    for part in days.lower().split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            weekdays.update(range(DAYS.index(first), DAYS.index(last) + 1))
+        else:
+            weekdays.add(DAYS.index(part))
+    return weekdays
+
+
+def in_shift(shifts, when):
+    """
+    Returns True if the datetime when is inside one of the shifts.
+    """
+    for shift in shifts:
+        if when.weekday() not in parse_days(shift.get("days", "mon-sun")):
+            continue
+        start = datetime.strptime(shift["start"], "%H:%M").time()
+        end = datetime.strptime(shift["end"], "%H:%M").time()
+        if start <= end and start <= when.time() < end:
+            return True
+        # Shifts that run past midnight.
+        if start > end and (when.time() >= start or when.time() < end):
+            return True
+    return False
+
+
+class RequestLog:
+    """
+    Reads request times appended to a log file and keeps those in the rate window.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.times = deque()
+        self.last_request = None
+
+    def update(self, now):
+        if self.path and os.path.exists(self.path):
+            if os.path.getsize(self.path) < self.offset:
+                # The log was rotated.
+                self.offset = 0
+            # Binary, so the offset counts bytes and seeking to it works with any text in the log.
+            with open(self.path, "rb") as log:
+                log.seek(self.offset)
+                for line in log:
+                    if not line.endswith(b"\n"):
+                        # Partly written line, read it next time.
+                        break
+                    self.offset += len(line)
+                    try:
+                        request_time = float(line.split()[0])
+                    except (ValueError, IndexError):
+                        continue
+                    self.times.append(request_time)
+                    self.last_request = max(self.last_request or 0, request_time)
+        while self.times and self.times[0] < now - RATE_WINDOW:
+            self.times.popleft()
+
+    def rate(self):
+        return len(self.times) / RATE_WINDOW
+
+
+class ModelSchedule:
+    """
+    The schedule and observed state of one model.
+    """
+    def __init__(self, config):
+        self.project = config["project"]
+        self.version = str(config["version"])
+        self.shifts = config.get("shifts", [])
+        self.tps_per_inference_unit = float(config["tps_per_inference_unit"])
+        self.expected_tps = float(config.get("expected_tps", 0))
+        self.max_inference_units = int(config.get("max_inference_units", 1))
+        self.warmup = float(config.get("warmup_minutes", DEFAULT_WARMUP_MINUTES)) * 60
+        self.idle = float(config.get("idle_minutes", DEFAULT_IDLE_MINUTES)) * 60
+        self.requests = RequestLog(config.get("request_log"))
+        self.peak_rate = 0
+        self.start_requested = None
+
+    @property
+    def name(self):
+        return f"{self.project}/{self.version}"
+
+    def inference_units(self):
+        """
+        The inference units needed for the expected or observed load.
+        """
+        load = max(self.expected_tps, self.peak_rate) * HEADROOM
+        units = math.ceil(load / self.tps_per_inference_unit) if load else 1
+        return min(max(units, 1), self.max_inference_units)
+
+    def wanted(self, now):
+        """
+        Returns True if the model should be hosted at Unix time now.
+        """
+        local_now = datetime.fromtimestamp(now)
+        if in_shift(self.shifts, local_now) or in_shift(self.shifts, local_now + timedelta(seconds=self.warmup)):
+            return True
+        return self.requests.last_request is not None and now - self.requests.last_request < self.idle
+
+
+class Scheduler:
+    """
+    Starts and stops models according to their schedules.
+    """
+    def __init__(self, orchestrator, models, dry_run=False):
+        self.orchestrator = orchestrator
+        self.models = models
+        self.dry_run = dry_run
+
+    def tick(self, now=None):
+        """
+        Checks every model once. Returns a list of (model name, action) tuples.
+        """
+        now = now or time.time()
+        actions = []
+        for model in self.models:
+            model.requests.update(now)
+            model.peak_rate = max(model.peak_rate * 0.99, model.requests.rate())
+            try:
+                status = self.orchestrator.call(
+                    "describe_model", ProjectName=model.project,
+                    ModelVersion=model.version)["ModelDescription"]["Status"]
+            except (ClientError, BotoCoreError) as error:
+                logger.error("Couldn't describe %s: %s", model.name, error)
+                continue
+
+            if status == "HOSTED" and model.start_requested is not None:
+                # Learn how long the model takes to warm up.
+                measured = now - model.start_requested
+                model.warmup = 0.5 * model.warmup + 0.5 * measured
+                model.start_requested = None
+                logger.info("%s took %.0fs to start", model.name, measured)
+
+            wanted = model.wanted(now)
+            try:
+                if wanted and status in ("TRAINED", "HOSTING_FAILED"):
+                    units = model.inference_units()
+                    action = f"start with {units} inference units"
+                    if not self.dry_run:
+                        self.orchestrator.call("start_model", ProjectName=model.project,
+                                               ModelVersion=model.version, MinInferenceUnits=units,
+                                               MaxInferenceUnits=model.max_inference_units)
+                        model.start_requested = now
+                    actions.append((model.name, action))
+                elif not wanted and status == "HOSTED":
+                    action = "stop"
+                    if not self.dry_run:
+                        self.orchestrator.call("stop_model", ProjectName=model.project,
+                                               ModelVersion=model.version)
+                    actions.append((model.name, action))
+            except (ClientError, BotoCoreError) as error:
+                # For example throttling, or a conflict with a start or stop already in progress.
+                # The model is checked again on the next tick.
+                logger.error("%s: couldn't %s: %s", model.name, action, error)
+        for name, action in actions:
+            logger.info("%s: %s", name, action)
+        return actions
+
+    def run(self, interval=DEFAULT_INTERVAL):
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                # Keep the daemon running, the next tick checks every model again.
+                logger.exception("Scheduler check failed")
+            time.sleep(interval)
+
+
+def main():
+    """
+    Entry point for the scheduler daemon.
+    """
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(
+        description="Starts and stops hosted Lookout for Vision models based on shifts and request rate.")
+    parser.add_argument("config", help="The YAML file describing the models.")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help="Seconds between checks.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Log the actions without starting or stopping models.")
+    parser.add_argument("--region", help="The AWS Region.")
+    parser.add_argument("--endpoint-url", help="A lookoutvision endpoint to use instead of AWS, such as a local stand-in.")
+    args = parser.parse_args()
+
+    with open(args.config, encoding="utf-8") as file:
+        config = yaml.safe_load(file)
+    client = boto3.client("lookoutvision", args.region, endpoint_url=args.endpoint_url)
+    scheduler = Scheduler(ProjectOrchestrator(client),
+                          [ModelSchedule(model) for model in config["models"]], args.dry_run)
+    scheduler.run(args.interval)
+
+
+if __name__ == "__main__":
+    main()
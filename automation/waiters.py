@@ -0,0 +1,213 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Waits for Amazon Lookout for Vision datasets and models to reach a status,
+such as CREATE_COMPLETE, TRAINED or HOSTED. Describe calls are made with
+exponential backoff and jitter instead of a fixed polling interval, and any
+number of waits share one thread pool and one scheduling loop.
+
+Works with any boto3 lookoutvision client, including one wrapped in a
+botocore Stubber or pointed at a local endpoint.
+"""
+
+import heapq
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+DEFAULT_TIMEOUT = 3 * 60 * 60
+DEFAULT_BASE_DELAY = 5
+DEFAULT_MAX_DELAY = 120
+DEFAULT_MAX_WORKERS = 8
+
+THROTTLING_ERRORS = ("ThrottlingException", "TooManyRequestsException")
+
+MODEL_FAILURE_STATUSES = ("TRAINING_FAILED", "HOSTING_FAILED", "DELETING")
+DATASET_FAILURE_STATUSES = ("CREATE_FAILED", "UPDATE_FAILED_ROLLBACK_COMPLETE",
+                            "DELETE_COMPLETE", "DELETE_FAILED")
+
+
+logger = logging.getLogger(__name__)
+
+
+class WaiterError(Exception):
+    """
+    Raised when a resource reaches a failure status or the wait times out.
+    """
+    def __init__(self, name, status, message):
+        super().__init__(f"{name}: {message} (status {status})")
+        self.name = name
+        self.status = status
+
+
+class StatusWait:
+    """
+    A resource to wait for.
+    name: A name for the resource, used in results and progress callbacks.
+    describe: A callable returning the current status of the resource.
+    target_statuses: The statuses that complete the wait.
+    failure_statuses: The statuses that fail the wait.
+    """
+    def __init__(self, name, describe, target_statuses, failure_statuses=()):
+        self.name = name
+        self.describe = describe
+        self.target_statuses = tuple(target_statuses)
+        self.failure_statuses = tuple(failure_statuses)
+
+
+def model_wait(client, project_name, model_version, target_status):
+    """
+    Creates a wait for a model version to reach a status such as TRAINED or HOSTED.
+    param client: A boto3 lookoutvision client.
+    param project_name: The project that contains the model.
+    param model_version: The model version.
+    param target_status: The status to wait for.
+    """
+    def describe():
+        response = client.describe_model(ProjectName=project_name, ModelVersion=model_version)
+        return response["ModelDescription"]["Status"]
+
+    failure_statuses = [status for status in MODEL_FAILURE_STATUSES if status != target_status]
+    return StatusWait(f"{project_name}/{model_version}", describe, [target_status], failure_statuses)
+
+
+def dataset_wait(client, project_name, dataset_type):
+    """
+    Creates a wait for a dataset to finish creating or updating.
+    param client: A boto3 lookoutvision client.
+    param project_name: The project that contains the dataset.
+    param dataset_type: The dataset type, train or test.
+    """
+    def describe():
+        response = client.describe_dataset(ProjectName=project_name, DatasetType=dataset_type)
+        return response["DatasetDescription"]["Status"]
+
+    return StatusWait(f"{project_name}/{dataset_type}", describe,
+                      ["CREATE_COMPLETE", "UPDATE_COMPLETE"], DATASET_FAILURE_STATUSES)
+
+
+class RateLimiter:
+    """
+    Spaces calls from all threads at least 1 / rate seconds apart.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+def backoff_delay(attempt, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    """
+    Gets the delay before the next describe call, using exponential backoff
+    with jitter so that many waits don't poll in lock step.
+    param attempt: The number of describe calls made so far.
+    """
+    delay = min(max_delay, base_delay * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+def wait_for_all(waits, timeout=DEFAULT_TIMEOUT, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY, max_workers=DEFAULT_MAX_WORKERS,
+                 on_progress=None):
+    """
+    Waits for all resources to reach a target or failure status, or time out.
+    param waits: A list of StatusWait objects.
+    param timeout: The maximum time to wait for each resource, in seconds.
+    param base_delay: The delay before the second describe call, in seconds.
+    param max_delay: The maximum delay between describe calls, in seconds.
+    param max_workers: The number of describe calls made concurrently.
+    param on_progress: Optional callable, called with the resource name, its
+    status and the elapsed time after every describe call.
+    Returns a dictionary of resource name to final status or WaiterError.
+    """
+    start_time = time.time()
+    deadline = start_time + timeout
+    results = {}
+    attempts = {status_wait.name: 0 for status_wait in waits}
+    # Heap of (next describe time, index into waits).
+    schedule = [(start_time, index) for index in range(len(waits))]
+    heapq.heapify(schedule)
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while schedule or in_flight:
+            now = time.time()
+            while schedule and schedule[0][0] <= now:
+                _, index = heapq.heappop(schedule)
+                in_flight[executor.submit(waits[index].describe)] = index
+
+            next_time = schedule[0][0] if schedule else None
+            wait_time = max(0, next_time - time.time()) if next_time is not None else None
+            if not in_flight:
+                time.sleep(wait_time)
+                continue
+            done, _ = wait(in_flight, timeout=wait_time, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                index = in_flight.pop(future)
+                status_wait = waits[index]
+                name = status_wait.name
+                attempts[name] += 1
+                try:
+                    status = future.result()
+                except ClientError as error:
+                    if error.response["Error"]["Code"] not in THROTTLING_ERRORS:
+                        results[name] = WaiterError(name, None, str(error))
+                        continue
+                    # Throttled, back off harder and try again.
+                    status = None
+                    attempts[name] += 1
+                    logger.info("Describe throttled for %s", name)
+                except BotoCoreError as error:
+                    # For example a connection error, it fails this wait but not the others.
+                    results[name] = WaiterError(name, None, str(error))
+                    continue
+
+                if on_progress is not None and status is not None:
+                    on_progress(name, status, time.time() - start_time)
+
+                if status in status_wait.target_statuses:
+                    results[name] = status
+                elif status in status_wait.failure_statuses:
+                    results[name] = WaiterError(name, status, "Failure status")
+                elif time.time() >= deadline:
+                    results[name] = WaiterError(name, status, f"Timed out after {timeout}s")
+                else:
+                    delay = backoff_delay(attempts[name] - 1, base_delay, max_delay)
+                    next_describe = min(time.time() + delay, deadline)
+                    heapq.heappush(schedule, (next_describe, index))
+
+    return results
+
+
+def wait_for_status(status_wait, **kwargs):
+    """
+    Waits for a single resource. Takes the same keyword arguments as wait_for_all.
+    Returns the final status, or raises WaiterError.
+    """
+    result = wait_for_all([status_wait], **kwargs)[status_wait.name]
+    if isinstance(result, WaiterError):
+        raise result
+    return result
+
+
+def print_progress(name, status, elapsed):
+    """
+    A progress callback that prints the status of each resource.
+    """
+    print(f"{name}: {status} ({elapsed:.0f}s)")
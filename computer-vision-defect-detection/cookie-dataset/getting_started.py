@@ -14,13 +14,50 @@ import argparse
 import sys
 import json
 import os
+import hashlib
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import boto3
 
 from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+
+from manifests import read_manifest, write_manifest, rebase_manifest_line
 
 TEMPLATE_MANIFEST_LOCATION = "manifests/template.manifest"
 TRAIN_MANIFEST_LOCATION = "manifests/train.manifest"
+# Images added with incremental_dataset.py. New JSON lines go to a log, which is hidden so it
+# isn't uploaded, and are compacted into a manifest of all added lines. Both are folded into
+# the train manifest whenever it is created, so the added labels survive a rebuild.
+LOG_MANIFEST_LOCATION = "manifests/.train.log.manifest"
+COMPACTED_MANIFEST_LOCATION = "manifests/train.compacted.manifest"
+
+DEFAULT_PROFILE = "lookoutvision-access"
+
+# Hidden files aren't uploaded, so the sync state can live in the dataset folder.
+SYNC_STATE_FILE = ".sync-state.json"
+
+# Upload tuning. Dataset images are mostly small, so most of the speed up
+# comes from uploading many files at once. Large files still use multipart.
+UPLOAD_MAX_WORKERS = 16
+UPLOAD_MAX_ATTEMPTS = 5
+UPLOAD_BASE_BACKOFF = 0.5
+UPLOAD_MAX_BACKOFF = 20
+# Only these failures are retried, errors such as AccessDenied or NoSuchBucket fail right away.
+UPLOAD_RETRY_ERRORS = ("SlowDown", "Throttling", "ThrottlingException", "RequestTimeout",
+                       "RequestTimeTooSkewed", "InternalError", "ServiceUnavailable")
+PROGRESS_INTERVAL = 5
+TRANSFER_MAX_CONCURRENCY = 4
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=TRANSFER_MAX_CONCURRENCY,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -43,51 +80,66 @@ def create_train_manifest(local_path, s3_path):
     template_manifest = Path(local_path) / TEMPLATE_MANIFEST_LOCATION
     getting_started_manifest = Path(local_path) / TRAIN_MANIFEST_LOCATION
 
-    with open(template_manifest, encoding="utf-8")\
-        as template_manifest, open(getting_started_manifest, "w", encoding="utf-8")\
-            as manifest_file:
-        lines = template_manifest.readlines()
-        for line in lines:
-            json_line = json.loads(line)
-            # Update JSON for writing.
-            json_line['source-ref'] = s3_path + json_line['source-ref']
-            if 'anomaly-mask-ref' in json_line:
-                json_line['anomaly-mask-ref'] = s3_path + \
-                    json_line['anomaly-mask-ref']
-
-            # Write the updated JSON line.
-            output_json = json.dumps(json_line)
-            manifest_file.write(output_json + '\n')
-            logger.info("Writing json line: %s ", output_json)
+    # Stream the template one line at a time.
+    json_lines = (rebase_manifest_line(json_line, s3_path)
+                  for json_line in read_manifest(template_manifest))
+    line_count = write_manifest(getting_started_manifest,
+                                merge_added_lines(json_lines, read_added_lines(local_path)))
 
-        logger.info("Wrote %s JSON Lines.", len(lines))
-        logger.info("Finished: Getting started manifest file name: %s",
-                    getting_started_manifest)
+    logger.info("Wrote %s JSON Lines.", line_count)
+    logger.info("Finished: Getting started manifest file name: %s",
+                getting_started_manifest)
 
 
-def copy_local_folder_to_s3(local_path, s3_path):
+def read_added_lines(local_path):
     """
-    Copies a local folder to an S3 path.
-    param local_path: The path to the local folder.
-    param s3_path: The S3 path to copy the local folder to.
+    Gets the latest JSON line of each image added with incremental_dataset.py.
+    param local_path: The dataset folder with the manifests folder.
+    Returns a dictionary of source-ref to JSON line.
     """
+    added = {}
+    for location in (COMPACTED_MANIFEST_LOCATION, LOG_MANIFEST_LOCATION):
+        manifest_path = Path(local_path) / location
+        if manifest_path.exists():
+            for json_line in read_manifest(manifest_path):
+                added[json_line["source-ref"]] = json_line
+    return added
 
-    logger.info("Copying local folder %s to %s", local_path, s3_path)
-    session = boto3.Session(profile_name='lookoutvision-access')
-    s3_resource = session.resource('s3')
 
-    # Remove forward slash at end of s3 path, if present.
-    if not s3_path.endswith("/"):
-        s3_path = s3_path + "/"
+def merge_added_lines(json_lines, added):
+    """
+    Replaces the JSON lines of relabeled images with their added lines, then adds the new images.
+    param json_lines: An iterable of JSON line dictionaries.
+    param added: A dictionary of source-ref to JSON line, see read_added_lines.
+    Yields the merged JSON lines.
+    """
+    added = dict(added)
+    for json_line in json_lines:
+        yield added.pop(json_line["source-ref"], json_line)
+    yield from added.values()
 
-    # Get the S3 bucket name for S3 resource.
-    bucket_name, s3_folder_path = s3_path.replace("s3://", "").split("/", 1)
-    bucket = s3_resource.Bucket(bucket_name)
 
+def get_s3_client(profile_name=DEFAULT_PROFILE, endpoint_url=None, max_workers=UPLOAD_MAX_WORKERS,
+                  region_name=None):
+    """
+    Gets an S3 client sized for concurrent uploads.
+    param profile_name: The AWS credentials profile to use.
+    param endpoint_url: Optional S3 compatible endpoint, such as a local moto server.
+    param max_workers: The number of files uploaded concurrently.
+    param region_name: Optional AWS Region, instead of the profile's.
+    """
+    session = boto3.Session(profile_name=profile_name, region_name=region_name)
+    # Each file upload can use several connections for multipart transfers.
+    config = Config(max_pool_connections=max_workers * TRANSFER_MAX_CONCURRENCY)
+    return session.client('s3', endpoint_url=endpoint_url, config=config)
 
-    copied_file_count = 0
-    # Get all files in folder and upload to S3.
-    # dirs are not needed.
+
+def list_local_files(local_path):
+    """
+    Lists the files to copy from a local folder, skipping hidden files.
+    param local_path: The path to the local folder.
+    Yields the full local path and the path relative to local_path.
+    """
     local_path = Path(local_path)
     for root, dirs, files in os.walk(local_path):
 
@@ -99,15 +151,259 @@ def copy_local_folder_to_s3(local_path, s3_path):
 
             full_local_path = Path(root) / file
             partial_path = full_local_path.as_posix()[len(local_path.as_posix())+1:]
-            destination_file = s3_folder_path + partial_path
+            yield full_local_path, partial_path
+
+
+def is_retryable_upload_error(error):
+    """
+    Checks if an upload error is a throttling, server or connection error that may succeed when retried.
+    param error: The exception raised by the upload.
+    """
+    if isinstance(error, S3UploadFailedError):
+        # boto3 raises S3UploadFailedError while handling the ClientError of the failed request.
+        error = error.__cause__ or error.__context__
+    if isinstance(error, ClientError):
+        status_code = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return error.response["Error"]["Code"] in UPLOAD_RETRY_ERRORS or status_code >= 500
+    return isinstance(error, (BotoConnectionError, HTTPClientError))
 
-            bucket.upload_file(full_local_path.as_posix(), destination_file)
-            logger.info("Copied %s to %s", file, "s3://" + bucket_name + "/" + destination_file)
 
+def upload_file_with_retry(s3_client, local_file, bucket_name, key,
+                           max_attempts=UPLOAD_MAX_ATTEMPTS):
+    """
+    Uploads a file to S3, retrying throttling, server and connection errors with
+    exponential backoff and jitter.
+    param s3_client: The S3 client to use.
+    param local_file: The path of the file to upload.
+    param bucket_name: The destination bucket.
+    param key: The destination object key.
+    param max_attempts: The number of attempts before the upload error is raised.
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            s3_client.upload_file(local_file, bucket_name, key, Config=TRANSFER_CONFIG)
+            return
+        except (S3UploadFailedError, ClientError, BotoCoreError) as error:
+            if attempt == max_attempts or not is_retryable_upload_error(error):
+                raise
+            delay = min(UPLOAD_MAX_BACKOFF, UPLOAD_BASE_BACKOFF * 2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+            logger.warning("Upload of %s failed (attempt %s of %s), retrying in %.1fs: %s",
+                           local_file, attempt, max_attempts, delay, error)
+            time.sleep(delay)
+
+
+def upload_files(s3_client, bucket_name, files, max_workers=UPLOAD_MAX_WORKERS,
+                 on_uploaded=None):
+    """
+    Uploads files to S3 from a bounded thread pool and reports progress and throughput.
+    param s3_client: The S3 client to use.
+    param bucket_name: The destination bucket.
+    param files: A list of (local file path, destination key) pairs.
+    param max_workers: The number of files uploaded concurrently.
+    param on_uploaded: Optional callable, called with the local file path and key
+    of each uploaded file from the calling thread.
+    Returns the number of files and bytes copied.
+    """
+    total_files = len(files)
+    copied_file_count = 0
+    copied_bytes = 0
+    start_time = time.time()
+    last_report = start_time
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        upload_futures = {
+            executor.submit(upload_file_with_retry, s3_client, local_file,
+                            bucket_name, key): (local_file, key)
+            for local_file, key in files
+        }
+        for future in as_completed(upload_futures):
+            local_file, key = upload_futures[future]
+            try:
+                future.result()
+            except Exception:
+                # Don't start the queued uploads, only wait for the ones in progress.
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            logger.debug("Copied %s to %s", local_file, "s3://" + bucket_name + "/" + key)
+            if on_uploaded is not None:
+                on_uploaded(local_file, key)
             copied_file_count += 1
+            copied_bytes += os.path.getsize(local_file)
+
+            now = time.time()
+            if now - last_report >= PROGRESS_INTERVAL or copied_file_count == total_files:
+                last_report = now
+                elapsed = max(now - start_time, 1e-6)
+                logger.info("Copied %s of %s files (%.1f files/s, %.2f MB/s)",
+                            copied_file_count, total_files,
+                            copied_file_count / elapsed, copied_bytes / elapsed / 1e6)
+
+    return copied_file_count, copied_bytes
+
+
+def copy_local_folder_to_s3(local_path, s3_path, max_workers=UPLOAD_MAX_WORKERS,
+                            profile_name=DEFAULT_PROFILE, endpoint_url=None):
+    """
+    Copies a local folder to an S3 path.
+    param local_path: The path to the local folder.
+    param s3_path: The S3 path to copy the local folder to.
+    param max_workers: The number of files uploaded concurrently.
+    param profile_name: The AWS credentials profile to use.
+    param endpoint_url: Optional S3 compatible endpoint, such as a local moto server.
+    """
+
+    logger.info("Copying local folder %s to %s", local_path, s3_path)
+    s3_client = get_s3_client(profile_name, endpoint_url, max_workers)
+
+    # Add forward slash at end of s3 path, if missing.
+    if not s3_path.endswith("/"):
+        s3_path = s3_path + "/"
+
+    # Get the S3 bucket name and folder.
+    bucket_name, s3_folder_path = s3_path.replace("s3://", "").split("/", 1)
+
+    # Get all files in folder and upload to S3.
+    files = [(full_local_path.as_posix(), s3_folder_path + partial_path)
+             for full_local_path, partial_path in list_local_files(local_path)]
+    copied_file_count, copied_bytes = upload_files(
+        s3_client, bucket_name, files, max_workers)
 
     logger.info("Finished copying local folder %s to %s", local_path, s3_path)
-    logger.info("%s files copied.", copied_file_count)
+    logger.info("%s files copied (%s bytes).", copied_file_count, copied_bytes)
+
+def file_md5(file_path):
+    """
+    Gets the hex MD5 digest of a file, reading it in chunks.
+    param file_path: The path of the file.
+    """
+    digest = hashlib.md5()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_sync_state(state_file, s3_path):
+    """
+    Loads the local sync state index. Entries recorded for a different
+    destination are kept for their hashes but not treated as uploaded.
+    param state_file: The path of the state index.
+    param s3_path: The S3 path being synced to.
+    """
+    try:
+        with open(state_file, encoding="utf-8") as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        return {"s3_path": s3_path, "files": {}}
+
+    if state.get("s3_path") != s3_path:
+        for entry in state["files"].values():
+            entry.pop("uploaded_md5", None)
+        state["s3_path"] = s3_path
+    return state
+
+
+def save_sync_state(state_file, state):
+    """
+    Atomically writes the local sync state index.
+    param state_file: The path of the state index.
+    param state: The state to write.
+    """
+    temp_file = str(state_file) + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as file:
+        json.dump(state, file)
+    os.replace(temp_file, state_file)
+
+
+def list_remote_objects(s3_client, bucket_name, prefix):
+    """
+    Lists the objects under an S3 prefix using paginated ListObjectsV2 calls.
+    param s3_client: The S3 client to use.
+    param bucket_name: The bucket to list.
+    param prefix: The key prefix to list.
+    Returns a dictionary of object key to (size, ETag).
+    """
+    remote_objects = {}
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for s3_object in page.get("Contents", []):
+            remote_objects[s3_object["Key"]] = (s3_object["Size"],
+                                                s3_object["ETag"].strip('"'))
+    return remote_objects
+
+
+def sync_local_folder_to_s3(local_path, s3_path, max_workers=UPLOAD_MAX_WORKERS,
+                            profile_name=DEFAULT_PROFILE, endpoint_url=None,
+                            state_file=None):
+    """
+    Uploads only the new or changed files in a local folder to an S3 path.
+    A local state index records the size, modification time and MD5 of each
+    file, so unchanged files aren't re-hashed, and is updated as each upload
+    completes, so an interrupted sync resumes where it stopped.
+    param local_path: The path to the local folder.
+    param s3_path: The S3 path to sync the local folder to.
+    param max_workers: The number of files uploaded concurrently.
+    param profile_name: The AWS credentials profile to use.
+    param endpoint_url: Optional S3 compatible endpoint, such as a local moto server.
+    param state_file: The path of the state index. Defaults to SYNC_STATE_FILE
+    in the local folder.
+    """
+    logger.info("Syncing local folder %s to %s", local_path, s3_path)
+    s3_client = get_s3_client(profile_name, endpoint_url, max_workers)
+
+    # Add forward slash at end of s3 path, if missing.
+    if not s3_path.endswith("/"):
+        s3_path = s3_path + "/"
+    bucket_name, s3_folder_path = s3_path.replace("s3://", "").split("/", 1)
+
+    if state_file is None:
+        state_file = Path(local_path) / SYNC_STATE_FILE
+    state = load_sync_state(state_file, s3_path)
+    remote_objects = list_remote_objects(s3_client, bucket_name, s3_folder_path)
+
+    files = []
+    partial_paths = {}
+    local_file_count = 0
+    for full_local_path, partial_path in list_local_files(local_path):
+        local_file_count += 1
+        stat = full_local_path.stat()
+        entry = state["files"].get(partial_path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime,
+                     "md5": file_md5(full_local_path)}
+            state["files"][partial_path] = entry
+
+        key = s3_folder_path + partial_path
+        remote = remote_objects.get(key)
+        if remote is not None and remote[0] == stat.st_size:
+            # Single part uploads have the MD5 as ETag. Multipart ETags can't be
+            # compared, so rely on the hash recorded when the file was uploaded.
+            if remote[1] == entry["md5"] or entry.get("uploaded_md5") == entry["md5"]:
+                entry["uploaded_md5"] = entry["md5"]
+                continue
+        files.append((full_local_path.as_posix(), key))
+        partial_paths[full_local_path.as_posix()] = partial_path
+
+    logger.info("%s of %s files are new or changed.", len(files), local_file_count)
+    last_save = [time.time()]
+
+    def record_upload(local_file, key):
+        entry = state["files"][partial_paths[local_file]]
+        entry["uploaded_md5"] = entry["md5"]
+        if time.time() - last_save[0] >= PROGRESS_INTERVAL:
+            save_sync_state(state_file, state)
+            last_save[0] = time.time()
+
+    try:
+        copied_file_count, copied_bytes = upload_files(
+            s3_client, bucket_name, files, max_workers, record_upload)
+    finally:
+        save_sync_state(state_file, state)
+
+    logger.info("Finished syncing local folder %s to %s", local_path, s3_path)
+    logger.info("%s files copied (%s bytes).", copied_file_count, copied_bytes)
+
 
 def get_manifest_file_location(s3_path):
     """
@@ -131,6 +427,18 @@ def main():
 
     parser.add_argument(
         "s3_path", help="The destination S3 folder for the dataset files.")
+    parser.add_argument(
+        "--workers", type=int, default=UPLOAD_MAX_WORKERS,
+        help="The number of files to upload concurrently.")
+    parser.add_argument(
+        "--profile", default=DEFAULT_PROFILE,
+        help="The AWS credentials profile to use.")
+    parser.add_argument(
+        "--sync", action="store_true",
+        help="Only upload files that are new or changed since the last run.")
+    parser.add_argument(
+        "--endpoint-url",
+        help="An S3 compatible endpoint to use instead of Amazon S3, such as a local moto server.")
     args = parser.parse_args()
 
     s3_path =args.s3_path
@@ -141,13 +449,18 @@ def main():
     try:
         #Create manifest file and copy all files to S3.
         create_train_manifest(local_path, s3_path)
-        copy_local_folder_to_s3(local_path, s3_path)
+        if args.sync:
+            sync_local_folder_to_s3(local_path, s3_path, args.workers,
+                                    args.profile, args.endpoint_url)
+        else:
+            copy_local_folder_to_s3(local_path, s3_path, args.workers,
+                                    args.profile, args.endpoint_url)
 
     except FileNotFoundError as file_error:
         print(f"Couldn't open file: {file_error.filename}")
         logger.error("Couldn't open file %s", file_error.filename)
         sys.exit(1)
-    except S3UploadFailedError as s3_error:
+    except (S3UploadFailedError, ClientError, BotoCoreError) as s3_error:
         print(f"S3 Error: {s3_error}")
         logger.error("S3 Error: %s", s3_error)
         sys.exit(1)
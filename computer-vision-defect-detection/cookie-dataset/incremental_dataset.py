@@ -0,0 +1,292 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Adds newly labeled images to an Amazon Lookout for Vision training dataset
+without rebuilding it. Labeled images come from the A2I review index written
+by A2I/review_router.py, or from a folder of normal and anomaly images such as
+images flagged on an edge device.
+
+New JSON lines are appended to a hidden log next to the train manifest, and
+only the new images and masks are uploaded. Objects are named by the MD5 of
+their content, so an image that is added twice is only uploaded once. With
+--project-name the new lines are also sent to the project's dataset with
+UpdateDatasetEntries. When the log grows past a fraction of the manifest, it is
+compacted into train.compacted.manifest, keeping the latest line for each image,
+and the train manifest is rewritten with the added lines and uploaded for the
+next create_dataset. getting_started.py folds the same lines into the train
+manifest it creates, so rebuilding it doesn't drop them.
+"""
+
+import logging
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import boto3
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import BotoCoreError, ClientError
+
+from getting_started import (
+    get_s3_client, upload_files, file_md5, list_remote_objects, get_manifest_file_location,
+    read_added_lines, merge_added_lines, TRAIN_MANIFEST_LOCATION, LOG_MANIFEST_LOCATION,
+    COMPACTED_MANIFEST_LOCATION, DEFAULT_PROFILE, UPLOAD_MAX_WORKERS
+)
+from manifests import (
+    read_manifest, write_manifest, json_dumps, classification_line, add_anomaly_mask,
+    parse_color_map, NORMAL_FOLDER, ANOMALY_FOLDER, IMAGE_EXTENSIONS
+)
+
+ADDED_FOLDER = "added"
+# Compact once the log has this many lines for each line in the manifest.
+COMPACT_RATIO = 0.2
+
+
+logger = logging.getLogger(__name__)
+
+
+def review_items(review_index, image_folder):
+    """
+    Gets the completed reviews from an A2I review index.
+    param review_index: The review index file written by review_router.py.
+    param image_folder: The folder the image paths in the index are relative to.
+    Yields (image path, is anomaly, mask path) tuples.
+    """
+    records = {}
+    with open(review_index) as index_file:
+        for line in index_file:
+            if line.strip():
+                record = json.loads(line)
+                records.setdefault(record["image"], {}).update(record)
+    for image, record in records.items():
+        if record.get("status") == "Completed":
+            yield Path(image_folder) / image, record["label"] == "Anomaly", None
+
+
+def folder_items(folder, mask_folder=None):
+    """
+    Gets the images in the normal and anomaly subfolders of a folder.
+    Anomalous images get the mask with the same name and a .png extension
+    from the mask folder, if there is one.
+    Yields (image path, is anomaly, mask path) tuples.
+    """
+    for subfolder in (NORMAL_FOLDER, ANOMALY_FOLDER):
+        folder_path = Path(folder) / subfolder
+        if not folder_path.is_dir():
+            continue
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                mask_path = None
+                if subfolder == ANOMALY_FOLDER and mask_folder is not None:
+                    mask_path = Path(mask_folder) / (Path(entry.name).stem + ".png")
+                    if not mask_path.is_file():
+                        mask_path = None
+                yield Path(entry.path), subfolder == ANOMALY_FOLDER, mask_path
+
+
+def line_key(json_line):
+    return (json_line["anomaly-label"], json_line.get("anomaly-mask-ref"))
+
+
+def load_labels(manifest_paths):
+    """
+    Gets the latest label and mask of each image in manifest files.
+    Returns a dictionary of source-ref to (anomaly-label, anomaly-mask-ref).
+    """
+    labels = {}
+    for manifest_path in manifest_paths:
+        if Path(manifest_path).exists():
+            for json_line in read_manifest(manifest_path):
+                labels[json_line["source-ref"]] = line_key(json_line)
+    return labels
+
+
+def add_items(items, local_path, s3_path, color_map=None, max_workers=UPLOAD_MAX_WORKERS,
+              profile_name=DEFAULT_PROFILE, endpoint_url=None, region_name=None):
+    """
+    Uploads the new images and masks and appends their JSON lines to the log.
+    param items: (image path, is anomaly, mask path) tuples.
+    param local_path: The dataset folder with the manifests folder.
+    param s3_path: The S3 path of the dataset.
+    param color_map: The internal color map for anomaly masks.
+    Returns the new JSON lines.
+    """
+    if not s3_path.endswith("/"):
+        s3_path = s3_path + "/"
+    bucket_name, s3_folder_path = s3_path.replace("s3://", "").split("/", 1)
+    base_manifest = Path(local_path) / TRAIN_MANIFEST_LOCATION
+    compacted_manifest = Path(local_path) / COMPACTED_MANIFEST_LOCATION
+    log_manifest = Path(local_path) / LOG_MANIFEST_LOCATION
+    labels = load_labels([base_manifest, compacted_manifest, log_manifest])
+    creation_date = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+    s3_client = get_s3_client(profile_name, endpoint_url, max_workers, region_name)
+    added_prefix = s3_folder_path + ADDED_FOLDER + "/"
+    remote_objects = list_remote_objects(s3_client, bucket_name, added_prefix)
+
+    json_lines = []
+    uploads = {}
+    for image_path, is_anomaly, mask_path in items:
+        image_key = f"{added_prefix}{file_md5(image_path)}{image_path.suffix.lower()}"
+        json_line = classification_line(f"s3://{bucket_name}/{image_key}", is_anomaly, creation_date)
+        files = [(image_path, image_key)]
+        if is_anomaly and mask_path is not None:
+            mask_key = f"{added_prefix}masks/{file_md5(mask_path)}.png"
+            add_anomaly_mask(json_line, f"s3://{bucket_name}/{mask_key}", color_map or {}, creation_date)
+            files.append((mask_path, mask_key))
+        if labels.get(json_line["source-ref"]) == line_key(json_line):
+            continue
+        labels[json_line["source-ref"]] = line_key(json_line)
+        json_lines.append(json_line)
+        for local_file, key in files:
+            if key not in remote_objects:
+                uploads[key] = Path(local_file).as_posix()
+
+    logger.info("%s new or relabeled images, %s files to upload", len(json_lines), len(uploads))
+    upload_files(s3_client, bucket_name, [(local_file, key) for key, local_file in uploads.items()],
+                 max_workers)
+
+    # Append only after the uploads, so the log never refers to missing objects.
+    log_manifest.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_manifest, "ab") as log_file:
+        for json_line in json_lines:
+            log_file.write(json_dumps(json_line) + b"\n")
+    return json_lines
+
+
+def count_lines(manifest_path):
+    if not Path(manifest_path).exists():
+        return 0
+    with open(manifest_path, "rb") as manifest_file:
+        return sum(1 for line in manifest_file if line.strip())
+
+
+def needs_compaction(local_path, ratio=COMPACT_RATIO):
+    base_count = count_lines(Path(local_path) / TRAIN_MANIFEST_LOCATION)
+    log_count = count_lines(Path(local_path) / LOG_MANIFEST_LOCATION)
+    return log_count > 0 and log_count >= base_count * ratio
+
+
+def compact(local_path):
+    """
+    Merges the log into the compacted manifest of added images, keeping the
+    latest line for each image, empties the log, and rewrites the train manifest
+    with the added lines. Returns the number of lines in the train manifest.
+    """
+    base_manifest = Path(local_path) / TRAIN_MANIFEST_LOCATION
+    compacted_manifest = Path(local_path) / COMPACTED_MANIFEST_LOCATION
+    log_manifest = Path(local_path) / LOG_MANIFEST_LOCATION
+    added = read_added_lines(local_path)
+
+    temp_manifest = compacted_manifest.with_suffix(".tmp")
+    write_manifest(temp_manifest, added.values())
+    os.replace(temp_manifest, compacted_manifest)
+    # The log is only emptied once its lines are in the compacted manifest.
+    open(log_manifest, "wb").close()
+    logger.info("Compacted %s into %s added JSON lines", log_manifest, len(added))
+
+    temp_manifest = base_manifest.with_suffix(".tmp")
+    base_lines = read_manifest(base_manifest) if base_manifest.exists() else ()
+    line_count = write_manifest(temp_manifest, merge_added_lines(base_lines, added))
+    os.replace(temp_manifest, base_manifest)
+    return line_count
+
+
+def upload_manifest(local_path, s3_path, profile_name=DEFAULT_PROFILE, endpoint_url=None, region_name=None):
+    """
+    Uploads the train manifest with the added images to its location under the S3 path.
+    """
+    bucket_name, key = get_manifest_file_location(s3_path).replace("s3://", "").split("/", 1)
+    s3_client = get_s3_client(profile_name, endpoint_url, max_workers=1, region_name=region_name)
+    upload_files(s3_client, bucket_name, [((Path(local_path) / TRAIN_MANIFEST_LOCATION).as_posix(), key)], 1)
+    return f"s3://{bucket_name}/{key}"
+
+
+def update_dataset(project_name, json_lines, dataset_type="train", profile_name=DEFAULT_PROFILE,
+                   endpoint_url=None, region_name=None):
+    """
+    Sends new JSON lines to a project's dataset with UpdateDatasetEntries.
+    param endpoint_url: Optional lookoutvision endpoint, such as a local stand-in.
+    param region_name: Optional AWS Region, instead of the profile's.
+    """
+    session = boto3.Session(profile_name=profile_name, region_name=region_name)
+    client = session.client("lookoutvision", endpoint_url=endpoint_url)
+    changes = b"\n".join(json_dumps(json_line) for json_line in json_lines)
+    response = client.update_dataset_entries(ProjectName=project_name, DatasetType=dataset_type,
+                                             Changes=changes)
+    logger.info("Updated %s dataset of %s: %s", dataset_type, project_name, response["Status"])
+
+
+def main():
+    """
+    Entry point for adding labeled images to a dataset.
+    """
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(
+        description="Adds newly labeled images to a Lookout for Vision training dataset.")
+    parser.add_argument("local_path", help="The dataset folder with the manifests folder.")
+    parser.add_argument("s3_path", help="The S3 path of the dataset.")
+    parser.add_argument("--reviews", help="An A2I review index written by review_router.py.")
+    parser.add_argument("--review-images", help="The folder the image paths in the review index are relative to.")
+    parser.add_argument("--folder", help="A folder with normal and anomaly subfolders of labeled images.")
+    parser.add_argument("--mask-folder", help="A folder with anomaly masks for the images in --folder.")
+    parser.add_argument("--class", dest="classes", action="append",
+                        help="An anomaly class and its mask color, for example cracked:#23A436. Repeat for each class.")
+    parser.add_argument("--project-name", help="Also send the new lines to this project's train dataset.")
+    parser.add_argument("--compact", action="store_true",
+                        help="Compact the log into the manifest even if it is small.")
+    parser.add_argument("--workers", type=int, default=UPLOAD_MAX_WORKERS,
+                        help="The number of files uploaded concurrently.")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, help="The AWS credentials profile to use.")
+    parser.add_argument("--endpoint-url", help="An S3 compatible endpoint to use instead of AWS.")
+    parser.add_argument("--lookoutvision-endpoint-url",
+                        help="A lookoutvision endpoint to use instead of AWS with --project-name.")
+    parser.add_argument("--region", help="The AWS Region, instead of the profile's.")
+    args = parser.parse_args()
+
+    try:
+        items = []
+        if args.reviews:
+            items.extend(review_items(args.reviews, args.review_images or "."))
+        if args.folder:
+            items.extend(folder_items(args.folder, args.mask_folder))
+
+        json_lines = add_items(items, args.local_path, args.s3_path, parse_color_map(args.classes),
+                               args.workers, args.profile, args.endpoint_url, args.region)
+        print(f"Added {len(json_lines)} JSON lines to {Path(args.local_path) / LOG_MANIFEST_LOCATION}")
+
+        if args.project_name and json_lines:
+            try:
+                update_dataset(args.project_name, json_lines, profile_name=args.profile,
+                               endpoint_url=args.lookoutvision_endpoint_url, region_name=args.region)
+            except (ClientError, BotoCoreError) as error:
+                # The lines are in the log, so the next create_dataset still gets them.
+                print(f"Couldn't update the dataset of {args.project_name}: {error}")
+                logger.error("Couldn't update the dataset of %s: %s", args.project_name, error)
+                sys.exit(1)
+        if args.compact or needs_compaction(args.local_path):
+            line_count = compact(args.local_path)
+            manifest = upload_manifest(args.local_path, args.s3_path, args.profile, args.endpoint_url,
+                                       args.region)
+            print(f"Compacted {line_count} JSON lines into {manifest}")
+
+    except FileNotFoundError as file_error:
+        print(f"Couldn't open file: {file_error.filename}")
+        logger.error("Couldn't open file %s", file_error.filename)
+        sys.exit(1)
+    except (S3UploadFailedError, ClientError, BotoCoreError) as s3_error:
+        print(f"S3 Error: {s3_error}")
+        logger.error("S3 Error: %s", s3_error)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
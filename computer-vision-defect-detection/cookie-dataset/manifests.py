@@ -0,0 +1,221 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Streaming reader and writer for Amazon Lookout for Vision manifest files.
+Manifests are processed one JSON line at a time so that memory use doesn't
+grow with the number of images. Also creates manifest files directly from a
+normal/anomaly folder layout, with optional anomaly mask references.
+"""
+
+import logging
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Log progress once per batch of lines instead of once per line.
+LOG_BATCH_SIZE = 10000
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+NORMAL_FOLDER = "normal"
+ANOMALY_FOLDER = "anomaly"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+logger = logging.getLogger(__name__)
+
+
+if orjson is not None:
+    def json_loads(line):
+        return orjson.loads(line)
+
+    def json_dumps(json_line):
+        return orjson.dumps(json_line)
+else:
+    def json_loads(line):
+        return json.loads(line)
+
+    def json_dumps(json_line):
+        return json.dumps(json_line).encode("utf-8")
+
+
+def read_manifest(manifest_path):
+    """
+    Reads a manifest file one JSON line at a time.
+    param manifest_path: The path to the manifest file.
+    Yields each JSON line as a dictionary.
+    """
+    with open(manifest_path, "rb") as manifest_file:
+        for line in manifest_file:
+            if line.strip():
+                yield json_loads(line)
+
+
+def write_manifest(manifest_path, json_lines, log_batch_size=LOG_BATCH_SIZE):
+    """
+    Writes JSON lines to a manifest file as they are produced.
+    param manifest_path: The path to the manifest file.
+    param json_lines: An iterable of JSON line dictionaries.
+    param log_batch_size: The number of lines written between progress messages.
+    Returns the number of lines written.
+    """
+    line_count = 0
+    with open(manifest_path, "wb", buffering=WRITE_BUFFER_SIZE) as manifest_file:
+        for json_line in json_lines:
+            manifest_file.write(json_dumps(json_line) + b"\n")
+            line_count += 1
+            if line_count % log_batch_size == 0:
+                logger.info("Wrote %s JSON lines to %s", line_count, manifest_path)
+            else:
+                logger.debug("Writing json line: %s", json_line)
+    return line_count
+
+
+def rebase_manifest_line(json_line, s3_path):
+    """
+    Prefixes the image and anomaly mask references of a JSON line with an S3 path.
+    param json_line: The JSON line dictionary to update.
+    param s3_path: The S3 path, ending with a forward slash.
+    """
+    json_line['source-ref'] = s3_path + json_line['source-ref']
+    if 'anomaly-mask-ref' in json_line:
+        json_line['anomaly-mask-ref'] = s3_path + json_line['anomaly-mask-ref']
+    return json_line
+
+
+def classification_line(source_ref, is_anomaly, creation_date):
+    """
+    Creates an image classification JSON line.
+    param source_ref: The S3 location of the image.
+    param is_anomaly: True if the image is anomalous.
+    param creation_date: The creation date to record in the metadata.
+    """
+    return {
+        "source-ref": source_ref,
+        "anomaly-label": 1 if is_anomaly else 0,
+        "anomaly-label-metadata": {
+            "job-name": "anomaly-label",
+            "class-name": ANOMALY_FOLDER if is_anomaly else NORMAL_FOLDER,
+            "human-annotated": "yes",
+            "creation-date": creation_date,
+            "type": "groundtruth/image-classification"
+        }
+    }
+
+
+def add_anomaly_mask(json_line, mask_ref, color_map, creation_date):
+    """
+    Adds an anomaly mask reference to an image classification JSON line.
+    param json_line: The JSON line dictionary to update.
+    param mask_ref: The S3 location of the anomaly mask image.
+    param color_map: The internal color map, for example
+    {"0": {"class-name": "cracked", "hex-color": "#23A436"}}.
+    param creation_date: The creation date to record in the metadata.
+    """
+    json_line["anomaly-mask-ref"] = mask_ref
+    json_line["anomaly-mask-ref-metadata"] = {
+        "internal-color-map": color_map,
+        "job-name": "labeling-job/object-mask-ref",
+        "human-annotated": "yes",
+        "creation-date": creation_date,
+        "type": "groundtruth/semantic-segmentation"
+    }
+    return json_line
+
+
+def folder_manifest_lines(local_path, s3_path, image_folder=".", mask_folder=None,
+                          color_map=None):
+    """
+    Creates JSON lines for the images in the normal and anomaly subfolders of
+    an image folder. Anomalous images get an anomaly mask reference if a mask
+    with the same name and a .png extension exists in the mask folder.
+    param local_path: The local folder that is copied to s3_path.
+    param s3_path: The S3 path that local_path is copied to.
+    param image_folder: The image folder, relative to local_path.
+    param mask_folder: Optional mask folder, relative to local_path.
+    param color_map: The internal color map for anomaly masks.
+    Yields each JSON line as a dictionary.
+    """
+    if not s3_path.endswith("/"):
+        s3_path = s3_path + "/"
+    local_path = Path(local_path)
+    creation_date = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+    for folder in (NORMAL_FOLDER, ANOMALY_FOLDER):
+        folder_path = local_path / image_folder / folder
+        if not folder_path.is_dir():
+            logger.info("No %s folder in %s", folder, local_path / image_folder)
+            continue
+
+        # scandir doesn't build a list of the folder contents.
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                relative_path = Path(entry.path).relative_to(local_path).as_posix()
+                json_line = classification_line(
+                    s3_path + relative_path, folder == ANOMALY_FOLDER, creation_date)
+
+                if folder == ANOMALY_FOLDER and mask_folder is not None:
+                    mask_path = local_path / mask_folder / (Path(entry.name).stem + ".png")
+                    if mask_path.is_file():
+                        add_anomaly_mask(json_line,
+                                         s3_path + mask_path.relative_to(local_path).as_posix(),
+                                         color_map or {}, creation_date)
+                yield json_line
+
+
+def parse_color_map(classes):
+    """
+    Creates an internal color map from class descriptions such as "cracked:#23A436".
+    param classes: A list of class descriptions.
+    """
+    color_map = {}
+    for index, description in enumerate(classes or []):
+        class_name, hex_color = description.split(":")
+        color_map[str(index)] = {"class-name": class_name, "hex-color": hex_color}
+    return color_map
+
+
+def main():
+    """
+    Entry point for creating a manifest file from a folder layout.
+    """
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(
+        description="Creates a manifest file from normal and anomaly image folders.")
+    parser.add_argument(
+        "local_path", help="The local folder that is copied to the S3 path.")
+    parser.add_argument(
+        "s3_path", help="The S3 path that the local folder is copied to.")
+    parser.add_argument(
+        "manifest", help="The manifest file to create.")
+    parser.add_argument(
+        "--image-folder", default=".",
+        help="The folder, relative to local_path, containing the normal and anomaly folders.")
+    parser.add_argument(
+        "--mask-folder",
+        help="The folder, relative to local_path, containing anomaly masks.")
+    parser.add_argument(
+        "--class", dest="classes", action="append",
+        help="An anomaly class and its mask color, for example cracked:#23A436. Repeat for each class.")
+    args = parser.parse_args()
+
+    line_count = write_manifest(args.manifest, folder_manifest_lines(
+        args.local_path, args.s3_path, args.image_folder, args.mask_folder,
+        parse_color_map(args.classes)))
+    print(f"Wrote {line_count} JSON lines to {args.manifest}")
+
+
+if __name__ == "__main__":
+    main()
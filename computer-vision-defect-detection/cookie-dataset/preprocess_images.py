@@ -0,0 +1,249 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Normalizes a folder of images before upload or inference: crops each image
+to a region of interest, resizes it to a target resolution and re-encodes it.
+Images keep their names and are encoded in the format of their extension, so
+manifests that refer to them stay valid. --jpeg re-encodes every image as
+JPEG instead, which changes .png and .bmp names to .jpg. Anomaly masks can be
+processed the same way with --masks, which uses nearest neighbour resizing
+and lossless PNG so mask colors are kept.
+Images are processed in a process pool. A content hash cache next to the
+output folder skips inputs that haven't changed since the last run. Files
+that can't be read as images are logged and skipped, and the others are
+still processed and cached.
+"""
+
+import logging
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+# Written next to the output folder, not in it, so tools that read every file in the
+# output folder, such as getting_started.py and inference-units/tps.py, only see images.
+CACHE_SUFFIX = ".preprocess-cache.json"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+IMAGE_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".bmp": "BMP"}
+DEFAULT_QUALITY = 90
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_size(size):
+    """
+    Parses a size such as 1024x768 into a (width, height) tuple.
+    """
+    width, height = size.lower().split("x")
+    return int(width), int(height)
+
+
+def parse_roi(roi):
+    """
+    Parses a region of interest such as 280,50,620,400 (left, top, width, height)
+    into a PIL crop box.
+    """
+    left, top, width, height = (int(value) for value in roi.split(","))
+    return left, top, left + width, top + height
+
+
+def output_path(relative_path, settings):
+    """
+    Gets the output path for an input path, relative to the output folder.
+    The name is kept, except that masks are always PNG and --jpeg changes
+    image extensions to .jpg.
+    """
+    relative_path = Path(relative_path)
+    if settings["masks"]:
+        return relative_path.with_suffix(".png")
+    if settings.get("jpeg") and IMAGE_FORMATS[relative_path.suffix.lower()] != "JPEG":
+        return relative_path.with_suffix(".jpg")
+    return relative_path
+
+
+def preprocess_image(task):
+    """
+    Crops, resizes and re-encodes one image. Runs in a worker process.
+    param task: A tuple of (input folder, output folder, relative path,
+    settings, cached input hash or None).
+    Returns a tuple of (relative path, input hash, input bytes, output bytes,
+    status, error), where status is processed, skipped or failed.
+    """
+    input_folder, output_folder, relative_path, settings, cached_hash = task
+    try:
+        return preprocess_file(input_folder, output_folder, relative_path, settings, cached_hash)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        # For example a corrupt or truncated image, it fails this file but not the others.
+        return relative_path, None, 0, 0, "failed", str(error)
+
+
+def preprocess_file(input_folder, output_folder, relative_path, settings, cached_hash):
+    """
+    Does the work of preprocess_image, raising the error if the file can't be processed.
+    """
+    with open(Path(input_folder) / relative_path, "rb") as image_file:
+        data = image_file.read()
+    input_hash = hashlib.sha256(data).hexdigest()
+    destination_path = output_path(relative_path, settings)
+    destination = Path(output_folder) / destination_path
+
+    if input_hash == cached_hash and destination.exists():
+        return relative_path, input_hash, len(data), destination.stat().st_size, "skipped", None
+
+    with Image.open(io.BytesIO(data)) as image:
+        if settings["masks"]:
+            image = image.convert("RGBA").convert("RGB")
+        else:
+            image = image.convert("RGB")
+        if settings["roi"]:
+            image = image.crop(settings["roi"])
+        if settings["size"] and image.size != tuple(settings["size"]):
+            resample = Image.NEAREST if settings["masks"] else Image.LANCZOS
+            image = image.resize(tuple(settings["size"]), resample)
+
+        output = io.BytesIO()
+        image_format = IMAGE_FORMATS[destination_path.suffix.lower()]
+        if image_format == "JPEG":
+            image.save(output, format="JPEG", quality=settings["quality"], optimize=True)
+        elif image_format == "PNG":
+            image.save(output, format="PNG", optimize=True)
+        else:
+            image.save(output, format=image_format)
+
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    with open(destination, "wb") as output_file:
+        output_file.write(output.getbuffer())
+    return relative_path, input_hash, len(data), output.tell(), "processed", None
+
+
+def load_cache(cache_file, settings):
+    """
+    Loads the content hash cache. The cache is discarded if the settings changed.
+    """
+    try:
+        with open(cache_file, encoding="utf-8") as file:
+            cache = json.load(file)
+    except FileNotFoundError:
+        return {}
+    if cache.get("settings") != settings:
+        logger.info("Settings changed since the last run, processing all images.")
+        return {}
+    return cache.get("files", {})
+
+
+def default_cache_file(output_folder):
+    """
+    Gets the cache path for an output folder, for example images-small.preprocess-cache.json.
+    """
+    output_folder = Path(output_folder).resolve()
+    return output_folder.with_name(output_folder.name + CACHE_SUFFIX)
+
+
+def preprocess_folder(input_folder, output_folder, size=None, roi=None,
+                      quality=DEFAULT_QUALITY, masks=False, max_workers=None, cache_file=None,
+                      jpeg=False):
+    """
+    Preprocesses all images in a folder tree into an output folder with the same layout.
+    param input_folder: The folder containing the images.
+    param output_folder: The folder to write the processed images to.
+    param size: Optional (width, height) to resize images to.
+    param roi: Optional (left, top, right, bottom) crop box, applied before resizing.
+    param quality: The JPEG quality.
+    param masks: True if the images are anomaly masks.
+    param max_workers: The number of worker processes. Defaults to the CPU count.
+    param cache_file: The content hash cache. Defaults to default_cache_file(output_folder).
+    param jpeg: True to re-encode all images as JPEG, renaming .png and .bmp files to .jpg.
+    Returns a dictionary with the processed, skipped, failed, input byte and output byte counts.
+    """
+    start_time = time.time()
+    settings = {"size": list(size) if size else None, "roi": list(roi) if roi else None,
+                "quality": quality, "masks": masks, "jpeg": jpeg}
+    Path(output_folder).mkdir(parents=True, exist_ok=True)
+    cache_file = cache_file or default_cache_file(output_folder)
+    cache = load_cache(cache_file, settings)
+
+    tasks = []
+    for root, dirs, files in os.walk(input_folder):
+        for file in files:
+            if file.startswith(".") or not file.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            relative_path = (Path(root) / file).relative_to(input_folder).as_posix()
+            tasks.append((str(input_folder), str(output_folder), relative_path, settings,
+                          cache.get(relative_path, {}).get("hash")))
+
+    stats = {"processed": 0, "skipped": 0, "failed": 0, "input_bytes": 0, "output_bytes": 0}
+    files = {}
+    max_workers = max_workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for relative_path, input_hash, input_bytes, output_bytes, status, error in executor.map(
+                preprocess_image, tasks, chunksize=max(1, len(tasks) // (max_workers * 4))):
+            stats[status] += 1
+            if status == "failed":
+                logger.error("Couldn't process %s: %s", relative_path, error)
+                continue
+            files[relative_path] = {"hash": input_hash}
+            stats["input_bytes"] += input_bytes
+            stats["output_bytes"] += output_bytes
+
+    with open(cache_file, "w", encoding="utf-8") as file:
+        json.dump({"settings": settings, "files": files}, file)
+
+    logger.info("Processed %s images, skipped %s unchanged images, %s failed in %.2fs.",
+                stats["processed"], stats["skipped"], stats["failed"], time.time() - start_time)
+    return stats
+
+
+def main():
+    """
+    Entry point for the image preprocessing script.
+    """
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(
+        description="Crops, resizes and re-encodes a folder of images.")
+    parser.add_argument("input_folder", help="The folder containing the images.")
+    parser.add_argument("output_folder", help="The folder to write the processed images to.")
+    parser.add_argument("--size", type=parse_size, help="The target resolution, for example 1024x768.")
+    parser.add_argument("--roi", type=parse_roi,
+                        help="The region of interest to crop to before resizing, as left,top,width,height.")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY, help="The JPEG quality (1-95).")
+    parser.add_argument("--jpeg", action="store_true",
+                        help="Re-encode all images as JPEG. Renames .png and .bmp images to .jpg, "
+                             "so manifests that refer to them must be updated.")
+    parser.add_argument("--masks", action="store_true",
+                        help="The images are anomaly masks. Keeps exact colors and writes PNG, "
+                             "renaming masks that aren't .png.")
+    parser.add_argument("--workers", type=int, help="The number of worker processes.")
+    parser.add_argument("--cache",
+                        help="The content hash cache file. Defaults to <output_folder>" + CACHE_SUFFIX + ".")
+    args = parser.parse_args()
+
+    try:
+        stats = preprocess_folder(args.input_folder, args.output_folder, args.size, args.roi,
+                                  args.quality, args.masks, args.workers, args.cache, args.jpeg)
+    except FileNotFoundError as file_error:
+        print(f"Couldn't open file: {file_error.filename}")
+        logger.error("Couldn't open file %s", file_error.filename)
+        sys.exit(1)
+
+    saved = stats["input_bytes"] - stats["output_bytes"]
+    print(f"Input: {stats['input_bytes']} bytes, output: {stats['output_bytes']} bytes, "
+          f"saved: {saved} bytes ({100 * saved / max(stats['input_bytes'], 1):.1f}%)")
+    if stats["failed"]:
+        print(f"{stats['failed']} files couldn't be processed, see the errors above.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
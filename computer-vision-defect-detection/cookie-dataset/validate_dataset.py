@@ -0,0 +1,260 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+Validates the images and anomaly masks referenced by an Amazon Lookout for
+Vision manifest before the files are uploaded and a dataset is created.
+Images and masks are decoded in a process pool and checked for:
+- Images or masks that can't be decoded.
+- Masks whose size doesn't match the image.
+- Mask colors that aren't in the manifest's internal color map.
+- Duplicate or near duplicate images, found with a perceptual hash.
+"""
+
+import logging
+import argparse
+import sys
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from manifests import read_manifest
+
+TEMPLATE_MANIFEST_LOCATION = "manifests/template.manifest"
+
+# Masks use black for pixels that aren't anomalous.
+BACKGROUND_COLOR = "#000000"
+# Images whose perceptual hashes differ by at most this many bits are reported as duplicates.
+DUPLICATE_DISTANCE = 4
+HASH_SIZE = 8
+
+
+logger = logging.getLogger(__name__)
+
+
+def hex_to_int(hex_color):
+    """
+    Converts a hex color such as #23A436 to a packed 24 bit RGB integer.
+    """
+    return int(hex_color.lstrip("#"), 16)
+
+
+def perceptual_hash(image):
+    """
+    Gets a 64 bit difference hash (dHash) of an image. Similar images have
+    hashes that differ in only a few bits.
+    param image: A PIL image.
+    """
+    pixels = np.asarray(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE),
+                                                  Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def validate_item(item):
+    """
+    Decodes and checks an image and its optional anomaly mask.
+    Runs in a worker process.
+    param item: A tuple of (image path, mask path or None, allowed mask colors).
+    Returns a tuple of (image path, list of errors, perceptual hash or None).
+    """
+    image_path, mask_path, allowed_colors = item
+    errors = []
+    image_hash = None
+
+    try:
+        with Image.open(image_path) as image:
+            image.load()
+            image_size = image.size
+            image_hash = perceptual_hash(image)
+    except (OSError, SyntaxError) as error:
+        return image_path, [f"Couldn't decode image: {error}"], None
+
+    if mask_path is not None:
+        try:
+            with Image.open(mask_path) as mask:
+                mask.load()
+                if mask.size != image_size:
+                    errors.append(f"Mask size {mask.size} doesn't match image size {image_size}")
+                # Palette masks can carry transparency, so convert through RGBA.
+                pixels = np.asarray(mask.convert("RGBA"))[..., :3].astype(np.uint32).reshape(-1, 3)
+                colors = np.unique((pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2])
+                unknown = [f"#{color:06X}" for color in colors if int(color) not in allowed_colors]
+                if unknown:
+                    errors.append(f"Mask {mask_path} has colors not in the color map: {unknown[:10]}")
+        except (OSError, SyntaxError) as error:
+            errors.append(f"Couldn't decode mask {mask_path}: {error}")
+
+    return image_path, errors, image_hash
+
+
+def manifest_items(local_path, manifest, s3_path=None):
+    """
+    Gets the files to validate from a manifest.
+    param local_path: The local folder containing the dataset files.
+    param manifest: The manifest file.
+    param s3_path: The S3 path prefix to remove from references, if the
+    manifest references S3 locations instead of local relative paths.
+    Yields (image path, mask path or None, allowed mask colors) tuples.
+    """
+    local_path = Path(local_path)
+    if s3_path and not s3_path.endswith("/"):
+        s3_path = s3_path + "/"
+
+    def local_file(ref):
+        if s3_path and ref.startswith(s3_path):
+            ref = ref[len(s3_path):]
+        return str(local_path / ref)
+
+    for json_line in read_manifest(manifest):
+        mask_path = None
+        allowed_colors = frozenset()
+        if "anomaly-mask-ref" in json_line:
+            mask_path = local_file(json_line["anomaly-mask-ref"])
+            color_map = json_line.get("anomaly-mask-ref-metadata", {}).get("internal-color-map", {})
+            allowed_colors = frozenset(
+                [hex_to_int(BACKGROUND_COLOR)] +
+                [hex_to_int(entry["hex-color"]) for entry in color_map.values()])
+        yield local_file(json_line["source-ref"]), mask_path, allowed_colors
+
+
+class HashBands:
+    """
+    An index of perceptual hashes for finding near duplicates.
+    Hashes are split into max_distance + 1 bands. Hashes that differ in at most
+    max_distance bits have at least one identical band, so only hashes that
+    share a band are compared. Bands get narrower as max_distance grows, so a
+    large max_distance compares more pairs, up to all of them.
+    """
+    def __init__(self, max_distance=DUPLICATE_DISTANCE):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        # (shift, mask) of each band. The widths differ by at most a bit when 64 isn't a
+        # multiple of the band count, and bands are empty past 64.
+        self.bands = [(64 * band // bands, (1 << (64 * (band + 1) // bands - 64 * band // bands)) - 1)
+                      for band in range(bands)]
+        self.buckets = defaultdict(list)
+
+    def band_keys(self, image_hash):
+        return [(band, (image_hash >> shift) & mask) for band, (shift, mask) in enumerate(self.bands)]
+
+    def add(self, key, image_hash):
+        """
+        Adds the hash of an image.
+        param key: The image path or another key for the image.
+        """
+        for band_key in self.band_keys(image_hash):
+            self.buckets[band_key].append((key, image_hash))
+
+    def matches(self, image_hash):
+        """
+        Yields (key, distance) for each added hash at most max_distance bits from image_hash.
+        """
+        seen = set()
+        for band_key in self.band_keys(image_hash):
+            for key, other_hash in self.buckets.get(band_key, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                distance = bin(image_hash ^ other_hash).count("1")
+                if distance <= self.max_distance:
+                    yield key, distance
+
+
+def find_duplicates(image_hashes, max_distance=DUPLICATE_DISTANCE):
+    """
+    Finds pairs of images with perceptual hashes at most max_distance bits apart.
+    param image_hashes: A dictionary of image path to perceptual hash.
+    Returns a list of (image path, image path, distance) tuples.
+    """
+    bands = HashBands(max_distance)
+    duplicates = set()
+    for image_path, image_hash in image_hashes.items():
+        for other_path, distance in bands.matches(image_hash):
+            duplicates.add((min(image_path, other_path), max(image_path, other_path), distance))
+        bands.add(image_path, image_hash)
+    return sorted(duplicates)
+
+
+def validate_dataset(local_path, manifest, s3_path=None, max_workers=None):
+    """
+    Validates the images and masks referenced by a manifest.
+    param local_path: The local folder containing the dataset files.
+    param manifest: The manifest file.
+    param s3_path: Optional S3 path prefix to remove from manifest references.
+    param max_workers: The number of worker processes. Defaults to the CPU count.
+    Returns a tuple of (dictionary of image path to errors, duplicate pairs, image count).
+    """
+    start_time = time.time()
+    items = list(manifest_items(local_path, manifest, s3_path))
+    max_workers = max_workers or os.cpu_count()
+    chunksize = max(1, len(items) // (max_workers * 4))
+
+    errors = {}
+    image_hashes = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for image_path, item_errors, image_hash in executor.map(
+                validate_item, items, chunksize=chunksize):
+            if item_errors:
+                errors[image_path] = item_errors
+            if image_hash is not None:
+                image_hashes[image_path] = image_hash
+
+    duplicates = find_duplicates(image_hashes)
+    elapsed = time.time() - start_time
+    logger.info("Validated %s images in %.2fs (%.2fs per 1000 images).",
+                len(items), elapsed, elapsed * 1000 / max(len(items), 1))
+    return errors, duplicates, len(items)
+
+
+def main():
+    """
+    Entry point for the dataset validation script.
+    """
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(
+        description="Validates dataset images and anomaly masks before upload.")
+    parser.add_argument(
+        "--local-path", default=str(Path(os.getcwd()) / "dataset-files"),
+        help="The local folder containing the dataset files.")
+    parser.add_argument(
+        "--manifest",
+        help="The manifest file to validate. Defaults to the template manifest in the local folder.")
+    parser.add_argument(
+        "--s3-path",
+        help="The S3 path prefix of manifest references, if the manifest references S3 locations.")
+    parser.add_argument(
+        "--workers", type=int, help="The number of worker processes.")
+    args = parser.parse_args()
+
+    manifest = args.manifest or Path(args.local_path) / TEMPLATE_MANIFEST_LOCATION
+    try:
+        errors, duplicates, image_count = validate_dataset(
+            args.local_path, manifest, args.s3_path, args.workers)
+    except FileNotFoundError as file_error:
+        print(f"Couldn't open file: {file_error.filename}")
+        logger.error("Couldn't open file %s", file_error.filename)
+        sys.exit(1)
+
+    for image_path, image_errors in errors.items():
+        for error in image_errors:
+            print(f"ERROR {image_path}: {error}")
+    for first, second, distance in duplicates:
+        print(f"DUPLICATE {first} and {second} (hash distance {distance})")
+
+    print(f"Checked {image_count} images: {len(errors)} with errors, "
+          f"{len(duplicates)} duplicate pairs.")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
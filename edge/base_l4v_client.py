@@ -1,30 +1,103 @@
 # // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
-import time
-import numpy as np
-import cv2
-import grpc
-import edge_agent_pb2 as pb2
-from edge_agent_pb2_grpc import (
-    EdgeAgentStub
-)
+import sys
+import os
+import json
+import threading
 
-import logging
+import tracing
 
+# numpy, cv2 and grpc are imported by the functions that use them, so importing this module,
+# for example from l4v_daemon.py, stays fast. The Edge Agent channel is opened once per process.
+EDGE_AGENT_SOCKET = os.environ.get("L4V_EDGE_AGENT_SOCKET", "unix:///tmp/aws.iot.lookoutvision.EdgeAgent.sock")
 
-import sys
-import json
-import io
-from PIL import Image
-import PIL
+
+# Decision rules, see evaluation/tune_thresholds.py to tune them from past results.
+# A rules.json next to this file, or the file named by L4V_RULES, overrides the defaults.
+RULES_FILE = os.environ.get("L4V_RULES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"))
+DEFAULT_RULES = {
+    "confidence_threshold": 0.0,
+    "default_min_area": 0.01,
+    "ignore": ["background"],
+    "classes": {}
+}
+
+
+def load_rules(rules_file=RULES_FILE):
+    rules = dict(DEFAULT_RULES)
+    if os.path.exists(rules_file):
+        with open(rules_file) as f:
+            rules.update(json.load(f))
+        print("loaded decision rules from " + rules_file)
+    return rules
+
+
+rules = load_rules()
+
+# Every client imports this module, so --trace works for all of them, see tracing.py.
+tracing.enable_from_args()
+
+# Set L4V_HISTORY_DB to keep every result in a local inspection history, see inspection_history.py.
+# L4V_CAMERA names the camera the results are recorded for.
+history = None
+if os.environ.get("L4V_HISTORY_DB"):
+    import atexit
+    from inspection_history import InspectionHistory
+    history = InspectionHistory(os.environ["L4V_HISTORY_DB"])
+    atexit.register(history.close)
+
+# Set L4V_CASCADE to a classification model component trained for the same product, to classify
+# every frame first and only segment the frames that aren't clearly normal, see cascade.py.
+# The component the clients are given is the segmentation model.
+CASCADE = os.environ.get("L4V_CASCADE")
+CASCADE_RECHECK_BELOW = float(os.environ.get("L4V_CASCADE_RECHECK", "0.8"))
+
+
+_stub = None
+_stub_lock = threading.Lock()
 
 
+def get_stub():
+    global _stub
+    with _stub_lock:
+        if _stub is None:
+            import grpc
+            from edge_agent_pb2_grpc import EdgeAgentStub
+            # Images and anomaly masks of 1080p and up are larger than gRPC's default 4 MB limit.
+            _stub = EdgeAgentStub(grpc.insecure_channel(EDGE_AGENT_SOCKET, options=[
+                ("grpc.max_send_message_length", -1), ("grpc.max_receive_message_length", -1)]))
+            print("channel set")
+    return _stub
 
-def process_segmentation(img, detect_anomalies_response):
+
+def rule_defects(detect_anomaly_result):
+    """Returns the defects over the thresholds in the decision rules as a dictionary of name to hex color."""
+    defects = {}
+    confidence_ok = detect_anomaly_result.confidence >= rules["confidence_threshold"]
+    for anomaly in detect_anomaly_result.anomalies:
+        min_area = rules["classes"].get(anomaly.name, {}).get("min_area", rules["default_min_area"])
+        if confidence_ok and anomaly.pixel_anomaly.total_percentage_area > min_area:
+            # ignore tag with 'background' or any other defect listed in the rules
+            if anomaly.pixel_anomaly and anomaly.name not in rules["ignore"]:
+                defects[anomaly.name] = anomaly.pixel_anomaly.hex_color
+    return defects
+
+
+def detected_defects(detect_anomaly_result):
+    """Returns all the defects in a result that aren't ignored, over the thresholds or not, as a dictionary of name to hex color."""
+    return {anomaly.name: anomaly.pixel_anomaly.hex_color for anomaly in detect_anomaly_result.anomalies
+            if anomaly.name not in rules["ignore"]}
+
+
+@tracing.traced("process_segmentation")
+def process_segmentation(img, detect_anomalies_response, output_dir="."):
+    """
+    Saves the anomaly mask and the blended image in output_dir, and prints the defects over the thresholds.
+    Returns the defects over the thresholds as a dictionary of name to hex color.
+    """
+    import numpy as np
+    import cv2
     defects_over_threshold = {}
-    all_defects = {}
     if detect_anomalies_response.detect_anomaly_result.is_anomalous:
-        anomalies = detect_anomalies_response.detect_anomaly_result.anomalies
-
         if detect_anomalies_response.detect_anomaly_result.anomaly_mask is not None:
             if (detect_anomalies_response.detect_anomaly_result.anomaly_mask and detect_anomalies_response.detect_anomaly_result.anomaly_mask.byte_data):
                 # Anomaly mask was returned as bytes over the wire - you can also used shared memory for increased performance, see below.
@@ -41,57 +114,76 @@ def process_segmentation(img, detect_anomalies_response):
                 )
 
             # Loading predicted anomaly mask.
-            predicted_anomaly_mask = np.frombuffer(
-                predicted_anomaly_mask_buffer,
-                dtype=np.uint8,
-            ).reshape(
-                detect_anomalies_response.detect_anomaly_result.anomaly_mask.height,
-                detect_anomalies_response.detect_anomaly_result.anomaly_mask.width,
-                3,
-            )
+            with tracing.span("frombuffer"):
+                predicted_anomaly_mask = np.frombuffer(
+                    predicted_anomaly_mask_buffer,
+                    dtype=np.uint8,
+                ).reshape(
+                    detect_anomalies_response.detect_anomaly_result.anomaly_mask.height,
+                    detect_anomalies_response.detect_anomaly_result.anomaly_mask.width,
+                    3,
+                )
             # convert the mask back to BGR so it looks correct
-            predicted_anomaly_mask_bgr = cv2.cvtColor(
-                predicted_anomaly_mask, cv2.COLOR_RGB2BGR)
-            cv2.imwrite("./defectmask.png", predicted_anomaly_mask_bgr)
+            with tracing.span("cvtColor mask"):
+                predicted_anomaly_mask_bgr = cv2.cvtColor(
+                    predicted_anomaly_mask, cv2.COLOR_RGB2BGR)
+            with tracing.span("imwrite defectmask"):
+                cv2.imwrite(os.path.join(output_dir, "defectmask.png"), predicted_anomaly_mask_bgr)
 
             # we need to convert the mask and the image and blend the two together
             alpha = 0.7
             beta = 1 - alpha
-            blended = cv2.addWeighted(
-                img, alpha, predicted_anomaly_mask, beta, 0)
-            blended_bgr = cv2.cvtColor(blended, cv2.COLOR_RGB2BGR)
-            cv2.imwrite("./blended.png", blended_bgr)
-
-            for anomaly in anomalies:
-                if anomaly.pixel_anomaly.total_percentage_area > 0.01:
-                    # ignore tag with 'background' or any other defect you wish to ignore
-                    if anomaly.pixel_anomaly and anomaly.name != 'background':
-                        defects_over_threshold[anomaly.name] = anomaly.pixel_anomaly.hex_color
-                        all_defects[anomaly.name] = anomaly.pixel_anomaly.hex_color
+            with tracing.span("addWeighted"):
+                blended = cv2.addWeighted(
+                    img, alpha, predicted_anomaly_mask, beta, 0)
+            with tracing.span("cvtColor blended"):
+                blended_bgr = cv2.cvtColor(blended, cv2.COLOR_RGB2BGR)
+            with tracing.span("imwrite blended"):
+                cv2.imwrite(os.path.join(output_dir, "blended.png"), blended_bgr)
+
+            defects_over_threshold = rule_defects(detect_anomalies_response.detect_anomaly_result)
             if len(defects_over_threshold) > 0:
                 print(
-                    f"Image is anomalous, ({detect_anomalies_response.detect_anomaly_result.confidence * 100} % confidence) contains defects with total area over .1%: {defects_over_threshold}")
+                    f"Image is anomalous, ({detect_anomalies_response.detect_anomaly_result.confidence * 100} % confidence) contains defects with total area over the threshold: {defects_over_threshold}")
             else:
                 print(
-                    f"Image is anomalous, ({detect_anomalies_response.detect_anomaly_result.confidence * 100} % confidence) contains no defects with total area over .1%. Needs manual inspection for defects {all_defects}")
+                    f"Image is anomalous, ({detect_anomalies_response.detect_anomaly_result.confidence * 100} % confidence) contains no defects with total area over the threshold. Needs manual inspection for defects {detected_defects(detect_anomalies_response.detect_anomaly_result)}")
     else:
         print(f"Image is normal")
+    return defects_over_threshold
 
 
-def check_for_anomalies(img, modelName):
-    with grpc.insecure_channel("unix:///tmp/aws.iot.lookoutvision.EdgeAgent.sock") as channel:
-        print("channel set")
-        stub = EdgeAgentStub(channel)
-        h, w, c = img.shape
-        print("shape="+str(img.shape))
-        detect_anomalies_response = stub.DetectAnomalies(
+def detect_anomalies(img, modelName):
+    """Runs DetectAnomalies on an RGB image, without printing or recording the result."""
+    import edge_agent_pb2 as pb2
+    h, w, c = img.shape
+    with tracing.span("tobytes", width=w, height=h):
+        byte_data = bytes(img.tobytes())
+    with tracing.span("DetectAnomalies", model_component=modelName) as rpc_span:
+        detect_anomalies_response = get_stub().DetectAnomalies(
             pb2.DetectAnomaliesRequest(
-                model_component=sys.argv[2],
+                model_component=modelName,
                 bitmap=pb2.Bitmap(
                     width=w,
                     height=h,
-                    byte_data=bytes(img.tobytes())
+                    byte_data=byte_data
                 )
             )
         )
-        return detect_anomalies_response
+        rpc_span.set("is_anomalous", detect_anomalies_response.detect_anomaly_result.is_anomalous)
+    return detect_anomalies_response
+
+
+@tracing.traced("check_for_anomalies")
+def check_for_anomalies(img, modelName):
+    print("shape="+str(img.shape))
+    if CASCADE:
+        import cascade
+        detect_anomalies_response = cascade.for_segmenter(modelName, CASCADE, CASCADE_RECHECK_BELOW).detect(img)
+    else:
+        detect_anomalies_response = detect_anomalies(img, modelName)
+    if history is not None:
+        with tracing.span("history"):
+            history.record_result(detect_anomalies_response.detect_anomaly_result,
+                                  os.environ.get("L4V_CAMERA", "default"), modelName)
+    return detect_anomalies_response
@@ -5,6 +5,9 @@ import cv2
 from pypylon import pylon
 import platform
 import sys
+import tracing
+
+tracing.enable_from_args()
 
 
 info = pylon.DeviceInfo()
@@ -17,16 +20,19 @@ camera = pylon.InstantCamera()
 camera.Attach(tl_factory.CreateFirstDevice(info)) # change this to use device serial number
 camera.Open()
 camera.StartGrabbing(1)
-grab = camera.RetrieveResult(5000, pylon.TimeoutHandling_Return)
+with tracing.span("RetrieveResult"):
+    grab = camera.RetrieveResult(5000, pylon.TimeoutHandling_Return)
 if grab.GrabSucceeded():
     img = grab.GetArray()
     print(f'Size of image: {img.shape}')
-    image = converter.Convert(grab)
-    img = image.GetArray()
+    with tracing.span("pylon Convert"):
+        image = converter.Convert(grab)
+        img = image.GetArray()
     cv2.namedWindow('title', cv2.WINDOW_NORMAL)
     cv2.imshow('title', img)
     cv2.waitKey(0)
-    cv2.imwrite(sys.argv[2],img)
+    with tracing.span("imwrite"):
+        cv2.imwrite(sys.argv[2],img)
 
 camera.Close()
 cv2.destroyAllWindows()
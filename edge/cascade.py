@@ -0,0 +1,180 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
+import os
+import sys
+import time
+import argparse
+import threading
+
+import tracing
+from base_l4v_client import detect_anomalies, get_stub
+
+#
+# A classification-first cascade. On a line where most parts are normal, segmenting every frame
+# spends the accelerator on masks nobody looks at, and sends a full size mask back for each one.
+# The cascade sends every frame to a classification model trained on the same images, which is
+# cheaper and returns no mask, and only sends a frame to the segmentation model when the
+# classifier finds it anomalous, or normal with a confidence below recheck_below. The result of
+# a frame is the segmentation result when it was segmented and the classifier's otherwise, so
+# the cascade can replace check_for_anomalies() in the clients, for example with L4V_CASCADE.
+#
+#   cascade = Cascade("segmentation-component", "classification-component", recheck_below=0.8)
+#   detect_anomalies_response = cascade.detect(img)
+#   print(cascade.stats())
+#
+# The classifier decides which frames are ever segmented, so it must be trained for the same
+# product as the segmentation model; name it explicitly. The Edge Agent doesn't say which kind of
+# model a component is, so classifier="auto" only helps on a device with a single classifier: the
+# cascade lists the RUNNING components with ListModels on the first frame, sends the frame to each
+# of them, and uses the one component that answers without a mask or anomaly classes. It fails if
+# none or several do. Components that reject the frame, for example because they take a different
+# image size, aren't candidates.
+#
+# usage: python3 cascade.py <segmentationComponent> <image> [image ...] --classifier <component|auto> [--recheck-below 0.8]
+#        prints which model decided each image and the accelerator time per image.
+#
+AUTO = "auto"
+DEFAULT_RECHECK_BELOW = 0.8
+
+
+def running_models():
+    """Returns the names of the model components that are RUNNING on the device."""
+    import edge_agent_pb2 as pb2
+    response = get_stub().ListModels(pb2.ListModelsRequest())
+    return [model.model_component for model in response.models if model.status == pb2.RUNNING]
+
+
+def check_running(model_component):
+    import edge_agent_pb2 as pb2
+    response = get_stub().DescribeModel(pb2.DescribeModelRequest(model_component=model_component))
+    status = response.model_description.status
+    if status != pb2.RUNNING:
+        raise Exception(f"model component {model_component} is {pb2.ModelStatus.Name(status)}, "
+                        f"start it with warmup-model.py")
+
+
+def is_segmentation(detect_anomaly_result):
+    # Segmentation models return the anomaly classes, at least background, and a mask for every image.
+    return len(detect_anomaly_result.anomalies) > 0 or detect_anomaly_result.anomaly_mask.width > 0
+
+
+def find_classifier(segmenter, img):
+    """Returns the only RUNNING model component other than segmenter that classifies img without a mask."""
+    import grpc
+    classifiers = []
+    for model_component in running_models():
+        if model_component == segmenter:
+            continue
+        try:
+            detect_anomaly_result = detect_anomalies(img, model_component).detect_anomaly_result
+        except grpc.RpcError as e:
+            print(f"skipping {model_component}: {e.code().name} {e.details()}")
+            continue
+        if not is_segmentation(detect_anomaly_result):
+            classifiers.append(model_component)
+    if len(classifiers) != 1:
+        raise Exception(f"found {len(classifiers)} running classification model components {classifiers} "
+                        f"to cascade with {segmenter}, set the classifier explicitly")
+    return classifiers[0]
+
+
+class Cascade:
+
+    def __init__(self, segmenter, classifier, recheck_below=DEFAULT_RECHECK_BELOW):
+        self.segmenter = segmenter
+        self.classifier = classifier
+        self.recheck_below = recheck_below
+        self.lock = threading.Lock()
+        self.resolved = False
+        self.frames = 0
+        self.segmented = 0
+        self.rechecked = 0
+        self.classify_ms = 0.0
+        self.segment_ms = 0.0
+
+    def resolve(self, img):
+        # Done on the first frame, as the models only accept images of the size they were trained on.
+        with self.lock:
+            if self.resolved:
+                return
+            if self.classifier == AUTO:
+                self.classifier = find_classifier(self.segmenter, img)
+            check_running(self.classifier)
+            check_running(self.segmenter)
+            print(f"cascading {self.classifier} to {self.segmenter} below {self.recheck_below * 100:.0f} % confidence")
+            self.resolved = True
+
+    def detect(self, img):
+        """Runs DetectAnomalies on an RGB image through the cascade and returns the deciding response."""
+        if not self.resolved:
+            self.resolve(img)
+        with tracing.span("cascade") as cascade_span:
+            start = time.perf_counter()
+            detect_anomalies_response = detect_anomalies(img, self.classifier)
+            classified = time.perf_counter()
+            result = detect_anomalies_response.detect_anomaly_result
+            segment = result.is_anomalous or result.confidence < self.recheck_below
+            if segment:
+                detect_anomalies_response = detect_anomalies(img, self.segmenter)
+            end = time.perf_counter()
+            cascade_span.set("segmented", segment)
+        with self.lock:
+            self.frames += 1
+            self.classify_ms += (classified - start) * 1000
+            if segment:
+                self.segmented += 1
+                self.rechecked += int(not result.is_anomalous)
+                self.segment_ms += (end - classified) * 1000
+        return detect_anomalies_response
+
+    def stats(self):
+        with self.lock:
+            frames = max(self.frames, 1)
+            return {
+                "frames": self.frames,
+                "segmented": self.segmented,
+                "rechecked": self.rechecked,
+                "segmented_rate": self.segmented / frames,
+                "classify_ms": self.classify_ms / frames,
+                "segment_ms": self.segment_ms / max(self.segmented, 1),
+                "ms_per_frame": (self.classify_ms + self.segment_ms) / frames
+            }
+
+
+_cascades = {}
+_cascades_lock = threading.Lock()
+
+
+def for_segmenter(segmenter, classifier, recheck_below=DEFAULT_RECHECK_BELOW):
+    """Returns the process wide cascade for a segmentation model component."""
+    with _cascades_lock:
+        if segmenter not in _cascades:
+            _cascades[segmenter] = Cascade(segmenter, classifier, recheck_below)
+        return _cascades[segmenter]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shows how many images the classifier decides without segmentation.")
+    parser.add_argument("segmenter", help="the segmentation model component")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--classifier", required=True,
+                        help="the classification model component, or auto if it is the only one on the device")
+    parser.add_argument("--recheck-below", type=float, default=DEFAULT_RECHECK_BELOW,
+                        help="segment normal images classified with less confidence than this")
+    args = parser.parse_args()
+
+    import cv2
+    cascade = Cascade(args.segmenter, args.classifier, args.recheck_below)
+    for image in args.images:
+        img = cv2.imread(image)
+        if img is None:
+            print("unable to read " + image)
+            sys.exit(1)
+        segmented = cascade.segmented
+        result = cascade.detect(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)).detect_anomaly_result
+        print(f"{os.path.basename(image)}: {'anomalous' if result.is_anomalous else 'normal'} "
+              f"{result.confidence * 100:.1f} % by {args.segmenter if cascade.segmented > segmented else cascade.classifier}")
+    stats = cascade.stats()
+    print(f"{stats['frames']} images, {stats['segmented']} segmented ({stats['rechecked']} normal below "
+          f"{args.recheck_below * 100:.0f} % confidence): {stats['ms_per_frame']:.1f} ms per image")
+    if stats["segmented"]:
+        print(f"segmenting every image would take about {stats['segment_ms']:.1f} ms per image")
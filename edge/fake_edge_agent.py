@@ -0,0 +1,152 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
+import time
+import sys
+import os
+import hashlib
+import threading
+from concurrent import futures
+import grpc
+import edge_agent_pb2 as pb2
+from edge_agent_pb2_grpc import (
+    EdgeAgentServicer,
+    add_EdgeAgentServicer_to_server
+)
+
+#
+# A stand-in for the Lookout for Vision Edge Agent so the edge clients and benchmarks can run
+# without a Greengrass device. Model components start RUNNING and can be stopped and started.
+# DetectAnomalies takes latency_ms, runs at most concurrency requests at a time like a device
+# with limited accelerators, and returns a result derived from a hash of the image, with a
+# synthetic anomaly mask the size of the image, so the same image always gets the same result.
+# FakeClassifierComponent is a classification model: it takes classifier_latency_ms and returns
+# the same prediction without a mask or anomaly classes.
+# The cloud equivalent is local-service/mock_lookoutvision.py.
+#
+# usage: python3 fake_edge_agent.py [socket] [latency_ms] [concurrency] [anomaly_rate] [classifier_latency_ms]
+#
+DEFAULT_SOCKET = "unix:///tmp/aws.iot.lookoutvision.EdgeAgent.sock"
+ANOMALY_CLASSES = [("crack", "#23A436"), ("scratch", "#FF0000")]
+
+
+def synthetic_result(data, width, height, anomaly_rate, segmentation=True):
+    """Returns a DetectAnomalyResult for the bitmap data derived from a hash of the data."""
+    digest = hashlib.sha256(data).digest()
+    is_anomalous = digest[0] / 256 < anomaly_rate
+    confidence = 0.5 + digest[1] / 512
+    if not segmentation:
+        return pb2.DetectAnomalyResult(is_anomalous=is_anomalous, confidence=confidence)
+    mask = bytearray(width * height * 3)
+    anomalies = [pb2.Anomaly(name="background", pixel_anomaly=pb2.PixelAnomaly(
+        total_percentage_area=1.0, hex_color="#000000"))]
+    if is_anomalous:
+        name, color = ANOMALY_CLASSES[digest[2] % len(ANOMALY_CLASSES)]
+        rgb = bytes.fromhex(color.lstrip("#"))
+        # A rectangle at a position and size taken from the hash.
+        left, top = digest[3] * width // 512, digest[4] * height // 512
+        box_width = max(1, (4 + digest[5] % 12) * width // 64)
+        box_height = max(1, (4 + digest[6] % 12) * height // 64)
+        for row in range(top, top + box_height):
+            start = (row * width + left) * 3
+            mask[start:start + box_width * 3] = rgb * box_width
+        area = box_width * box_height / (width * height)
+        anomalies = [
+            pb2.Anomaly(name="background", pixel_anomaly=pb2.PixelAnomaly(
+                total_percentage_area=1.0 - area, hex_color="#000000")),
+            pb2.Anomaly(name=name, pixel_anomaly=pb2.PixelAnomaly(
+                total_percentage_area=area, hex_color=color)),
+        ]
+    return pb2.DetectAnomalyResult(
+        is_anomalous=is_anomalous, confidence=confidence,
+        anomaly_mask=pb2.Bitmap(width=width, height=height, byte_data=bytes(mask)),
+        anomalies=anomalies)
+
+
+class FakeEdgeAgentServicer(EdgeAgentServicer):
+
+    def __init__(self, latency_ms=0, model_components=("FakeModelComponent",), concurrency=1,
+                 anomaly_rate=0.3, classifier_components=("FakeClassifierComponent",),
+                 classifier_latency_ms=None):
+        self.latency_ms = latency_ms
+        self.classifier_latency_ms = latency_ms if classifier_latency_ms is None else classifier_latency_ms
+        self.classifiers = set(classifier_components)
+        self.statuses = {name: pb2.RUNNING for name in tuple(model_components) + tuple(classifier_components)}
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.anomaly_rate = anomaly_rate
+        self.request_count = 0
+
+    def model_status(self, model_component, context):
+        if model_component not in self.statuses:
+            context.abort(grpc.StatusCode.NOT_FOUND, "Model component not found: " + model_component)
+        return self.statuses[model_component]
+
+    def read_bitmap(self, bitmap):
+        if bitmap.HasField("shared_memory_handle"):
+            handle = bitmap.shared_memory_handle
+            with open("/dev/shm/" + handle.name.lstrip("/"), "rb") as segment:
+                segment.seek(handle.offset)
+                return segment.read(handle.size)
+        return bitmap.byte_data
+
+    def DetectAnomalies(self, request, context):
+        self.request_count += 1
+        if self.model_status(request.model_component, context) != pb2.RUNNING:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION,
+                          "Model component isn't running: " + request.model_component)
+        bitmap = request.bitmap
+        data = self.read_bitmap(bitmap)
+        if len(data) != bitmap.width * bitmap.height * 3:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                          "Bitmap size doesn't match width * height * 3")
+        segmentation = request.model_component not in self.classifiers
+        latency_ms = self.latency_ms if segmentation else self.classifier_latency_ms
+        with self.slots:
+            if latency_ms:
+                time.sleep(latency_ms / 1000.0)
+        return pb2.DetectAnomaliesResponse(detect_anomaly_result=synthetic_result(
+            data, bitmap.width, bitmap.height, self.anomaly_rate, segmentation))
+
+    def StartModel(self, request, context):
+        self.model_status(request.model_component, context)
+        self.statuses[request.model_component] = pb2.RUNNING
+        return pb2.StartModelResponse(status=pb2.STARTING)
+
+    def StopModel(self, request, context):
+        self.model_status(request.model_component, context)
+        self.statuses[request.model_component] = pb2.STOPPED
+        return pb2.StopModelResponse(status=pb2.STOPPED)
+
+    def ListModels(self, request, context):
+        return pb2.ListModelsResponse(models=[
+            pb2.ModelMetadata(model_component=name, status=status)
+            for name, status in self.statuses.items()
+        ])
+
+    def DescribeModel(self, request, context):
+        status = self.model_status(request.model_component, context)
+        return pb2.DescribeModelResponse(model_description=pb2.ModelDescription(
+            model_component=request.model_component, status=status))
+
+
+def serve(servicer, address=DEFAULT_SOCKET, max_workers=8):
+    """Starts a gRPC server for the servicer on the address and returns it."""
+    if address.startswith("unix://") and os.path.exists(address[len("unix://"):]):
+        os.remove(address[len("unix://"):])
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers), options=[
+        ("grpc.max_send_message_length", -1), ("grpc.max_receive_message_length", -1)])
+    add_EdgeAgentServicer_to_server(servicer, server)
+    server.add_insecure_port(address)
+    server.start()
+    return server
+
+
+if __name__ == "__main__":
+    address = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SOCKET
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    anomaly_rate = float(sys.argv[4]) if len(sys.argv) > 4 else 0.3
+    classifier_latency_ms = float(sys.argv[5]) if len(sys.argv) > 5 else None
+    server = serve(FakeEdgeAgentServicer(latency_ms, concurrency=concurrency, anomaly_rate=anomaly_rate,
+                                         classifier_latency_ms=classifier_latency_ms),
+                   address, max_workers=max(8, concurrency * 2))
+    print("fake edge agent listening on " + address)
+    server.wait_for_termination()
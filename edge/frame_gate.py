@@ -0,0 +1,176 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
+import sys
+import time
+import argparse
+
+import numpy as np
+import cv2
+
+#
+# A cheap check that runs before inference in a streaming loop, so frames where nothing has
+# changed don't use the accelerator, for example while the conveyor is stopped.
+#
+# Each frame is reduced to a small grayscale thumbnail, which takes about a millisecond at 1080p.
+# A frame is sent to the model when its thumbnail differs from the one of the last inferred
+# frame by more than diff_threshold gray levels on average, or, with method="hash", when the
+# difference hashes of the two differ in more than hash_distance bits. With an ROI, the frame is
+# also only sent when a part is present in it: the ROI must differ from an image of the empty
+# scene by presence_threshold, or without one, have at least that much contrast. A frame is
+# inferred at least every max_interval seconds anyway, so slow changes are not missed.
+#
+#   gate = FrameGate(diff_threshold=4, roi=(280, 50, 620, 400))
+#   infer, reason = gate.check(img)
+#   if infer:
+#       check_for_anomalies(...)
+#   print(gate.stats())
+#
+# usage: python3 frame_gate.py <video file or camera index> [--diff 4] [--roi x,y,w,h] [--empty empty.png]
+#        prints how many frames of a recording the gate would skip, to tune the thresholds.
+#
+THUMBNAIL_SIZE = (64, 48)
+HASH_SIZE = 8
+# Neighboring hash cells must differ by this many gray levels, so sensor noise on flat
+# backgrounds doesn't flip bits.
+HASH_MARGIN = 2
+DEFAULT_DIFF_THRESHOLD = 4.0
+DEFAULT_HASH_DISTANCE = 4
+DEFAULT_PRESENCE_THRESHOLD = 12.0
+DEFAULT_MAX_INTERVAL = 10.0
+
+
+def parse_roi(text):
+    """Parses an ROI such as 280,50,620,400 into (x, y, w, h)."""
+    x, y, w, h = (int(value) for value in text.split(","))
+    return x, y, w, h
+
+
+def thumbnail(img, size=THUMBNAIL_SIZE):
+    # Averaging every pixel of a large frame costs more than the rest of the gate. Sampling
+    # every step-th pixel first still leaves at least 4x4 pixels for each thumbnail pixel.
+    step = max(1, min(img.shape[0] // (size[1] * 4), img.shape[1] // (size[0] * 4)))
+    small = cv2.resize(img[::step, ::step], size, interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return small.astype(np.int16)
+
+
+def difference_hash(small):
+    """Returns the difference hash of a grayscale thumbnail as a boolean array."""
+    resized = cv2.resize(small.astype(np.uint8), (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    return resized[:, 1:].astype(np.int16) > resized[:, :-1].astype(np.int16) + HASH_MARGIN
+
+
+class FrameGate:
+
+    def __init__(self, diff_threshold=DEFAULT_DIFF_THRESHOLD, method="diff", hash_distance=DEFAULT_HASH_DISTANCE,
+                 roi=None, empty=None, presence_threshold=DEFAULT_PRESENCE_THRESHOLD,
+                 max_interval=DEFAULT_MAX_INTERVAL):
+        """
+        roi is (x, y, w, h) in frame pixels. empty is an image of the scene without a part.
+        """
+        self.diff_threshold = diff_threshold
+        self.method = method
+        self.hash_distance = hash_distance
+        self.roi = roi
+        self.presence_threshold = presence_threshold
+        self.max_interval = max_interval
+        self.empty_roi = thumbnail(self.crop(empty)) if empty is not None and roi is not None else None
+        self.last = None
+        self.last_hash = None
+        self.last_time = 0.0
+        self.frames = 0
+        self.inferred = 0
+        self.skipped_static = 0
+        self.skipped_absent = 0
+
+    def crop(self, img):
+        if self.roi is None:
+            return img
+        x, y, w, h = self.roi
+        return img[y:y + h, x:x + w]
+
+    def part_present(self, img):
+        if self.roi is None:
+            return True
+        small = thumbnail(self.crop(img))
+        if self.empty_roi is not None:
+            return np.abs(small - self.empty_roi).mean() > self.presence_threshold
+        return small.std() > self.presence_threshold
+
+    def changed(self, small):
+        if self.last is None:
+            return True
+        if self.method == "hash":
+            return np.count_nonzero(difference_hash(small) != self.last_hash) > self.hash_distance
+        return np.abs(small - self.last).mean() > self.diff_threshold
+
+    def check(self, img, now=None):
+        """
+        Returns (True, reason) if the frame should be inferred, (False, reason) if it can be skipped.
+        The reasons are "changed", "interval", "static" and "absent".
+        """
+        now = time.monotonic() if now is None else now
+        self.frames += 1
+        if not self.part_present(img):
+            self.skipped_absent += 1
+            return False, "absent"
+        small = thumbnail(img)
+        if self.changed(small):
+            reason = "changed"
+        elif self.max_interval and now - self.last_time >= self.max_interval:
+            reason = "interval"
+        else:
+            self.skipped_static += 1
+            return False, "static"
+        self.last = small
+        self.last_hash = difference_hash(small) if self.method == "hash" else None
+        self.last_time = now
+        self.inferred += 1
+        return True, reason
+
+    def stats(self):
+        skipped = self.skipped_static + self.skipped_absent
+        return {
+            "frames": self.frames,
+            "inferred": self.inferred,
+            "skipped_static": self.skipped_static,
+            "skipped_absent": self.skipped_absent,
+            "saved": skipped / self.frames if self.frames else 0.0
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shows how many frames of a recording the gate skips.")
+    parser.add_argument("source", help="a video file or a camera index")
+    parser.add_argument("--method", choices=("diff", "hash"), default="diff")
+    parser.add_argument("--diff", type=float, default=DEFAULT_DIFF_THRESHOLD,
+                        help="mean gray level difference of a changed frame")
+    parser.add_argument("--hash-distance", type=int, default=DEFAULT_HASH_DISTANCE)
+    parser.add_argument("--roi", type=parse_roi, help="x,y,w,h of the area where parts appear")
+    parser.add_argument("--empty", help="an image of the ROI scene without a part")
+    parser.add_argument("--presence", type=float, default=DEFAULT_PRESENCE_THRESHOLD)
+    parser.add_argument("--max-interval", type=float, default=DEFAULT_MAX_INTERVAL)
+    parser.add_argument("--fps", type=float, default=30.0, help="the frame rate of the recording")
+    args = parser.parse_args()
+
+    cap = cv2.VideoCapture(int(args.source) if args.source.isdigit() else args.source)
+    if not cap.isOpened():
+        print("unable to open " + args.source)
+        sys.exit(1)
+    gate = FrameGate(args.diff, args.method, args.hash_distance, args.roi,
+                     cv2.imread(args.empty) if args.empty else None, args.presence, args.max_interval)
+    elapsed = 0.0
+    frame = 0
+    while True:
+        ret_val, img = cap.read()
+        if not ret_val:
+            break
+        start = time.perf_counter()
+        gate.check(img, now=frame / args.fps)
+        elapsed += time.perf_counter() - start
+        frame += 1
+    cap.release()
+    stats = gate.stats()
+    print(f"{stats['frames']} frames, {stats['inferred']} inferred, {stats['skipped_static']} static, "
+          f"{stats['skipped_absent']} without a part: {stats['saved'] * 100:.1f} % of inferences saved")
+    print(f"gate took {elapsed / max(frame, 1) * 1000:.2f} ms per frame")
@@ -0,0 +1,249 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
+import os
+import sys
+import json
+import mmap
+import time
+import queue
+import struct
+import tempfile
+import threading
+
+import numpy as np
+import cv2
+
+#
+# Keeps the last frames of a streaming loop, so when an anomaly is found the frames before and
+# after it can be saved as a clip for root cause analysis, instead of only the inspected frame.
+#
+# FrameRing is a fixed number of frame slots in a memory-mapped file, allocated for the first
+# frame and then overwritten in turn, so adding a frame is one copy with no allocation. The file
+# is in /dev/shm by default, which is memory, so normal operation does no disk I/O, and the ring
+# of a process that died can still be saved with this script. Each slot records the number of the
+# frame in it; a reader copies the slot and checks the number again afterwards, so a frame that
+# was overwritten while it was read is dropped rather than saved torn.
+#
+# ClipRecorder adds the frames to a ring. When trigger() marks a frame, a background thread
+# writes the frames from before frames earlier to after frames later as
+# <directory>/anomaly-<time>-<frame>.mp4, with a .json of the frame times and the triggers. It
+# starts right away with the older frames and follows the newer ones as they are added. Triggers
+# within a clip that is still collecting frames are added to that clip.
+#
+#   clips = ClipRecorder(FrameRing(capacity=90), before=30, after=30, directory="clips")
+#   frame = clips.add(img)
+#   if detect_anomalies_response.detect_anomaly_result.is_anomalous:
+#       clips.trigger(frame, {"confidence": ...})
+#   ...
+#   clips.close()
+#
+# A 1080p BGR frame takes 6 MB, so a ring of 90 frames takes about 560 MB of memory.
+#
+# usage: python3 frame_ring.py <ring file> <clip.mp4> [--fps 30]
+#        saves the frames left in the ring file of a process that stopped as a clip.
+#
+MAGIC = b"L4VRING1"
+HEADER = struct.Struct("<8s4q")
+TABLE_OFFSET = 64
+PAGE_SIZE = 4096
+DEFAULT_FOURCC = "mp4v"
+
+
+def default_path():
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"l4v-frames-{os.getpid()}.ring")
+
+
+class FrameRing:
+
+    def __init__(self, capacity, path=None):
+        self.capacity = capacity
+        self.path = path or default_path()
+        self.map = None
+        self.shape = None
+        self.next_frame = 0
+
+    def layout(self, shape):
+        frames_offset = -(-(TABLE_OFFSET + 16 * self.capacity) // PAGE_SIZE) * PAGE_SIZE
+        return frames_offset, frames_offset + self.capacity * int(np.prod(shape))
+
+    def attach(self, shape, mode):
+        # The header, the frame number and time of each slot, then the page aligned frames.
+        frames_offset, size = self.layout(shape)
+        with open(self.path, "r+b" if mode == "r" else "w+b") as f:
+            if mode != "r":
+                f.truncate(size)
+            self.map = mmap.mmap(f.fileno(), size)
+        self.shape = tuple(shape)
+        self.numbers = np.ndarray((self.capacity,), np.int64, self.map, TABLE_OFFSET)
+        self.times = np.ndarray((self.capacity,), np.float64, self.map, TABLE_OFFSET + 8 * self.capacity)
+        self.frames = np.ndarray((self.capacity,) + self.shape, np.uint8, self.map, frames_offset)
+        if mode != "r":
+            height, width = shape[:2]
+            self.map[:HEADER.size] = HEADER.pack(MAGIC, self.capacity, height, width, shape[2] if len(shape) > 2 else 1)
+            self.numbers.fill(-1)
+
+    @classmethod
+    def open(cls, path):
+        """Opens the ring file of another process, to read the frames in it."""
+        with open(path, "rb") as f:
+            magic, capacity, height, width, channels = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(path + " is not a frame ring file")
+        ring = cls(capacity, path)
+        ring.attach((height, width, channels) if channels > 1 else (height, width), "r")
+        ring.next_frame = int(ring.numbers.max()) + 1
+        return ring
+
+    def put(self, frame, timestamp=None):
+        """Copies a uint8 frame into the ring and returns its number."""
+        if self.map is None:
+            self.attach(frame.shape, "w")
+        elif frame.shape != self.shape:
+            raise ValueError(f"frame shape {frame.shape} doesn't match the ring's {self.shape}")
+        number = self.next_frame
+        slot = number % self.capacity
+        self.numbers[slot] = -1
+        np.copyto(self.frames[slot], frame)
+        self.times[slot] = timestamp or time.time()
+        self.numbers[slot] = number
+        self.next_frame = number + 1
+        return number
+
+    def read(self, number, out):
+        """Copies frame number into out and returns its time, or None if it isn't in the ring anymore."""
+        slot = number % self.capacity
+        if number < 0 or self.numbers[slot] != number:
+            return None
+        timestamp = float(self.times[slot])
+        np.copyto(out, self.frames[slot])
+        if self.numbers[slot] != number:
+            return None
+        return timestamp
+
+    def oldest(self):
+        return max(self.next_frame - self.capacity, 0)
+
+    def close(self, remove=True):
+        if self.map is not None:
+            del self.numbers, self.times, self.frames
+            self.map.close()
+            self.map = None
+            if remove:
+                os.remove(self.path)
+
+
+def write_clip(ring, first, last, path, fps=30.0, fourcc=DEFAULT_FOURCC, scratch=None, wait_for=None):
+    """
+    Writes frames first to last of the ring to a video file and returns the times of the frames written.
+    wait_for is called with each frame number before it is read and returns False to stop at that frame.
+    """
+    height, width = ring.shape[:2]
+    scratch = scratch if scratch is not None else np.empty(ring.shape, np.uint8)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height), len(ring.shape) == 3)
+    if not writer.isOpened():
+        raise Exception("unable to open a " + fourcc + " video writer for " + path)
+    times = []
+    try:
+        for number in range(first, last + 1):
+            if wait_for is not None and not wait_for(number):
+                break
+            timestamp = ring.read(number, scratch)
+            if timestamp is not None:
+                writer.write(scratch)
+                times.append(timestamp)
+    finally:
+        writer.release()
+    return times
+
+
+class ClipRecorder:
+
+    def __init__(self, ring, before=30, after=30, directory="clips", fps=30.0, fourcc=DEFAULT_FOURCC):
+        if ring.capacity <= before + after:
+            raise ValueError("the ring must hold more than before + after frames, so the clip writer has time to read them")
+        self.ring = ring
+        self.before = before
+        self.after = after
+        self.directory = directory
+        self.fps = fps
+        self.fourcc = fourcc
+        self.added = threading.Condition()
+        self.closing = False
+        self.last_clip = None
+        self.scratch = None
+        self.clips = queue.Queue()
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, name="clips", daemon=True)
+        self.thread.start()
+
+    def add(self, frame, timestamp=None):
+        """Adds a frame to the ring and returns its number."""
+        number = self.ring.put(frame, timestamp)
+        with self.added:
+            self.added.notify_all()
+        return number
+
+    def trigger(self, number, info=None):
+        """Saves a clip around frame number. info is saved with the clip's frame times."""
+        trigger = dict(info or {}, frame=number, time=time.time())
+        with self.added:
+            if self.last_clip is not None and number <= self.last_clip["last"]:
+                self.last_clip["triggers"].append(trigger)
+                return
+            self.last_clip = {"first": max(number - self.before, self.ring.oldest()),
+                              "last": number + self.after, "triggers": [trigger]}
+            self.clips.put(self.last_clip)
+
+    def wait_for(self, number):
+        """Waits until frame number is in the ring. Returns False if it won't be because the recorder is closing."""
+        with self.added:
+            while self.ring.next_frame <= number and not self.closing:
+                self.added.wait()
+            return self.ring.next_frame > number
+
+    def run(self):
+        while True:
+            clip = self.clips.get()
+            if clip is None:
+                return
+            try:
+                self.write(clip)
+            except Exception as e:
+                print("failed to save clip: " + str(e))
+
+    def write(self, clip):
+        # Started as soon as the clip is triggered: the frames before it are read from the ring
+        # first, while they are the oldest, then the frames after it as they are added.
+        if self.scratch is None:
+            self.scratch = np.empty(self.ring.shape, np.uint8)
+        number = clip["triggers"][0]["frame"]
+        name = time.strftime("anomaly-%Y%m%d-%H%M%S", time.localtime(clip["triggers"][0]["time"])) + f"-{number}"
+        path = os.path.join(self.directory, name + ".mp4")
+        times = write_clip(self.ring, clip["first"], clip["last"], path, self.fps, self.fourcc, self.scratch,
+                           self.wait_for)
+        with self.added:
+            metadata = {"first_frame": clip["first"], "frame_times": times, "triggers": list(clip["triggers"]),
+                        "dropped": min(clip["last"], self.ring.next_frame - 1) - clip["first"] + 1 - len(times)}
+        with open(os.path.join(self.directory, name + ".json"), "w") as f:
+            json.dump(metadata, f)
+        print(f"saved {len(times)} frames around frame {number} to {path}")
+
+    def close(self):
+        """Saves the clips still collecting frames with the frames they have, and stops the writer thread."""
+        with self.added:
+            self.closing = True
+            self.added.notify_all()
+        self.clips.put(None)
+        self.thread.join()
+        self.ring.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: frame_ring.py <ring file> <clip.mp4> [--fps 30]")
+        sys.exit(1)
+    fps = float(sys.argv[sys.argv.index("--fps") + 1]) if "--fps" in sys.argv else 30.0
+    ring = FrameRing.open(sys.argv[1])
+    times = write_clip(ring, ring.oldest(), ring.next_frame - 1, sys.argv[2], fps)
+    print(f"saved {len(times)} frames to {sys.argv[2]}")
+    ring.close(remove=False)
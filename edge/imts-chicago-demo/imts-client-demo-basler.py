@@ -1,29 +1,94 @@
 # // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
 import cv2
-import grpc
-import edge_agent_pb2 as pb2 
-from edge_agent_pb2_grpc import ( 
-    EdgeAgentStub
-)
 from pypylon import pylon
-import numpy as np
 import sys
-from base_l4v_client import process_segmentation, check_for_anomalies
+import os
+import time
+import threading
+# base_l4v_client.py is shared with the other edge clients in the parent folder.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from base_l4v_client import check_for_anomalies, rule_defects
+from tiled_inference import detect_tiled, parse_size
+from result_display import ResultDisplay
+import tracing
+
+# Set L4V_TILE to the model's input size, e.g. 1024x1024, to inspect the whole frame in
+# overlapping tiles at full resolution instead of the cropped and resized subject.
+TILE = parse_size(os.environ["L4V_TILE"]) if os.environ.get("L4V_TILE") else None
+
+#
+# Inspects the subject under the camera continuously. The main thread grabs frames at camera
+# rate, an inference thread always takes the newest frame and drops the ones it had no time
+# for, and result_display.py shows the live frame with the latest result from its own thread.
+# Anomalous frames are saved to <outputFile>. Press q or Esc in the window to stop.
+#
+
+
+class LatestFrame:
+    """A single slot holding the newest frame. Putting a frame replaces the one not yet taken."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.closed = False
+
+    def put(self, frame):
+        with self.condition:
+            self.frame = frame
+            self.condition.notify()
+
+    def take(self):
+        with self.condition:
+            while self.frame is None and not self.closed:
+                self.condition.wait()
+            frame, self.frame = self.frame, None
+            return frame
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+def prepare(img):
+    if TILE is None:
+        cropped_image = img[50:450, 280:900]
+        dim = (550,380)
+        return cv2.resize(cropped_image, dim, interpolation = cv2.INTER_AREA)
+    return img
+
+
+def inspect(latest, display, component, output_file):
+    while True:
+        frame = latest.take()
+        if frame is None:
+            return
+        with tracing.span("inference"):
+            start = time.perf_counter()
+            with tracing.span("cvtColor"):
+                converted_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            try:
+                if TILE is None:
+                    detect_anomalies_response = check_for_anomalies(converted_image, component)
+                else:
+                    detect_anomalies_response = detect_tiled(converted_image, component, TILE)
+            except Exception as e:
+                print("inference failed: " + str(e))
+                time.sleep(1)
+                continue
+            result = detect_anomalies_response.detect_anomaly_result
+            display.update_result(result, rule_defects(result), (time.perf_counter() - start) * 1000)
+            if result.is_anomalous and output_file:
+                with tracing.span("imwrite"):
+                    cv2.imwrite(output_file, frame)
+
 
 if (len(sys.argv) < 3):
-    print("usage: capture-subject-basler <deviceSerialNumber> <componentName>")
+    print("usage: imts-client-demo-basler <deviceSerialNumber> <componentName> [outputFile]")
     sys.exit(1)
-print ("usage: capture-subject-basler <deviceSerialNumber> <componentName>")
 
 info = pylon.DeviceInfo()
 print("getting camera serial number "+sys.argv[1])
-img_1 = np.zeros([1080,1920,1],dtype=np.uint8)
-img_1.fill(0)
-# or img[:] = 255
-cv2.putText(img=img_1, text='Welcome to Amazon Lookout For Vision' , org=(100, 150), fontFace=cv2.FONT_HERSHEY_TRIPLEX, fontScale=2, color=(255, 0, 255),thickness=2)
-cv2.putText(img=img_1, text='Place subject under camera and press any key' , org=(100, 250), fontFace=cv2.FONT_HERSHEY_TRIPLEX, fontScale=2, color=(255, 0, 255),thickness=2)
-cv2.imshow('Welcome to Amazon Lookout For Vision', img_1)
-cv2.waitKey(0)
 info.SetSerialNumber(sys.argv[1])
 converter = pylon.ImageFormatConverter()
 converter.OutputPixelFormat = pylon.PixelType_BGR8packed
@@ -34,29 +99,35 @@ camera = pylon.InstantCamera()
 camera.Attach(tl_factory.CreateFirstDevice(info)) # change this to use device serial number
 camera.Open()
 #camera.PixelFormat.SetValue("BayerRG8")
-camera.StartGrabbing(1)
-grab = camera.RetrieveResult(5000, pylon.TimeoutHandling_Return)
-if grab.GrabSucceeded():
-    img = grab.GetArray()
-    print(f'Size of image: {img.shape}')
-    image = converter.Convert(grab)
-    img = image.GetArray()
-    cropped_image = img[50:450, 280:900]
-    dim = (550,380)
-    resized_image = cv2.resize(cropped_image, dim, interpolation = cv2.INTER_AREA)
-
-
-    cv2.namedWindow('ORIGINAL', cv2.WINDOW_FULLSCREEN)
-    cv2.imshow('ORIGINAL', cv2.resize(resized_image, (1920,1080),interpolation = cv2.INTER_AREA))
-    cv2.waitKey(0)
-    cv2.imwrite(sys.argv[3],img)
-    cv2.imwrite("cropped-"+sys.argv[3],resized_image)
-    print("start client")
-    converted_image = cv2.cvtColor(resized_image, cv2.COLOR_BGR2RGB)
-    detect_anomalies_response = check_for_anomalies(converted_image, sys.argv[2])
-    process_segmentation(converted_image, detect_anomalies_response)
-
-
-camera.Close()
-cv2.destroyAllWindows()
 
+display = ResultDisplay().start()
+latest = LatestFrame()
+inference = threading.Thread(target=inspect, name="inference", daemon=True,
+                             args=(latest, display, sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None))
+inference.start()
+
+# Only the newest image is kept in the camera buffer, so a slow consumer never sees stale frames.
+camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+try:
+    while camera.IsGrabbing() and not display.stopped.is_set():
+        with tracing.span("RetrieveResult"):
+            grab = camera.RetrieveResult(5000, pylon.TimeoutHandling_Return)
+        if grab is None or not grab.GrabSucceeded():
+            continue
+        with tracing.span("capture"):
+            # The converted array is new for every frame, so the display and inference can keep it.
+            with tracing.span("pylon Convert"):
+                frame = converter.Convert(grab).GetArray()
+            grab.Release()
+            with tracing.span("prepare"):
+                frame = prepare(frame)
+        display.update_frame(frame)
+        latest.put(frame)
+except KeyboardInterrupt:
+    pass
+finally:
+    camera.StopGrabbing()
+    camera.Close()
+    latest.close()
+    inference.join()
+    display.stop()
@@ -0,0 +1,197 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
+import os
+import sys
+import time
+import queue
+import sqlite3
+import threading
+import argparse
+
+#
+# A local history of inspection results, kept on the device in SQLite. Each frame is stored with
+# its timestamp, camera, model component, is_anomalous, confidence and the area of each defect
+# class. Results are queued and written by a background thread in batches, one transaction per
+# batch, so recording a frame doesn't wait for the disk. The database uses WAL mode so queries
+# can run while frames are written. The time indexes cover the columns the queries read, so
+# queries such as "anomaly rate by class in the last hour" only touch the rows in the window
+# and stay in the milliseconds after months of data.
+#
+# usage: python3 inspection_history.py [--db inspection-history.db] query --last 1h [--camera cam1]
+#        python3 inspection_history.py [--db inspection-history.db] prune --older-than 90d
+#
+DEFAULT_DB = "inspection-history.db"
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+MAX_QUEUED = 100000
+IGNORED_CLASSES = ("background",)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    camera TEXT NOT NULL,
+    model_component TEXT NOT NULL,
+    is_anomalous INTEGER NOT NULL,
+    confidence REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS defects (
+    frame_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    class TEXT NOT NULL,
+    area REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS frames_ts ON frames (ts, is_anomalous);
+CREATE INDEX IF NOT EXISTS frames_camera_ts ON frames (camera, ts, is_anomalous);
+CREATE INDEX IF NOT EXISTS defects_ts ON defects (ts, class, area);
+CREATE INDEX IF NOT EXISTS defects_class_ts ON defects (class, ts);
+"""
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(text):
+    """Parses durations such as 90s, 15m, 1h or 30d into seconds."""
+    return float(text[:-1]) * DURATION_UNITS[text[-1]] if text[-1] in DURATION_UNITS else float(text)
+
+
+def connect(path):
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    # With WAL, NORMAL only risks the last transactions on power loss, never corruption.
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def result_areas(detect_anomaly_result):
+    """Returns the area of each defect class in a DetectAnomalyResult."""
+    return {anomaly.name: anomaly.pixel_anomaly.total_percentage_area
+            for anomaly in detect_anomaly_result.anomalies
+            if anomaly.name not in IGNORED_CLASSES}
+
+
+class InspectionHistory:
+
+    def __init__(self, path=DEFAULT_DB, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(MAX_QUEUED)
+        self.dropped = 0
+        connect(path).close()
+        self.writer = threading.Thread(target=self.write_batches, name="inspection-history", daemon=True)
+        self.writer.start()
+
+    def record(self, is_anomalous, confidence, areas, camera="default", model_component="", timestamp=None):
+        """Queues a frame for writing. Never blocks; frames are dropped if the writer falls behind."""
+        try:
+            self.queue.put_nowait((timestamp or time.time(), camera, model_component,
+                                   int(is_anomalous), float(confidence), areas))
+        except queue.Full:
+            self.dropped += 1
+
+    def record_result(self, detect_anomaly_result, camera="default", model_component="", timestamp=None):
+        self.record(detect_anomaly_result.is_anomalous, detect_anomaly_result.confidence,
+                    result_areas(detect_anomaly_result), camera, model_component, timestamp)
+
+    def write_batches(self):
+        connection = connect(self.path)
+        done = False
+        while not done:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+            if batch:
+                self.write(connection, batch)
+        connection.close()
+
+    @staticmethod
+    def write(connection, batch):
+        with connection:
+            cursor = connection.cursor()
+            defects = []
+            for ts, camera, model_component, is_anomalous, confidence, areas in batch:
+                cursor.execute("INSERT INTO frames (ts, camera, model_component, is_anomalous, confidence) "
+                               "VALUES (?, ?, ?, ?, ?)", (ts, camera, model_component, is_anomalous, confidence))
+                frame_id = cursor.lastrowid
+                defects.extend((frame_id, ts, name, area) for name, area in areas.items())
+            cursor.executemany("INSERT INTO defects (frame_id, ts, class, area) VALUES (?, ?, ?, ?)", defects)
+
+    def close(self):
+        """Writes the queued frames and stops the writer thread."""
+        self.queue.put(None)
+        self.writer.join()
+
+
+def anomaly_rate(connection, since, until=None, camera=None):
+    """Returns (frames, anomalous frames) between since and until."""
+    query = "SELECT COUNT(*), COALESCE(SUM(is_anomalous), 0) FROM frames WHERE ts >= ? AND ts < ?"
+    params = [since, until or time.time() + 1]
+    if camera is not None:
+        query += " AND camera = ?"
+        params.append(camera)
+    return tuple(connection.execute(query, params).fetchone())
+
+
+def anomaly_rate_by_class(connection, since, until=None, camera=None, min_area=0.0):
+    """Returns {class: (frames with the class over min_area, rate)} between since and until."""
+    until = until or time.time() + 1
+    frames, _ = anomaly_rate(connection, since, until, camera)
+    if camera is None:
+        rows = connection.execute(
+            "SELECT class, COUNT(*) FROM defects WHERE ts >= ? AND ts < ? AND area > ? GROUP BY class",
+            (since, until, min_area))
+    else:
+        rows = connection.execute(
+            "SELECT d.class, COUNT(*) FROM defects d JOIN frames f ON f.id = d.frame_id "
+            "WHERE d.ts >= ? AND d.ts < ? AND d.area > ? AND f.camera = ? GROUP BY d.class",
+            (since, until, min_area, camera))
+    return {name: (count, count / frames if frames else 0.0) for name, count in rows}
+
+
+def prune(connection, before):
+    """Deletes the frames recorded before a time. Returns the number of frames deleted."""
+    with connection:
+        connection.execute("DELETE FROM defects WHERE ts < ?", (before,))
+        return connection.execute("DELETE FROM frames WHERE ts < ?", (before,)).rowcount
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queries the local inspection history.")
+    parser.add_argument("--db", default=os.environ.get("L4V_HISTORY_DB", DEFAULT_DB))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    query_parser = subparsers.add_parser("query", help="anomaly rate by class")
+    query_parser.add_argument("--last", default="1h", help="time window, e.g. 15m, 1h, 7d")
+    query_parser.add_argument("--camera")
+    query_parser.add_argument("--min-area", type=float, default=0.0)
+    prune_parser = subparsers.add_parser("prune", help="delete old frames")
+    prune_parser.add_argument("--older-than", required=True, help="e.g. 90d")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print("no inspection history at " + args.db)
+        sys.exit(1)
+    connection = connect(args.db)
+    if args.command == "query":
+        start = time.perf_counter()
+        since = time.time() - parse_duration(args.last)
+        frames, anomalous = anomaly_rate(connection, since, camera=args.camera)
+        by_class = anomaly_rate_by_class(connection, since, camera=args.camera, min_area=args.min_area)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(f"{frames} frames in the last {args.last}, {anomalous} anomalous "
+              f"({anomalous / frames * 100 if frames else 0:.2f} %)")
+        for name, (count, rate) in sorted(by_class.items(), key=lambda item: -item[1][0]):
+            print(f"  {name}: {count} frames ({rate * 100:.2f} %)")
+        print(f"query took {elapsed_ms:.1f} ms")
+    else:
+        deleted = prune(connection, time.time() - parse_duration(args.older_than))
+        print(f"deleted {deleted} frames")
+    connection.close()
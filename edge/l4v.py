@@ -0,0 +1,87 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
+import os
+import sys
+import json
+import socket
+
+#
+# A small command line front end for l4v_daemon.py. It only imports the standard library and
+# sends one request over the daemon's Unix socket, so it returns in milliseconds.
+#
+# usage: python3 l4v.py detect <imagefile> <componentName> [--segment] [--publish]
+#        python3 l4v.py capture <componentName> [--source 0] [--save frame.bmp] [--segment] [--publish]
+#        python3 l4v.py start|stop <componentName>
+#        python3 l4v.py models
+#        python3 l4v.py ping
+#
+DEFAULT_SOCKET = os.environ.get("L4V_DAEMON_SOCKET", "/tmp/l4v-daemon.sock")
+USAGE = """usage: l4v.py detect <imagefile> <componentName> [--segment] [--publish]
+       l4v.py capture <componentName> [--source 0] [--save frame.bmp] [--segment] [--publish]
+       l4v.py start|stop <componentName>
+       l4v.py models
+       l4v.py ping"""
+
+
+def daemon_request(request, socket_path=DEFAULT_SOCKET, timeout=60):
+    """
+    Sends a request to the daemon and returns its response. Raises FileNotFoundError or
+    ConnectionRefusedError if it isn't running, and socket.timeout if it doesn't respond in time.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(socket_path)
+        connection.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with connection.makefile("rb") as reader:
+            return json.loads(reader.readline())
+
+
+def parse_request(argv):
+    """Returns the request for the command line arguments, or None if they aren't valid."""
+    args = []
+    options = {}
+    position = 0
+    while position < len(argv):
+        if argv[position] in ("--source", "--save") and position + 1 < len(argv):
+            options[argv[position][2:]] = argv[position + 1]
+            position += 1
+        elif argv[position] in ("--segment", "--publish"):
+            options[argv[position][2:]] = True
+        else:
+            args.append(argv[position])
+        position += 1
+
+    command = args[0] if args else None
+    if command == "detect" and len(args) == 3:
+        request = {"command": command, "image": os.path.abspath(args[1]), "model": args[2]}
+    elif command in ("capture", "start", "stop") and len(args) == 2:
+        request = {"command": command, "model": args[1]}
+    elif command in ("models", "ping") and len(args) == 1:
+        request = {"command": command}
+    else:
+        return None
+    if "save" in options:
+        options["save"] = os.path.abspath(options["save"])
+    if options.get("segment"):
+        # The daemon writes the mask and blended images where this client is run.
+        options["output_dir"] = os.getcwd()
+    request.update(options)
+    return request
+
+
+if __name__ == "__main__":
+    request = parse_request(sys.argv[1:])
+    if request is None:
+        print(USAGE)
+        sys.exit(2)
+    try:
+        response = daemon_request(request)
+    except socket.timeout:
+        print("l4v daemon on " + DEFAULT_SOCKET + " didn't respond within the timeout")
+        sys.exit(1)
+    except OSError as e:
+        print("l4v daemon is not running on " + DEFAULT_SOCKET + ", start it with python3 l4v_daemon.py (" + str(e) + ")")
+        sys.exit(1)
+    if not response["ok"]:
+        print(response["error"])
+        sys.exit(1)
+    print(json.dumps(response["result"], indent=4))
@@ -0,0 +1,265 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import socketserver
+
+import base_l4v_client
+from base_l4v_client import process_segmentation, check_for_anomalies
+
+#
+# A resident inference process for the edge clients. Starting a client script imports cv2,
+# numpy, grpc and awscrt, and opens the Edge Agent channel, the camera and the MQTT connection,
+# which takes seconds on a Jetson before the first frame is inspected. The daemon does this
+# once and keeps them open; l4v.py, which only imports the standard library, sends it requests
+# over a Unix socket and gets the result back in milliseconds.
+#
+# Requests and responses are JSON objects, one per line:
+#   {"command": "detect", "image": "/abs/path.jpg", "model": "<componentName>", "segment": true,
+#    "output_dir": "/abs/dir"}
+#   {"command": "capture", "model": "<componentName>", "source": "0", "save": "/abs/frame.bmp"}
+#   {"command": "start" | "stop", "model": "<componentName>"}
+#   {"command": "models"}
+#   {"command": "ping"}
+# detect and capture also take "publish": true to publish the result over MQTT. With segment, the
+# mask and blended images are written to output_dir, the client's working directory, so they end
+# up where the client would write them without the daemon. Requests for the same directory are
+# segmented one at a time, so concurrent requests don't overwrite each other's images halfway.
+# Responses are {"ok": true, "result": {...}, "elapsed_ms": ...} or {"ok": false, "error": "..."}.
+#
+# usage: python3 l4v_daemon.py [--socket /tmp/l4v-daemon.sock] [--camera 0] [--mqtt]
+#
+DEFAULT_SOCKET = os.environ.get("L4V_DAEMON_SOCKET", "/tmp/l4v-daemon.sock")
+DEFAULT_CAMERA = os.environ.get("L4V_CAMERA_SOURCE", "0")
+
+# MQTT settings, as in sample-client-file-mqtt.py.
+IOT_ENDPOINT = os.environ.get("L4V_IOT_ENDPOINT", "<your_iot_endpoint_here>")
+CLIENT_ID = os.environ.get("L4V_CLIENT_ID", "l4vEdgeDemo")
+PATH_TO_CERTIFICATE = "/greengrass/v2/thingCert.crt"
+PATH_TO_PRIVATE_KEY = "/greengrass/v2/privKey.key"
+PATH_TO_AMAZON_ROOT_CA_1 = "/greengrass/v2/rootCA.pem"
+TOPIC = "l4v/testclient"
+MQTT_FORMAT = os.environ.get("L4V_MQTT_FORMAT", "json")
+MASK_SCALE = int(os.environ.get("L4V_MASK_SCALE", "4"))
+
+
+def result_dict(detect_anomaly_result):
+    return {
+        "is_anomalous": detect_anomaly_result.is_anomalous,
+        "confidence": detect_anomaly_result.confidence,
+        "anomalies": {anomaly.name: {"area": anomaly.pixel_anomaly.total_percentage_area,
+                                     "color": anomaly.pixel_anomaly.hex_color}
+                      for anomaly in detect_anomaly_result.anomalies}
+    }
+
+
+class Camera:
+    """An open camera. Reads are serialized, so concurrent requests get whole frames."""
+
+    def __init__(self, source):
+        import cv2
+        if source.isdigit():
+            self.capture = cv2.VideoCapture(int(source))
+        else:
+            # Anything else is a GStreamer pipeline, such as the one in sample-client-camera.py.
+            self.capture = cv2.VideoCapture(source, cv2.CAP_GSTREAMER)
+        if not self.capture.isOpened():
+            raise RuntimeError("Unable to open camera " + source)
+        self.lock = threading.Lock()
+
+    def read(self):
+        with self.lock:
+            ret_val, img = self.capture.read()
+        if not ret_val:
+            raise RuntimeError("Unable to read from camera")
+        return img
+
+    def release(self):
+        with self.lock:
+            self.capture.release()
+
+
+class InferenceDaemon:
+
+    def __init__(self):
+        self.started = time.time()
+        self.cameras = {}
+        self.cameras_lock = threading.Lock()
+        self.mqtt_connection = None
+        self.mqtt_lock = threading.Lock()
+        self.output_locks = {}
+        self.output_locks_lock = threading.Lock()
+
+    def preload(self, camera_sources=(), mqtt_connect=False):
+        """Imports the heavy modules and opens the connections before the first request."""
+        import numpy
+        import cv2
+        import edge_agent_pb2
+        base_l4v_client.get_stub()
+        for source in camera_sources:
+            self.camera(source)
+        if mqtt_connect:
+            self.mqtt()
+
+    def camera(self, source):
+        with self.cameras_lock:
+            if source not in self.cameras:
+                self.cameras[source] = Camera(source)
+                print("opened camera " + source)
+            return self.cameras[source]
+
+    def mqtt(self):
+        with self.mqtt_lock:
+            if self.mqtt_connection is None:
+                from awscrt import io
+                from awsiot import mqtt_connection_builder
+                event_loop_group = io.EventLoopGroup(1)
+                host_resolver = io.DefaultHostResolver(event_loop_group)
+                client_bootstrap = io.ClientBootstrap(event_loop_group, host_resolver)
+                mqtt_connection = mqtt_connection_builder.mtls_from_path(
+                    endpoint=IOT_ENDPOINT,
+                    cert_filepath=PATH_TO_CERTIFICATE,
+                    pri_key_filepath=PATH_TO_PRIVATE_KEY,
+                    client_bootstrap=client_bootstrap,
+                    ca_filepath=PATH_TO_AMAZON_ROOT_CA_1,
+                    client_id=CLIENT_ID,
+                    clean_session=False,
+                    keep_alive_secs=6
+                )
+                print("Connecting to {} with client ID '{}'...".format(IOT_ENDPOINT, CLIENT_ID))
+                mqtt_connection.connect().result()
+                print("Connected!")
+                self.mqtt_connection = mqtt_connection
+            return self.mqtt_connection
+
+    def publish(self, detect_anomalies_response, model_component):
+        from awscrt import mqtt
+        mqtt_connection = self.mqtt()
+        if MQTT_FORMAT == "protobuf":
+            from result_codec import encode_detect_result
+            payload = encode_detect_result(detect_anomalies_response.detect_anomaly_result,
+                                           camera=CLIENT_ID, model_component=model_component,
+                                           mask_scale=MASK_SCALE)
+            mqtt_connection.publish(topic=TOPIC + "/pb", payload=payload, qos=mqtt.QoS.AT_LEAST_ONCE)
+        else:
+            message = dict(result_dict(detect_anomalies_response.detect_anomaly_result),
+                           model_component=model_component)
+            mqtt_connection.publish(topic=TOPIC, payload=json.dumps(message), qos=mqtt.QoS.AT_LEAST_ONCE)
+
+    def output_lock(self, output_dir):
+        with self.output_locks_lock:
+            return self.output_locks.setdefault(os.path.realpath(output_dir), threading.Lock())
+
+    def inspect(self, img, request):
+        detect_anomalies_response = check_for_anomalies(img, request["model"])
+        result = result_dict(detect_anomalies_response.detect_anomaly_result)
+        if request.get("segment"):
+            output_dir = request.get("output_dir") or os.getcwd()
+            with self.output_lock(output_dir):
+                result["defects"] = process_segmentation(img, detect_anomalies_response, output_dir)
+        if request.get("publish"):
+            self.publish(detect_anomalies_response, request["model"])
+        return result
+
+    def detect(self, request):
+        import cv2
+        img = cv2.imread(request["image"])
+        if img is None:
+            raise ValueError("Unable to read image " + request["image"])
+        # this is very important to covert to RGB or you will not get good results
+        return self.inspect(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), request)
+
+    def capture(self, request):
+        import cv2
+        img = self.camera(request.get("source") or DEFAULT_CAMERA).read()
+        if request.get("save"):
+            cv2.imwrite(request["save"], img)
+        return self.inspect(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), request)
+
+    def start(self, request):
+        import edge_agent_pb2 as pb2
+        response = base_l4v_client.get_stub().StartModel(pb2.StartModelRequest(model_component=request["model"]))
+        return {"status": pb2.ModelStatus.Name(response.status)}
+
+    def stop(self, request):
+        import edge_agent_pb2 as pb2
+        response = base_l4v_client.get_stub().StopModel(pb2.StopModelRequest(model_component=request["model"]))
+        return {"status": pb2.ModelStatus.Name(response.status)}
+
+    def models(self, request):
+        import edge_agent_pb2 as pb2
+        response = base_l4v_client.get_stub().ListModels(pb2.ListModelsRequest())
+        return {model.model_component: pb2.ModelStatus.Name(model.status) for model in response.models}
+
+    def ping(self, request):
+        return {"pid": os.getpid(), "uptime": time.time() - self.started,
+                "cameras": sorted(self.cameras), "mqtt": self.mqtt_connection is not None}
+
+    def handle(self, request):
+        command = request.get("command")
+        if command not in ("detect", "capture", "start", "stop", "models", "ping"):
+            return {"ok": False, "error": "Unknown command " + str(command)}
+        start = time.perf_counter()
+        try:
+            result = getattr(self, command)(request)
+        except Exception as e:
+            return {"ok": False, "error": type(e).__name__ + ": " + str(e)}
+        return {"ok": True, "result": result, "elapsed_ms": (time.perf_counter() - start) * 1000}
+
+    def close(self):
+        for camera in self.cameras.values():
+            camera.release()
+        if self.mqtt_connection is not None:
+            self.mqtt_connection.disconnect().result()
+
+
+def make_handler(daemon):
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    response = daemon.handle(json.loads(line))
+                except ValueError as e:
+                    response = {"ok": False, "error": "Invalid request: " + str(e)}
+                self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+    return Handler
+
+
+def serve(daemon, socket_path=DEFAULT_SOCKET):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socketserver.ThreadingUnixStreamServer(socket_path, make_handler(daemon))
+    server.daemon_threads = True
+    print("l4v daemon listening on " + socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        daemon.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keeps the edge inference client resident for l4v.py.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument("--camera", action="append", default=[],
+                        help="a camera index or GStreamer pipeline to open at startup, can be repeated")
+    parser.add_argument("--mqtt", action="store_true", help="connect to AWS IoT Core at startup")
+    args = parser.parse_args()
+
+    daemon = InferenceDaemon()
+    start = time.perf_counter()
+    daemon.preload(args.camera, args.mqtt)
+    print(f"ready in {time.perf_counter() - start:.2f} s")
+    sys.stdout.flush()
+    serve(daemon, args.socket)
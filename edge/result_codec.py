@@ -0,0 +1,228 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
+import struct
+import time
+
+import numpy as np
+
+#
+# Encodes inspection results, including the anomaly mask of each defect class, as the compact
+# InspectionResult protobuf message in inspection-result.proto, and decodes them on the consumer
+# side. The protobuf wire format is written directly, so no generated code is needed here and
+# any protoc-generated class can read the payloads.
+#
+# Each class mask is run-length encoded: a 0/1 mask becomes a few varints per row that crosses a
+# defect, so a typical result with masks fits in a few hundred bytes instead of a JSON document,
+# or instead of the raw mask at width * height * 3 bytes.
+#
+# encoder, on the device:
+#   payload = encode_detect_result(response.detect_anomaly_result, camera="line1",
+#                                  model_component=component, mask_scale=4)
+# decoder, on the consumer:
+#   result = decode_result(payload)
+#   masks = {defect["name"]: decode_mask(defect, result["mask_width"], result["mask_height"])
+#            for defect in result["defects"]}
+#
+IGNORED_CLASSES = ("background",)
+
+VARINT = 0
+FIXED32 = 5
+LENGTH_DELIMITED = 2
+FIXED64 = 1
+
+
+def write_varint(value, out):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def write_key(field, wire_type, out):
+    write_varint((field << 3) | wire_type, out)
+
+
+def write_bytes(field, value, out):
+    write_key(field, LENGTH_DELIMITED, out)
+    write_varint(len(value), out)
+    out.extend(value)
+
+
+def mask_runs(class_mask):
+    """Returns the run lengths of a 0/1 mask, row by row, starting with a run of zeros."""
+    flat = np.ascontiguousarray(class_mask, dtype=bool).ravel()
+    if flat.size == 0:
+        return []
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], changes, [flat.size]))
+    runs = np.diff(bounds).tolist()
+    if flat[0]:
+        runs.insert(0, 0)
+    return runs
+
+
+def encode_defect(name, area, color, runs):
+    out = bytearray()
+    if name:
+        write_bytes(1, name.encode("utf-8"), out)
+    if area:
+        write_key(2, FIXED32, out)
+        out.extend(struct.pack("<f", area))
+    if color:
+        write_key(3, VARINT, out)
+        write_varint(color, out)
+    if runs:
+        packed = bytearray()
+        for run in runs:
+            write_varint(run, packed)
+        write_bytes(4, packed, out)
+    return bytes(out)
+
+
+def encode_result(is_anomalous, confidence, defects, mask_width=0, mask_height=0,
+                  camera="", model_component="", timestamp_ms=None):
+    """
+    Encodes an InspectionResult message.
+    defects is a list of (name, area, color as int, run lengths) tuples.
+    """
+    out = bytearray()
+    write_key(1, VARINT, out)
+    write_varint(int(time.time() * 1000) if timestamp_ms is None else timestamp_ms, out)
+    if camera:
+        write_bytes(2, camera.encode("utf-8"), out)
+    if model_component:
+        write_bytes(3, model_component.encode("utf-8"), out)
+    if is_anomalous:
+        write_key(4, VARINT, out)
+        write_varint(1, out)
+    if confidence:
+        write_key(5, FIXED32, out)
+        out.extend(struct.pack("<f", confidence))
+    if mask_width:
+        write_key(6, VARINT, out)
+        write_varint(mask_width, out)
+    if mask_height:
+        write_key(7, VARINT, out)
+        write_varint(mask_height, out)
+    for defect in defects:
+        write_bytes(8, encode_defect(*defect), out)
+    return bytes(out)
+
+
+def encode_detect_result(detect_anomaly_result, camera="", model_component="", mask_scale=1,
+                         timestamp_ms=None):
+    """
+    Encodes a DetectAnomalyResult from the Edge Agent with a run-length encoded mask per
+    defect class. mask_scale downsamples the mask by that factor in each direction first.
+    """
+    mask = None
+    bitmap = detect_anomaly_result.anomaly_mask
+    if bitmap.byte_data:
+        mask = np.frombuffer(bitmap.byte_data, dtype=np.uint8).reshape(bitmap.height, bitmap.width, 3)
+        mask = mask[::mask_scale, ::mask_scale]
+        packed = (mask[..., 0].astype(np.uint32) << 16) | (mask[..., 1].astype(np.uint32) << 8) | mask[..., 2]
+
+    defects = []
+    for anomaly in detect_anomaly_result.anomalies:
+        if anomaly.name in IGNORED_CLASSES:
+            continue
+        color = int(anomaly.pixel_anomaly.hex_color.lstrip("#") or "0", 16)
+        runs = mask_runs(packed == color) if mask is not None else []
+        defects.append((anomaly.name, anomaly.pixel_anomaly.total_percentage_area, color, runs))
+
+    height, width = mask.shape[:2] if mask is not None else (0, 0)
+    return encode_result(detect_anomaly_result.is_anomalous, detect_anomaly_result.confidence,
+                         defects, width, height, camera, model_component, timestamp_ms)
+
+
+def read_fields(data):
+    """Yields (field number, value) for each field of a message. Skips unknown wire types."""
+    position = 0
+    while position < len(data):
+        key, position = read_varint(data, position)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == VARINT:
+            value, position = read_varint(data, position)
+        elif wire_type == FIXED32:
+            value = data[position:position + 4]
+            position += 4
+        elif wire_type == FIXED64:
+            value = data[position:position + 8]
+            position += 8
+        elif wire_type == LENGTH_DELIMITED:
+            length, position = read_varint(data, position)
+            value = data[position:position + length]
+            position += length
+        else:
+            raise ValueError("Unsupported wire type %d" % wire_type)
+        yield field, value
+
+
+def decode_defect(data):
+    defect = {"name": "", "area": 0.0, "color": "#000000", "mask_runs": []}
+    for field, value in read_fields(data):
+        if field == 1:
+            defect["name"] = bytes(value).decode("utf-8")
+        elif field == 2:
+            defect["area"] = struct.unpack("<f", value)[0]
+        elif field == 3:
+            defect["color"] = "#%06X" % value
+        elif field == 4:
+            position = 0
+            while position < len(value):
+                run, position = read_varint(value, position)
+                defect["mask_runs"].append(run)
+    return defect
+
+
+def decode_result(payload):
+    """Decodes an InspectionResult message into a dictionary."""
+    result = {"timestamp_ms": 0, "camera": "", "model_component": "", "is_anomalous": False,
+              "confidence": 0.0, "mask_width": 0, "mask_height": 0, "defects": []}
+    for field, value in read_fields(memoryview(payload)):
+        if field == 1:
+            result["timestamp_ms"] = value
+        elif field == 2:
+            result["camera"] = bytes(value).decode("utf-8")
+        elif field == 3:
+            result["model_component"] = bytes(value).decode("utf-8")
+        elif field == 4:
+            result["is_anomalous"] = bool(value)
+        elif field == 5:
+            result["confidence"] = struct.unpack("<f", value)[0]
+        elif field == 6:
+            result["mask_width"] = value
+        elif field == 7:
+            result["mask_height"] = value
+        elif field == 8:
+            result["defects"].append(decode_defect(value))
+    return result
+
+
+def decode_mask(defect, width, height):
+    """Returns the 0/1 mask of a decoded defect as a height x width boolean array."""
+    values = np.zeros(len(defect["mask_runs"]), dtype=bool)
+    values[1::2] = True
+    mask = np.repeat(values, defect["mask_runs"])
+    mask = np.pad(mask, (0, width * height - mask.size))
+    return mask.reshape(height, width)
+
+
+def render_mask(result):
+    """Returns an RGB anomaly mask with each decoded defect class in its color."""
+    mask = np.zeros((result["mask_height"], result["mask_width"], 3), dtype=np.uint8)
+    for defect in result["defects"]:
+        color = bytes.fromhex(defect["color"].lstrip("#"))
+        mask[decode_mask(defect, result["mask_width"], result["mask_height"])] = list(color)
+    return mask
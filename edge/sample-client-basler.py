@@ -8,6 +8,7 @@ from edge_agent_pb2_grpc import (
 from pypylon import pylon
 import sys
 from base_l4v_client import process_segmentation, check_for_anomalies
+import tracing
 
 if (len(sys.argv) < 3):
     print("usage: capture-subject-basler <deviceSerialNumber> <componentName>")
@@ -24,19 +25,23 @@ camera = pylon.InstantCamera()
 camera.Attach(tl_factory.CreateFirstDevice(info)) # change this to use device serial number
 camera.Open()
 camera.StartGrabbing(1)
-grab = camera.RetrieveResult(5000, pylon.TimeoutHandling_Return)
+with tracing.span("RetrieveResult"):
+    grab = camera.RetrieveResult(5000, pylon.TimeoutHandling_Return)
 if grab.GrabSucceeded():
     img = grab.GetArray()
     print(f'Size of image: {img.shape}')
-    image = converter.Convert(grab)
-    img = image.GetArray()
+    with tracing.span("pylon Convert"):
+        image = converter.Convert(grab)
+        img = image.GetArray()
     cv2.namedWindow('title', cv2.WINDOW_NORMAL)
     cv2.imshow('title', img)
     cv2.waitKey(0)
     print("start client")
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    detect_anomalies_response = check_for_anomalies(img, sys.argv[2])
-    process_segmentation(img, detect_anomalies_response)
+    with tracing.span("frame"):
+        with tracing.span("cvtColor"):
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        detect_anomalies_response = check_for_anomalies(img, sys.argv[2])
+        process_segmentation(img, detect_anomalies_response)
 
 
 camera.Close()
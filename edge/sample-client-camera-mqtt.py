@@ -12,7 +12,9 @@ from awscrt import io, mqtt, auth, http
 from awsiot import mqtt_connection_builder
 import time as t
 import json
+import os
 from base_l4v_client import process_segmentation, check_for_anomalies
+import tracing
 
 ENDPOINT = "aidnfuomgla6i-ats.iot.us-east-1.amazonaws.com"
 CLIENT_ID = "l4vJetsonXavierNx"
@@ -20,6 +22,24 @@ PATH_TO_CERTIFICATE = "/greengrass/v2/thingCert.crt"
 PATH_TO_PRIVATE_KEY = "/greengrass/v2/privKey.key"
 PATH_TO_AMAZON_ROOT_CA_1 = "/greengrass/v2/rootCA.pem"
 TOPIC = "l4v/testclient"
+# Set L4V_MQTT_FORMAT=protobuf to publish the compact InspectionResult message from
+# inspection-result.proto, with the defect masks, to TOPIC + "/pb" instead of JSON.
+# Decode it with result_codec.decode_result.
+MQTT_FORMAT = os.environ.get("L4V_MQTT_FORMAT", "json")
+MASK_SCALE = int(os.environ.get("L4V_MASK_SCALE", "4"))
+# Set L4V_SUMMARY_INTERVAL to a number of seconds to inspect frames continuously. Anomalous
+# frames are published as they come and a summary of all frames to TOPIC + "/summary" once per
+# interval, see telemetry.py.
+SUMMARY_INTERVAL = float(os.environ.get("L4V_SUMMARY_INTERVAL", "0"))
+# In continuous mode, set L4V_GATE_DIFF to skip frames that differ from the last inferred frame
+# by less than that many gray levels on average, and L4V_GATE_ROI to x,y,w,h to also skip frames
+# without a part in that area, see frame_gate.py.
+GATE_DIFF = os.environ.get("L4V_GATE_DIFF")
+GATE_ROI = os.environ.get("L4V_GATE_ROI")
+# In continuous mode, set L4V_CLIP_DIR to keep the last frames in memory and save the
+# L4V_CLIP_FRAMES frames before and after each anomalous frame there as a clip, see frame_ring.py.
+CLIP_DIR = os.environ.get("L4V_CLIP_DIR")
+CLIP_FRAMES = int(os.environ.get("L4V_CLIP_FRAMES", "30"))
 
 
 
@@ -52,34 +72,7 @@ def gstreamer_pipeline(
           )
 
 
-if (len(sys.argv) < 2):
-    print("missing command line arguements. Example: <modelName> ")
-    sys.exit(1)
-cap = cv2.VideoCapture(gstreamer_pipeline(flip_method=0), cv2.CAP_GSTREAMER)
-if cap.isOpened():
-    ret_val, img = cap.read()
-    cv2.imwrite("frame.bmp",img)
-    cap.release()
-    print("start client <modelName>")
-
-    detect_anomalies_response = check_for_anomalies(img, sys.argv[1])
-    process_segmentation(img, detect_anomalies_response)
-        
-    anomalies = {}
-    for anomaly in detect_anomalies_response.detect_anomaly_result.anomalies:
-        anomalies[anomaly.name] = {
-            "height": detect_anomalies_response.detect_anomaly_result.anomaly_mask.height,
-            "width": detect_anomalies_response.detect_anomaly_result.anomaly_mask.width
-        }
-
-    messageToIotCore = {
-        "is_anomalous": str(detect_anomalies_response.detect_anomaly_result.is_anomalous),
-        "confidence": detect_anomalies_response.detect_anomaly_result.confidence,
-        "anomalies": anomalies
-    }
-
-    print("message to MQTT:"+json.dumps(messageToIotCore, indent=4))
-
+def connect_mqtt():
     event_loop_group = io.EventLoopGroup(1)
     host_resolver = io.DefaultHostResolver(event_loop_group)
     client_bootstrap = io.ClientBootstrap(event_loop_group, host_resolver)
@@ -100,12 +93,116 @@ if cap.isOpened():
     # Future.result() waits until a result is available
     connect_future.result()
     print("Connected!")
+    return mqtt_connection
+
+
+def publish_result(mqtt_connection, detect_anomalies_response, model_component):
+    if MQTT_FORMAT == "protobuf":
+        from result_codec import encode_detect_result
+        payload = encode_detect_result(detect_anomalies_response.detect_anomaly_result,
+                                       camera=CLIENT_ID, model_component=model_component,
+                                       mask_scale=MASK_SCALE)
+        mqtt_connection.publish(topic=TOPIC + "/pb", payload=payload, qos=mqtt.QoS.AT_LEAST_ONCE)
+        print("Published " + str(len(payload)) + " bytes to the topic: " + TOPIC + "/pb")
+    else:
+        anomalies = {}
+        for anomaly in detect_anomalies_response.detect_anomaly_result.anomalies:
+            anomalies[anomaly.name] = {
+                "height": detect_anomalies_response.detect_anomaly_result.anomaly_mask.height,
+                "width": detect_anomalies_response.detect_anomaly_result.anomaly_mask.width
+            }
+
+        messageToIotCore = {
+            "is_anomalous": str(detect_anomalies_response.detect_anomaly_result.is_anomalous),
+            "confidence": detect_anomalies_response.detect_anomaly_result.confidence,
+            "anomalies": anomalies
+        }
+
+        print("message to MQTT:"+json.dumps(messageToIotCore, indent=4))
+        data = "{} [{}]".format(str(messageToIotCore), 1)
+        message = {"message" : data}
+        mqtt_connection.publish(topic=TOPIC, payload=json.dumps(message), qos=mqtt.QoS.AT_LEAST_ONCE)
+        print("Published: '" + json.dumps(message) + "' to the topic: " + TOPIC)
+
+
+def run_continuous(cap, model_component):
+    # Publishes anomalous frames as they come and one summary of all frames per interval,
+    # instead of one message per frame.
+    from telemetry import TelemetryAggregator, summary_json
+    mqtt_connection = connect_mqtt()
+    aggregator = TelemetryAggregator(
+        lambda summary: mqtt_connection.publish(topic=TOPIC + "/summary", payload=summary_json(summary),
+                                                qos=mqtt.QoS.AT_LEAST_ONCE),
+        interval=SUMMARY_INTERVAL, camera=CLIENT_ID, model_component=model_component)
+    print("publishing a summary to " + TOPIC + "/summary every " + str(SUMMARY_INTERVAL) + " seconds")
+    gate = None
+    if GATE_DIFF:
+        from frame_gate import FrameGate, parse_roi
+        gate = FrameGate(float(GATE_DIFF), roi=parse_roi(GATE_ROI) if GATE_ROI else None)
+    clips = None
+    if CLIP_DIR:
+        from frame_ring import FrameRing, ClipRecorder
+        clips = ClipRecorder(FrameRing(capacity=3 * CLIP_FRAMES), before=CLIP_FRAMES, after=CLIP_FRAMES,
+                             directory=CLIP_DIR, fps=cap.get(cv2.CAP_PROP_FPS) or 30.0)
+    try:
+        while True:
+            with tracing.span("frame"):
+                with tracing.span("read"):
+                    ret_val, img = cap.read()
+                if not ret_val:
+                    print("Unable to read from camera")
+                    break
+                if clips is not None:
+                    # Skipped frames are kept too, they show what happened around an anomaly.
+                    with tracing.span("ring"):
+                        frame_number = clips.add(img)
+                if gate is not None:
+                    with tracing.span("gate"):
+                        infer = gate.check(img)[0]
+                    if not infer:
+                        aggregator.skip()
+                        continue
+                start = time.perf_counter()
+                detect_anomalies_response = check_for_anomalies(img, model_component)
+                aggregator.add(detect_anomalies_response.detect_anomaly_result,
+                               (time.perf_counter() - start) * 1000)
+                if detect_anomalies_response.detect_anomaly_result.is_anomalous:
+                    if clips is not None:
+                        clips.trigger(frame_number, {
+                            "confidence": detect_anomalies_response.detect_anomaly_result.confidence})
+                    with tracing.span("publish"):
+                        publish_result(mqtt_connection, detect_anomalies_response, model_component)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cap.release()
+        aggregator.close()
+        if clips is not None:
+            clips.close()
+        if gate is not None:
+            print("frame gate: " + json.dumps(gate.stats()))
+        mqtt_connection.disconnect().result()
+
+
+if (len(sys.argv) < 2):
+    print("missing command line arguements. Example: <modelName> ")
+    sys.exit(1)
+cap = cv2.VideoCapture(gstreamer_pipeline(flip_method=0), cv2.CAP_GSTREAMER)
+if cap.isOpened() and SUMMARY_INTERVAL > 0:
+    run_continuous(cap, sys.argv[1])
+elif cap.isOpened():
+    ret_val, img = cap.read()
+    cv2.imwrite("frame.bmp",img)
+    cap.release()
+    print("start client <modelName>")
+
+    detect_anomalies_response = check_for_anomalies(img, sys.argv[1])
+    process_segmentation(img, detect_anomalies_response)
+
+    mqtt_connection = connect_mqtt()
     # Publish message to server desired number of times.
     print('Begin Publish')
-    data = "{} [{}]".format(str(messageToIotCore), 1)
-    message = {"message" : data}
-    mqtt_connection.publish(topic=TOPIC, payload=json.dumps(message), qos=mqtt.QoS.AT_LEAST_ONCE)
-    print("Published: '" + json.dumps(message) + "' to the topic: " + TOPIC)
+    publish_result(mqtt_connection, detect_anomalies_response, sys.argv[1])
     t.sleep(0.1)
     print('Publish End')
     disconnect_future = mqtt_connection.disconnect()
@@ -3,6 +3,7 @@ import time
 import cv2
 from base_l4v_client import process_segmentation, check_for_anomalies
 import sys
+import tracing
 
 
 def gstreamer_pipeline(
@@ -39,13 +40,16 @@ if (len(sys.argv) < 2):
 
 cap = cv2.VideoCapture(gstreamer_pipeline(flip_method=0), cv2.CAP_GSTREAMER)
 if cap.isOpened():
-    ret_val, img = cap.read()
-    cv2.imwrite("frame.bmp", img)
-    cap.release()
-    print("start client <modelName>")
-    
-    detect_anomalies_response = check_for_anomalies(img, sys.argv[1])
-    process_segmentation(img, detect_anomalies_response)
+    with tracing.span("frame"):
+        with tracing.span("read"):
+            ret_val, img = cap.read()
+        with tracing.span("imwrite"):
+            cv2.imwrite("frame.bmp", img)
+        cap.release()
+        print("start client <modelName>")
+
+        detect_anomalies_response = check_for_anomalies(img, sys.argv[1])
+        process_segmentation(img, detect_anomalies_response)
 
 
 else:
@@ -11,6 +11,7 @@ from awscrt import io, mqtt, auth, http
 from awsiot import mqtt_connection_builder
 import time as t
 import json
+import os
 
 from base_l4v_client import process_segmentation, check_for_anomalies
 
@@ -20,6 +21,11 @@ PATH_TO_CERTIFICATE = "/greengrass/v2/thingCert.crt"
 PATH_TO_PRIVATE_KEY = "/greengrass/v2/privKey.key"
 PATH_TO_AMAZON_ROOT_CA_1 = "/greengrass/v2/rootCA.pem"
 TOPIC = "l4v/testclient"
+# Set L4V_MQTT_FORMAT=protobuf to publish the compact InspectionResult message from
+# inspection-result.proto, with the defect masks, to TOPIC + "/pb" instead of JSON.
+# Decode it with result_codec.decode_result.
+MQTT_FORMAT = os.environ.get("L4V_MQTT_FORMAT", "json")
+MASK_SCALE = int(os.environ.get("L4V_MASK_SCALE", "4"))
 
 
 if (len(sys.argv) < 3):
@@ -73,12 +79,20 @@ connect_future.result()
 print("Connected!")
 # Publish message to server desired number of times.
 print('Begin Publish')
-data = "{} [{}]".format(str(messageToIotCore), 1)
-message = {"message": data,
-           "is_anomalous": detect_anomalies_response.detect_anomaly_result.is_anomalous}
-mqtt_connection.publish(topic=TOPIC, payload=json.dumps(
-    message), qos=mqtt.QoS.AT_LEAST_ONCE)
-print("Published: '" + json.dumps(message) + "' to the topic: " + TOPIC)
+if MQTT_FORMAT == "protobuf":
+    from result_codec import encode_detect_result
+    payload = encode_detect_result(detect_anomalies_response.detect_anomaly_result,
+                                   camera=CLIENT_ID, model_component=sys.argv[2],
+                                   mask_scale=MASK_SCALE)
+    mqtt_connection.publish(topic=TOPIC + "/pb", payload=payload, qos=mqtt.QoS.AT_LEAST_ONCE)
+    print("Published " + str(len(payload)) + " bytes to the topic: " + TOPIC + "/pb")
+else:
+    data = "{} [{}]".format(str(messageToIotCore), 1)
+    message = {"message": data,
+               "is_anomalous": detect_anomalies_response.detect_anomaly_result.is_anomalous}
+    mqtt_connection.publish(topic=TOPIC, payload=json.dumps(
+        message), qos=mqtt.QoS.AT_LEAST_ONCE)
+    print("Published: '" + json.dumps(message) + "' to the topic: " + TOPIC)
 t.sleep(0.1)
 print('Publish End')
 disconnect_future = mqtt_connection.disconnect()
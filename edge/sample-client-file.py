@@ -1,21 +1,46 @@
 # // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
 
 
-import cv2
+import os
 import sys
-# this base file below has the reusable functions common across these scripts
-from base_l4v_client import process_segmentation, check_for_anomalies
+import json
+import socket
+import tracing
+# l4v.py only imports the standard library, so checking for the daemon first costs nothing
+from l4v import daemon_request
 
 
+tracing.enable_from_args()
+
 if (len(sys.argv) < 3):
     print("missing command line arguements. Example: <imagefile> <modelName> ")
     sys.exit(1)
 
-img = cv2.imread(sys.argv[1])
-# this is very important to covert to RGB or you will not get good results
-img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 print("start client "+str(sys.argv))
 
-detect_anomalies_response = check_for_anomalies(img, sys.argv[2])
-process_segmentation(img, detect_anomalies_response)
+# If l4v_daemon.py is running it already has the libraries loaded and the channel open
+try:
+    response = daemon_request({"command": "detect", "image": os.path.abspath(sys.argv[1]),
+                               "model": sys.argv[2], "segment": True, "output_dir": os.getcwd()})
+except (FileNotFoundError, ConnectionRefusedError):
+    response = None
+except socket.timeout:
+    print("l4v daemon didn't respond, check it with python3 l4v.py ping")
+    sys.exit(1)
+if response is not None:
+    print(json.dumps(response.get("result", response), indent=4))
+    sys.exit(0 if response["ok"] else 1)
+
+import cv2
+# this base file below has the reusable functions common across these scripts
+from base_l4v_client import process_segmentation, check_for_anomalies
+
+with tracing.span("frame", image=sys.argv[1]):
+    with tracing.span("imread"):
+        img = cv2.imread(sys.argv[1])
+    # this is very important to covert to RGB or you will not get good results
+    with tracing.span("cvtColor"):
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
+    detect_anomalies_response = check_for_anomalies(img, sys.argv[2])
+    process_segmentation(img, detect_anomalies_response)
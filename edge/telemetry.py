@@ -0,0 +1,138 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
+import json
+import time
+import bisect
+import threading
+
+#
+# Aggregates inspection results into windows, so a camera running at 30 fps sends one summary
+# message per interval instead of one MQTT message per frame. Each window counts the frames,
+# the frames skipped without inference, the anomalous frames and the frames with each defect
+# class, and keeps fixed-bucket histograms of the confidence and of the inference latency, from
+# which the latency percentiles are estimated. A background thread closes the window every
+# interval and passes its summary to a publish function. Anomalous frames are not held back:
+# the client publishes them as they come.
+#
+#   aggregator = TelemetryAggregator(lambda summary: publish(TOPIC + "/summary", summary),
+#                                    interval=60, camera="line1", model_component=component)
+#   aggregator.add(detect_anomalies_response.detect_anomaly_result, latency_ms)
+#   ...
+#   aggregator.close()
+#
+IGNORED_CLASSES = ("background",)
+CONFIDENCE_BINS = 10
+# Upper bounds of the latency buckets in milliseconds, the last bucket has no upper bound.
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000, 2000, 5000)
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+class TelemetryWindow:
+
+    def __init__(self, start=None):
+        self.start = start or time.time()
+        self.frames = 0
+        self.skipped = 0
+        self.anomalous = 0
+        self.classes = {}
+        self.confidence = [0] * CONFIDENCE_BINS
+        self.latency = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def add(self, is_anomalous, confidence, class_names, latency_ms):
+        self.frames += 1
+        self.anomalous += int(is_anomalous)
+        for name in class_names:
+            self.classes[name] = self.classes.get(name, 0) + 1
+        self.confidence[min(int(confidence * CONFIDENCE_BINS), CONFIDENCE_BINS - 1)] += 1
+        self.latency[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        self.latency_sum += latency_ms
+        self.latency_max = max(self.latency_max, latency_ms)
+
+    def latency_percentile(self, percentile):
+        """Estimates a latency percentile as the upper bound of the bucket it falls in."""
+        if self.frames == 0:
+            return 0.0
+        rank = percentile / 100 * self.frames
+        count = 0
+        for bucket, bucket_count in enumerate(self.latency):
+            count += bucket_count
+            if count >= rank:
+                if bucket == len(LATENCY_BUCKETS_MS):
+                    break
+                return min(float(LATENCY_BUCKETS_MS[bucket]), self.latency_max)
+        return self.latency_max
+
+    def summary(self, end=None):
+        latency = {f"p{percentile}": self.latency_percentile(percentile) for percentile in LATENCY_PERCENTILES}
+        latency["mean"] = self.latency_sum / self.frames if self.frames else 0.0
+        latency["max"] = self.latency_max
+        return {
+            "window_start": self.start,
+            "window_end": end or time.time(),
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "anomalous": self.anomalous,
+            "anomaly_rate": self.anomalous / self.frames if self.frames else 0.0,
+            "classes": self.classes,
+            "confidence_histogram": self.confidence,
+            "latency_ms": latency
+        }
+
+
+class TelemetryAggregator:
+
+    def __init__(self, publish, interval=60.0, camera="default", model_component=""):
+        """
+        publish is called with each window's summary as a dictionary, from the aggregator thread.
+        """
+        self.publish = publish
+        self.interval = interval
+        self.camera = camera
+        self.model_component = model_component
+        self.lock = threading.Lock()
+        self.window = TelemetryWindow()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="telemetry", daemon=True)
+        self.thread.start()
+
+    def add(self, detect_anomaly_result, latency_ms, min_area=0.0):
+        """Counts a DetectAnomalyResult and the time it took in the current window."""
+        class_names = [anomaly.name for anomaly in detect_anomaly_result.anomalies
+                       if anomaly.name not in IGNORED_CLASSES
+                       and anomaly.pixel_anomaly.total_percentage_area > min_area]
+        with self.lock:
+            self.window.add(detect_anomaly_result.is_anomalous, detect_anomaly_result.confidence,
+                            class_names, latency_ms)
+
+    def skip(self):
+        """Counts a frame that wasn't inferred, for example because frame_gate.py found it unchanged."""
+        with self.lock:
+            self.window.skipped += 1
+
+    def flush(self):
+        """Closes the current window and publishes its summary."""
+        now = time.time()
+        with self.lock:
+            window, self.window = self.window, TelemetryWindow(now)
+        summary = window.summary(now)
+        summary["camera"] = self.camera
+        summary["model_component"] = self.model_component
+        try:
+            self.publish(summary)
+        except Exception as e:
+            print("failed to publish telemetry summary: " + str(e))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        """Stops the aggregator thread and publishes the last window."""
+        self.stopped.set()
+        self.thread.join()
+        self.flush()
+
+
+def summary_json(summary):
+    return json.dumps(summary, separators=(",", ":"))
@@ -0,0 +1,200 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import tracing
+import base_l4v_client
+from base_l4v_client import detect_anomalies, process_segmentation
+
+#
+# Inspects a high resolution frame at full detail by splitting it into overlapping tiles at the
+# model's input size, instead of resizing it or cropping it by hand. The tiles are sent to the
+# Edge Agent concurrently, so each call carries a small image, and the anomaly masks that come
+# back are stitched into one mask the size of the frame.
+#
+# Predictions near the edge of a tile see less context, so where tiles overlap each tile's
+# votes are weighted by a ramp that falls off towards its edges: a pixel gets the defect class
+# with the most weight, if that is at least half of the weight of all the tiles covering it.
+# The result is a DetectAnomaliesResponse for the whole frame, with the areas recomputed from
+# the stitched mask, so process_segmentation, the inspection history and result_codec work on
+# it unchanged.
+#
+# usage: python3 tiled_inference.py <imagefile> <componentName> [--tile 1024x1024] [--overlap 0.25] [--workers 4]
+#
+DEFAULT_TILE = (1024, 1024)
+DEFAULT_OVERLAP = 0.25
+DEFAULT_WORKERS = 4
+IGNORED_CLASSES = ("background",)
+# Used when no tile reports a background class.
+DEFAULT_BACKGROUND_COLOR = "#000000"
+MIN_WEIGHT = 0.05
+
+
+def parse_size(text):
+    """Parses a size such as 1024x768 into (width, height)."""
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def tile_origins(length, tile, overlap):
+    """Returns the start of each tile along one axis. The last tile ends at the edge of the frame."""
+    if length <= tile:
+        return [0]
+    stride = max(1, int(tile * (1 - overlap)))
+    origins = list(range(0, length - tile, stride))
+    origins.append(length - tile)
+    return origins
+
+
+def ramp(length, width):
+    """Weights along one axis of a tile, rising from the edges over width pixels."""
+    distance = np.minimum(np.arange(length), np.arange(length)[::-1]) + 1
+    return np.clip(distance / (width + 1), MIN_WEIGHT, 1.0).astype(np.float32)
+
+
+def tile_boxes(width, height, tile_size=DEFAULT_TILE, overlap=DEFAULT_OVERLAP):
+    """Returns (x, y, w, h) of the tiles that cover a frame."""
+    tile_w, tile_h = min(tile_size[0], width), min(tile_size[1], height)
+    return [(x, y, tile_w, tile_h)
+            for y in tile_origins(height, tile_h, overlap)
+            for x in tile_origins(width, tile_w, overlap)]
+
+
+class MaskStitcher:
+    """Accumulates the weighted class votes of the tile masks for one frame."""
+
+    def __init__(self, width, height, tile_size, overlap):
+        self.width = width
+        self.height = height
+        tile_w, tile_h = min(tile_size[0], width), min(tile_size[1], height)
+        self.weights = np.outer(ramp(tile_h, int(tile_h * overlap)), ramp(tile_w, int(tile_w * overlap)))
+        self.total = np.zeros((height, width), dtype=np.float32)
+        self.votes = {}
+        self.names = {}
+        self.background_color = None
+
+    def add(self, x, y, detect_anomaly_result):
+        import cv2
+        h, w = self.weights.shape
+        self.total[y:y + h, x:x + w] += self.weights
+        bitmap = detect_anomaly_result.anomaly_mask
+        if not bitmap.byte_data:
+            return
+        mask = np.frombuffer(bitmap.byte_data, dtype=np.uint8).reshape(bitmap.height, bitmap.width, 3)
+        if mask.shape[:2] != (h, w):
+            mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_NEAREST)
+        packed = (mask[..., 0].astype(np.uint32) << 16) | (mask[..., 1].astype(np.uint32) << 8) | mask[..., 2]
+        for anomaly in detect_anomaly_result.anomalies:
+            color = anomaly.pixel_anomaly.hex_color.upper()
+            if anomaly.name in IGNORED_CLASSES:
+                if self.background_color is None:
+                    self.background_color = color
+                continue
+            class_pixels = packed == int(color.lstrip("#"), 16)
+            if not class_pixels.any():
+                continue
+            self.names[color] = anomaly.name
+            if color not in self.votes:
+                self.votes[color] = np.zeros((self.height, self.width), dtype=np.float32)
+            self.votes[color][y:y + h, x:x + w] += self.weights * class_pixels
+
+    def mask(self):
+        """
+        Returns the stitched RGB mask, with the background in the color the tiles reported for it,
+        and the number of pixels of each class color in it, background included.
+        """
+        background_color = self.background_color or DEFAULT_BACKGROUND_COLOR
+        mask = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        mask[:] = list(bytes.fromhex(background_color.lstrip("#")))
+        if not self.votes:
+            return mask, {background_color: self.width * self.height}
+        colors = list(self.votes)
+        votes = np.stack([self.votes[color] for color in colors])
+        best = votes.argmax(axis=0)
+        selected = np.take_along_axis(votes, best[None], axis=0)[0] >= 0.5 * self.total
+        pixels = {background_color: int(self.width * self.height - np.count_nonzero(selected))}
+        for index, color in enumerate(colors):
+            class_pixels = selected & (best == index)
+            mask[class_pixels] = list(bytes.fromhex(color.lstrip("#")))
+            pixels[color] = int(np.count_nonzero(class_pixels))
+        return mask, pixels
+
+
+def detect_tile(tile, model_component, x, y, parent):
+    # The tiles run on worker threads, so their spans are attached to the caller's span explicitly.
+    with tracing.span("tile", parent=parent, x=x, y=y):
+        return detect_anomalies(tile, model_component)
+
+
+@tracing.traced("detect_tiled")
+def detect_tiled(img, model_component, tile_size=DEFAULT_TILE, overlap=DEFAULT_OVERLAP,
+                 max_workers=DEFAULT_WORKERS):
+    """
+    Runs DetectAnomalies on overlapping tiles of an RGB image and stitches the results.
+    Returns a DetectAnomaliesResponse for the whole image.
+    """
+    import edge_agent_pb2 as pb2
+    height, width = img.shape[:2]
+    boxes = tile_boxes(width, height, tile_size, overlap)
+    stitcher = MaskStitcher(width, height, tile_size, overlap)
+    anomalous = []
+    normal = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        parent = tracing.current()
+        futures = {executor.submit(detect_tile, img[y:y + h, x:x + w], model_component, x, y, parent): (x, y)
+                   for x, y, w, h in boxes}
+        # Stitch each tile as it arrives, so only the tiles in flight are held in memory.
+        for future in as_completed(futures):
+            result = future.result().detect_anomaly_result
+            (anomalous if result.is_anomalous else normal).append(result.confidence)
+            with tracing.span("stitch tile"):
+                stitcher.add(*futures[future], result)
+
+    with tracing.span("stitch mask"):
+        mask, pixels = stitcher.mask()
+    anomalies = [pb2.Anomaly(name=stitcher.names.get(color, IGNORED_CLASSES[0]), pixel_anomaly=pb2.PixelAnomaly(
+                     total_percentage_area=count / (width * height), hex_color=color))
+                 for color, count in pixels.items()]
+    # The frame is anomalous if any tile is, with the most confident of those tiles. A normal
+    # frame is only as certain as its least confident tile.
+    detect_anomalies_response = pb2.DetectAnomaliesResponse(detect_anomaly_result=pb2.DetectAnomalyResult(
+        is_anomalous=bool(anomalous),
+        confidence=max(anomalous) if anomalous else min(normal),
+        anomaly_mask=pb2.Bitmap(width=width, height=height, byte_data=mask.tobytes()),
+        anomalies=anomalies))
+    if base_l4v_client.history is not None:
+        base_l4v_client.history.record_result(detect_anomalies_response.detect_anomaly_result,
+                                              os.environ.get("L4V_CAMERA", "default"), model_component)
+    return detect_anomalies_response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspects a large image in overlapping tiles.")
+    parser.add_argument("image")
+    parser.add_argument("model_component")
+    parser.add_argument("--tile", type=parse_size, default=DEFAULT_TILE,
+                        help="the model's input size, e.g. 1024x1024")
+    parser.add_argument("--overlap", type=float, default=DEFAULT_OVERLAP,
+                        help="the fraction of a tile that overlaps its neighbors")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="the number of tiles sent to the Edge Agent at once")
+    args = parser.parse_args()
+
+    import cv2
+    img = cv2.imread(args.image)
+    if img is None:
+        print("unable to read " + args.image)
+        sys.exit(1)
+    # this is very important to covert to RGB or you will not get good results
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    height, width = img.shape[:2]
+    start = time.perf_counter()
+    detect_anomalies_response = detect_tiled(img, args.model_component, args.tile, args.overlap, args.workers)
+    print(f"{len(tile_boxes(width, height, args.tile, args.overlap))} tiles of {args.tile[0]}x{args.tile[1]} "
+          f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+    process_segmentation(img, detect_anomalies_response)
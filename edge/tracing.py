@@ -0,0 +1,223 @@
+# // Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. // SPDX-License-Identifier: MIT-0
+import os
+import sys
+import json
+import time
+import random
+import atexit
+import functools
+import threading
+from collections import deque
+
+#
+# Span tracing for the edge clients, to see where a frame's time goes on the device: image
+# conversion, tobytes, the DetectAnomalies RPC, reading and blending the mask, writing files.
+#
+# Wrap each stage in a span; spans opened inside another span on the same thread become its
+# children, and a span can be given an explicit parent to continue a trace on another thread:
+#
+#   with tracing.span("frame"):
+#       with tracing.span("cvtColor"):
+#           img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+#
+# Tracing is off unless a client is started with --trace[=prefix] or L4V_TRACE=prefix; then
+# span() returns a shared no-op context, so the hooks cost well under a microsecond. When on, a
+# sample_rate fraction of the traces is kept (L4V_TRACE_SAMPLE, default all of them) in a ring
+# buffer of the last capacity spans, and at exit they are written as <prefix>.trace.json in the
+# Chrome trace event format, for chrome://tracing or https://ui.perfetto.dev, and as
+# <prefix>.otlp.json in the OTLP JSON file format the OpenTelemetry Collector reads.
+#
+DEFAULT_PREFIX = "l4v"
+DEFAULT_CAPACITY = 100000
+SERVICE_NAME = "l4v-edge"
+
+
+class NullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "thread", "attributes")
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else random.getrandbits(128)
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent.span_id if parent is not None else 0
+        self.attributes = attributes
+        self.thread = threading.get_ident()
+        self.start_ns = 0
+        self.end_ns = 0
+
+    def __enter__(self):
+        self.tracer.local.stack.append(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.end_ns = time.perf_counter_ns()
+        self.tracer.local.stack.pop()
+        if exc_info[0] is not None:
+            self.attributes["error"] = exc_info[0].__name__
+        self.tracer.spans.append(self)
+        return False
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+
+class Tracer:
+
+    def __init__(self, sample_rate=1.0, capacity=DEFAULT_CAPACITY):
+        self.sample_rate = sample_rate
+        # A deque with maxlen drops the oldest spans, and its appends are thread safe.
+        self.spans = deque(maxlen=capacity)
+        self.local = threading.local()
+        # perf_counter has no epoch, so remember where it was at a known wall clock time.
+        self.epoch_offset_ns = time.time_ns() - time.perf_counter_ns()
+
+    def current(self):
+        stack = getattr(self.local, "stack", None)
+        return stack[-1] if stack else None
+
+    def span(self, name, parent=None, **attributes):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        parent = parent or self.current()
+        if parent is NULL_SPAN:
+            return NULL_SPAN
+        if parent is None and random.random() >= self.sample_rate:
+            # Not sampled: the children of this span are dropped with it.
+            return NullRoot(self)
+        return Span(self, name, parent, attributes)
+
+    def chrome_trace(self):
+        events = []
+        pid = os.getpid()
+        for span in list(self.spans):
+            events.append({
+                "name": span.name,
+                "ph": "X",
+                "ts": (span.start_ns + self.epoch_offset_ns) / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": pid,
+                "tid": span.thread,
+                "args": dict(span.attributes, trace_id="%032x" % span.trace_id)
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def otlp(self):
+        spans = []
+        for span in list(self.spans):
+            otlp_span = {
+                "traceId": "%032x" % span.trace_id,
+                "spanId": "%016x" % span.span_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start_ns + self.epoch_offset_ns),
+                "endTimeUnixNano": str(span.end_ns + self.epoch_offset_ns),
+                "attributes": [otlp_attribute(key, value) for key, value in span.attributes.items()]
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = "%016x" % span.parent_id
+            spans.append(otlp_span)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [otlp_attribute("service.name", SERVICE_NAME),
+                                        otlp_attribute("process.pid", os.getpid())]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}]
+        }]}
+
+    def export(self, prefix=DEFAULT_PREFIX):
+        """Writes the recorded spans as <prefix>.trace.json and <prefix>.otlp.json."""
+        with open(prefix + ".trace.json", "w") as f:
+            json.dump(self.chrome_trace(), f)
+        # The OTLP file format has one export request per line.
+        with open(prefix + ".otlp.json", "w") as f:
+            f.write(json.dumps(self.otlp()) + "\n")
+        print(f"wrote {len(self.spans)} spans to {prefix}.trace.json and {prefix}.otlp.json")
+
+
+class NullRoot(NullSpan):
+    """An unsampled root span. It is pushed like a span so the spans inside it are dropped too."""
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def __enter__(self):
+        self.tracer.local.stack.append(NULL_SPAN)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.local.stack.pop()
+        return False
+
+
+def otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+tracer = None
+
+
+def span(name, parent=None, **attributes):
+    """Returns a span context for a stage, or a no-op context when tracing is off."""
+    if tracer is None:
+        return NULL_SPAN
+    return tracer.span(name, parent, **attributes)
+
+
+def traced(name):
+    """Decorates a function to run in a span."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current():
+    return tracer.current() if tracer is not None else None
+
+
+def enable(prefix=DEFAULT_PREFIX, sample_rate=1.0, capacity=DEFAULT_CAPACITY):
+    """Turns tracing on and exports the spans at exit."""
+    global tracer
+    if tracer is None:
+        tracer = Tracer(sample_rate, capacity)
+        atexit.register(tracer.export, prefix)
+    return tracer
+
+
+def enable_from_args(argv=sys.argv):
+    """
+    Turns tracing on if the command line has --trace or --trace=prefix, or L4V_TRACE is set.
+    The flag is removed from argv, so the scripts' positional arguments are unchanged.
+    """
+    prefix = os.environ.get("L4V_TRACE")
+    for arg in list(argv[1:]):
+        if arg == "--trace" or arg.startswith("--trace="):
+            prefix = arg.partition("=")[2] or DEFAULT_PREFIX
+            argv.remove(arg)
+    if prefix:
+        enable(prefix, float(os.environ.get("L4V_TRACE_SAMPLE", "1.0")))
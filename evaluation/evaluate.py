@@ -0,0 +1,276 @@
+import os
+import sys
+import io
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+'''
+This script will:
+1. Read a labeled folder of images (normal/ and anomaly/ subfolders)
+2. Run every image concurrently through a model, either the cloud
+   detect_anomalies API or a model component on an edge device
+3. Cache the detections per model version, so re-scoring is free
+4. Print precision/recall at a threshold, the ROC AUC over the anomaly score,
+   and per-class pixel IoU against ground-truth masks
+
+The anomaly score of an image is its confidence if the model says it is
+anomalous, and 1 - confidence otherwise.
+'''
+
+NORMAL_FOLDER = 'normal'
+ANOMALY_FOLDER = 'anomaly'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+DEFAULT_CACHE_DIR = '.evaluation-cache'
+DEFAULT_SOCKET = 'unix:///tmp/aws.iot.lookoutvision.EdgeAgent.sock'
+
+
+def labeled_images(image_folder):
+    """Returns (relative path, label) for the images in the normal and anomaly folders."""
+    images = []
+    for label, folder in ((0, NORMAL_FOLDER), (1, ANOMALY_FOLDER)):
+        folder_path = Path(image_folder) / folder
+        if not folder_path.is_dir():
+            continue
+        for filename in sorted(os.listdir(folder_path)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                images.append((f'{folder}/{filename}', label))
+    return images
+
+
+def cloud_detector(project_name, model_version, region=None, endpoint_url=None, max_workers=8):
+    """Returns a function that runs an image file through the cloud detect_anomalies API."""
+    import boto3
+    from botocore.config import Config
+
+    client = boto3.client('lookoutvision', region, endpoint_url=endpoint_url,
+                          config=Config(max_pool_connections=max_workers))
+
+    def detect(image_path):
+        content_type = 'image/png' if image_path.lower().endswith('.png') else 'image/jpeg'
+        with open(image_path, 'rb') as image:
+            response = client.detect_anomalies(ProjectName=project_name, ContentType=content_type,
+                                               Body=image.read(), ModelVersion=model_version)
+        result = response['DetectAnomalyResult']
+        mask = None
+        if result.get('AnomalyMask'):
+            mask = np.asarray(Image.open(io.BytesIO(result['AnomalyMask'])).convert('RGB'))
+        anomalies = {anomaly['Name']: (anomaly['PixelAnomaly']['Color'],
+                                       anomaly['PixelAnomaly']['TotalPercentageArea'])
+                     for anomaly in result.get('Anomalies', [])}
+        return result['IsAnomalous'], result['Confidence'], mask, anomalies
+
+    return detect
+
+
+def edge_detector(model_component, socket=DEFAULT_SOCKET):
+    """Returns a function that runs an image file through a model component on an edge device."""
+    import grpc
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'edge'))
+    import edge_agent_pb2 as pb2
+    from edge_agent_pb2_grpc import EdgeAgentStub
+
+    stub = EdgeAgentStub(grpc.insecure_channel(socket))
+
+    def detect(image_path):
+        img = np.asarray(Image.open(image_path).convert('RGB'))
+        h, w, c = img.shape
+        response = stub.DetectAnomalies(pb2.DetectAnomaliesRequest(
+            model_component=model_component,
+            bitmap=pb2.Bitmap(width=w, height=h, byte_data=img.tobytes())))
+        result = response.detect_anomaly_result
+        mask = None
+        if result.anomaly_mask.byte_data:
+            mask = np.frombuffer(result.anomaly_mask.byte_data, dtype=np.uint8).reshape(
+                result.anomaly_mask.height, result.anomaly_mask.width, 3)
+        anomalies = {anomaly.name: (anomaly.pixel_anomaly.hex_color,
+                                    anomaly.pixel_anomaly.total_percentage_area)
+                     for anomaly in result.anomalies}
+        return result.is_anomalous, result.confidence, mask, anomalies
+
+    return detect
+
+
+def load_cache(cache_path):
+    results = {}
+    if (cache_path / 'results.jsonl').exists():
+        with open(cache_path / 'results.jsonl') as cache_file:
+            for line in cache_file:
+                result = json.loads(line)
+                results[result['image']] = result
+    return results
+
+
+def run_detections(image_folder, images, detect, cache_path, max_workers=8):
+    """
+    Runs the images that aren't cached yet through detect concurrently and
+    appends the results, and any predicted masks, to the cache.
+    Returns the results for all images.
+    """
+    cache_path.mkdir(parents=True, exist_ok=True)
+    (cache_path / 'masks').mkdir(exist_ok=True)
+    results = load_cache(cache_path)
+    pending = [(image, label) for image, label in images if image not in results]
+    print(f'{len(images) - len(pending)} cached detections, running {len(pending)} images')
+
+    def run(item):
+        image, label = item
+        is_anomalous, confidence, mask, anomalies = detect(str(Path(image_folder) / image))
+        mask_file = None
+        if mask is not None:
+            mask_file = image.replace('/', '_') + '.png'
+            Image.fromarray(mask).save(cache_path / 'masks' / mask_file)
+        return {'image': image, 'label': label, 'is_anomalous': bool(is_anomalous),
+                'confidence': float(confidence), 'mask': mask_file,
+                'anomalies': {name: {'color': color, 'area': float(area)}
+                              for name, (color, area) in anomalies.items()}}
+
+    with open(cache_path / 'results.jsonl', 'a') as cache_file, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for result in executor.map(run, pending):
+            results[result['image']] = result
+            cache_file.write(json.dumps(result) + '\n')
+            cache_file.flush()
+    return [results[image] for image, label in images]
+
+
+def anomaly_scores(results):
+    """Returns the labels and anomaly scores of the results as numpy arrays."""
+    labels = np.array([result['label'] for result in results], dtype=bool)
+    confidence = np.array([result['confidence'] for result in results], dtype=np.float64)
+    is_anomalous = np.array([result['is_anomalous'] for result in results], dtype=bool)
+    return labels, np.where(is_anomalous, confidence, 1 - confidence)
+
+
+def classification_metrics(labels, scores, threshold):
+    predicted = scores >= threshold
+    tp = np.count_nonzero(predicted & labels)
+    fp = np.count_nonzero(predicted & ~labels)
+    fn = np.count_nonzero(~predicted & labels)
+    tn = np.count_nonzero(~predicted & ~labels)
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn,
+            'precision': precision, 'recall': recall, 'f1': f1}
+
+
+def roc_curve(labels, scores):
+    """
+    Returns the thresholds, false positive rates and true positive rates of
+    the ROC curve, and its area under the curve. The area is nan if the
+    labels are all normal or all anomalous.
+    """
+    if labels.size == 0:
+        raise ValueError('no results to compute the ROC curve of')
+    order = np.argsort(-scores, kind='mergesort')
+    sorted_scores = scores[order]
+    sorted_labels = labels[order]
+    # Keep the last index of each distinct score.
+    distinct = np.r_[np.nonzero(np.diff(sorted_scores))[0], sorted_labels.size - 1]
+    tps = np.cumsum(sorted_labels)[distinct]
+    fps = (distinct + 1) - tps
+    tpr = np.r_[0, tps / max(tps[-1], 1)]
+    fpr = np.r_[0, fps / max(fps[-1], 1)]
+    thresholds = np.r_[np.inf, sorted_scores[distinct]]
+    if tps[-1] == 0 or fps[-1] == 0:
+        auc = float('nan')
+    else:
+        auc = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+    return thresholds, fpr, tpr, auc
+
+
+def pack_rgb(pixels):
+    pixels = pixels.astype(np.uint32)
+    return (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+
+
+def pixel_iou(results, mask_folder, class_colors, cache_path):
+    """
+    Returns the pixel IoU per class over all anomalous images that have a
+    ground-truth mask. Ground-truth masks use class_colors, predicted masks
+    use the colors the model returned for each class name.
+    """
+    intersection = dict.fromkeys(class_colors, 0)
+    union = dict.fromkeys(class_colors, 0)
+    for result in results:
+        gt_path = Path(mask_folder) / (Path(result['image']).stem + '.png')
+        if result['label'] != 1 or not gt_path.exists():
+            continue
+        gt = pack_rgb(np.asarray(Image.open(gt_path).convert('RGB')))
+        predicted = None
+        if result['mask']:
+            predicted = pack_rgb(np.asarray(
+                Image.open(cache_path / 'masks' / result['mask']).convert('RGB').resize(
+                    (gt.shape[1], gt.shape[0]), Image.NEAREST)))
+        for name, color in class_colors.items():
+            gt_class = gt == int(color.lstrip('#'), 16)
+            predicted_class = np.zeros_like(gt_class)
+            if predicted is not None and name in result['anomalies']:
+                predicted_class = predicted == int(result['anomalies'][name]['color'].lstrip('#'), 16)
+            intersection[name] += np.count_nonzero(gt_class & predicted_class)
+            union[name] += np.count_nonzero(gt_class | predicted_class)
+    return {name: intersection[name] / union[name] if union[name] else float('nan')
+            for name in class_colors}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Script to evaluate a model against a labeled image folder')
+    parser.add_argument('--images', type=str, help='folder with normal and anomaly subfolders', required=True)
+    parser.add_argument('--project-name', type=str, help='Lookout for Vision project to evaluate')
+    parser.add_argument('--model-version', type=str, help='model version to evaluate')
+    parser.add_argument('--region', type=str, help='AWS region of the project')
+    parser.add_argument('--endpoint-url', type=str, help='lookoutvision endpoint to use instead of AWS')
+    parser.add_argument('--model-component', type=str, help='evaluate this edge model component instead of a cloud model')
+    parser.add_argument('--socket', type=str, help='Edge Agent gRPC address', default=DEFAULT_SOCKET)
+    parser.add_argument('--workers', type=int, help='concurrent requests', default=8)
+    parser.add_argument('--cache-dir', type=str, help='folder for cached detections', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--threshold', type=float, help='anomaly score threshold', default=0.5)
+    parser.add_argument('--roc-csv', type=str, help='write the ROC curve to this CSV file')
+    parser.add_argument('--mask-folder', type=str, help='folder with ground-truth masks named <image>.png')
+    parser.add_argument('--class', dest='classes', action='append', default=[],
+                        help='ground-truth mask class and color, e.g. cracked:#23A436. Repeat for each class.')
+
+    args = parser.parse_args()
+
+    if args.model_component:
+        model_key = 'edge-' + args.model_component
+        detect = edge_detector(args.model_component, args.socket)
+    elif args.project_name and args.model_version:
+        model_key = f'{args.project_name}-{args.model_version}'
+        detect = cloud_detector(args.project_name, args.model_version, args.region,
+                                args.endpoint_url, args.workers)
+    else:
+        parser.error('either --model-component or --project-name and --model-version are required')
+
+    images = labeled_images(args.images)
+    if not images:
+        print(f'No images in {Path(args.images) / NORMAL_FOLDER} or {Path(args.images) / ANOMALY_FOLDER}')
+        sys.exit(1)
+    cache_path = Path(args.cache_dir) / model_key
+    results = run_detections(args.images, images, detect, cache_path, args.workers)
+
+    labels, scores = anomaly_scores(results)
+    metrics = classification_metrics(labels, scores, args.threshold)
+    thresholds, fpr, tpr, auc = roc_curve(labels, scores)
+    print(f"Images: {labels.size} ({np.count_nonzero(labels)} anomalous)")
+    print(f"Threshold {args.threshold}: precision {metrics['precision']:.3f}, recall {metrics['recall']:.3f}, "
+          f"F1 {metrics['f1']:.3f} (TP {metrics['tp']}, FP {metrics['fp']}, FN {metrics['fn']}, TN {metrics['tn']})")
+    if np.isnan(auc):
+        print(f"ROC AUC: undefined, all images are {'anomalous' if labels.all() else 'normal'}")
+    else:
+        print(f'ROC AUC: {auc:.3f}')
+
+    if args.roc_csv:
+        np.savetxt(args.roc_csv, np.column_stack([thresholds, fpr, tpr]), delimiter=',',
+                   header='threshold,false_positive_rate,true_positive_rate', comments='')
+
+    if args.mask_folder and args.classes:
+        class_colors = dict(description.split(':') for description in args.classes)
+        for name, iou in pixel_iou(results, args.mask_folder, class_colors, cache_path).items():
+            print(f'Pixel IoU {name}: {iou:.3f}')
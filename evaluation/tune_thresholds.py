@@ -0,0 +1,180 @@
+import sys
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+'''
+This script tunes the decision rule the edge clients apply to model results
+(see process_segmentation in edge/base_l4v_client.py). A part is rejected when
+its anomaly score is at least the confidence threshold and at least one defect
+class covers more than that class's minimum area.
+
+1. "import" converts labeled detections, such as the results.jsonl files that
+   evaluate.py caches, into a compact columnar .npz file. Importing into an
+   existing file appends to it.
+2. "tune" sweeps the confidence threshold and a minimum area per defect class
+   over the stored results and picks the rule with the lowest cost, where
+   cost = false rejects * --false-reject-cost + false accepts * --false-accept-cost.
+   The rule is written as a JSON file that the edge client loads at startup.
+
+Each sweep step bins the results into a 2D histogram of (confidence, area)
+threshold indexes and takes reverse cumulative sums, so evaluating every
+threshold pair costs O(results + thresholds^2) instead of running inference
+or looping over the results again.
+'''
+
+DEFAULT_IGNORE = ['background']
+CONFIDENCE_GRID = np.round(np.arange(0.5, 1.0001, 0.01), 4)
+AREA_GRID = np.r_[0, np.geomspace(1e-5, 0.5, 60)]
+MAX_ROUNDS = 5
+
+
+def import_results(results_files, columns_file):
+    """
+    Appends labeled detections to a columnar file with label, anomaly score
+    and one area column per defect class.
+    """
+    rows = []
+    for results_file in results_files:
+        with open(results_file) as results:
+            rows.extend(json.loads(line) for line in results if line.strip())
+
+    class_names = sorted({name for row in rows for name in row.get('anomalies', {})})
+    labels = np.array([row['label'] for row in rows], dtype=np.uint8)
+    # float64 like the threshold grids, so a score or area on a grid point isn't rounded below it.
+    confidence = np.array([row['confidence'] for row in rows], dtype=np.float64)
+    is_anomalous = np.array([row['is_anomalous'] for row in rows], dtype=bool)
+    scores = np.where(is_anomalous, confidence, 1 - confidence)
+    areas = np.zeros((len(rows), len(class_names)), dtype=np.float64)
+    for index, row in enumerate(rows):
+        for column, name in enumerate(class_names):
+            anomaly = row.get('anomalies', {}).get(name)
+            if anomaly:
+                areas[index, column] = anomaly['area']
+
+    if Path(columns_file).exists():
+        existing = load_columns(columns_file)
+        all_names = sorted(set(existing['class_names']) | set(class_names))
+        areas = np.vstack([align_areas(existing['areas'], existing['class_names'], all_names),
+                           align_areas(areas, class_names, all_names)])
+        labels = np.r_[existing['labels'], labels]
+        scores = np.r_[existing['scores'], scores]
+        class_names = all_names
+
+    np.savez_compressed(columns_file, labels=labels, scores=scores, areas=areas,
+                        class_names=np.array(class_names))
+    print(f'{labels.size} results with classes {class_names} in {columns_file}')
+
+
+def align_areas(areas, class_names, all_names):
+    aligned = np.zeros((areas.shape[0], len(all_names)), dtype=np.float64)
+    for column, name in enumerate(class_names):
+        aligned[:, all_names.index(name)] = areas[:, column]
+    return aligned
+
+
+def load_columns(columns_file):
+    with np.load(columns_file) as columns:
+        return {'labels': columns['labels'].astype(bool), 'scores': columns['scores'],
+                'areas': columns['areas'], 'class_names': list(columns['class_names'])}
+
+
+def threshold_counts(score_index, area_index, mask):
+    """
+    Returns a (confidence thresholds x area thresholds) array with the number
+    of selected results whose score is at least each confidence threshold and
+    whose area is over each area threshold.
+    """
+    hist = np.zeros((CONFIDENCE_GRID.size + 1, AREA_GRID.size + 1), dtype=np.int64)
+    np.add.at(hist, (score_index[mask] + 1, area_index[mask] + 1), 1)
+    counts = hist[::-1, ::-1].cumsum(axis=0).cumsum(axis=1)[::-1, ::-1]
+    return counts[1:, 1:]
+
+
+def tune(columns, false_reject_cost, false_accept_cost, ignore=DEFAULT_IGNORE):
+    """
+    Finds the confidence threshold and per-class minimum areas with the lowest
+    cost, optimising one class at a time while the others are held fixed.
+    """
+    labels = columns['labels']
+    classes = [index for index, name in enumerate(columns['class_names']) if name not in ignore]
+    if not classes:
+        # The edge client only applies the rule to the defect classes of segmentation results.
+        raise ValueError('no defect classes in the results, the rules only apply to segmentation models')
+    # Files imported before the columns were float64 hold float32 values, compare them to the
+    # grids in the same precision. score >= CONFIDENCE_GRID[k] exactly when score_index >= k.
+    scores, areas = columns['scores'], columns['areas']
+    score_index = np.searchsorted(CONFIDENCE_GRID.astype(scores.dtype), scores, side='right') - 1
+    # area > AREA_GRID[k] exactly when area_index >= k.
+    area_indexes = np.searchsorted(AREA_GRID.astype(areas.dtype), areas, side='left') - 1
+
+    confidence = 0
+    min_areas = {column: int(np.searchsorted(AREA_GRID, 0.01)) for column in classes}
+    best_cost = None
+    for _ in range(MAX_ROUNDS):
+        improved = False
+        for column in classes:
+            others = np.zeros(labels.size, dtype=bool)
+            for other in classes:
+                if other != column:
+                    others |= area_indexes[:, other] >= min_areas[other]
+            # Rejected if score passes and (this class passes or another class already passes).
+            rejects = {}
+            for label in (False, True):
+                selected = labels == label
+                by_others = threshold_counts(score_index, np.zeros_like(score_index), selected & others)[:, :1]
+                by_class = threshold_counts(score_index, area_indexes[:, column], selected & ~others)
+                rejects[label] = by_others + by_class
+            false_rejects = rejects[False]
+            false_accepts = np.count_nonzero(labels) - rejects[True]
+            cost = false_rejects * false_reject_cost + false_accepts * false_accept_cost
+            k, j = np.unravel_index(np.argmin(cost), cost.shape)
+            if best_cost is None or cost[k, j] < best_cost:
+                improved = best_cost is not None
+                best_cost = cost[k, j]
+                confidence, min_areas[column] = int(k), int(j)
+                best_counts = (int(false_rejects[k, j]), int(false_accepts[k, j]))
+        if not improved:
+            break
+
+    return {
+        'confidence_threshold': float(CONFIDENCE_GRID[confidence]),
+        'ignore': list(ignore),
+        'classes': {columns['class_names'][column]: {'min_area': float(AREA_GRID[index])}
+                    for column, index in min_areas.items()},
+    }, best_cost, best_counts
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Script to tune anomaly decision thresholds from stored results')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help='append labeled results to a columnar file')
+    import_parser.add_argument('results', nargs='+', help='results.jsonl files written by evaluate.py')
+    import_parser.add_argument('--columns', type=str, help='columnar results file', default='results.npz')
+    tune_parser = subparsers.add_parser('tune', help='tune thresholds and write a rule file')
+    tune_parser.add_argument('--columns', type=str, help='columnar results file', default='results.npz')
+    tune_parser.add_argument('--false-reject-cost', type=float, help='cost of rejecting a normal part', default=1)
+    tune_parser.add_argument('--false-accept-cost', type=float, help='cost of accepting a defective part', default=10)
+    tune_parser.add_argument('--ignore', action='append', help='defect class to ignore, default background')
+    tune_parser.add_argument('--output', type=str, help='rule file to write', default='rules.json')
+
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        import_results(args.results, args.columns)
+    else:
+        try:
+            rules, cost, (false_rejects, false_accepts) = tune(
+                load_columns(args.columns), args.false_reject_cost, args.false_accept_cost,
+                args.ignore or DEFAULT_IGNORE)
+        except ValueError as error:
+            print(f'Unable to tune {args.columns}: {error}')
+            sys.exit(1)
+        with open(args.output, 'w') as rules_file:
+            json.dump(rules, rules_file, indent=4)
+        print(json.dumps(rules, indent=4))
+        print(f'Cost: {cost}, false rejects: {false_rejects}, false accepts: {false_accepts}')
+        print(f'Wrote {args.output}. Copy it next to base_l4v_client.py or set L4V_RULES to its path.')
@@ -0,0 +1,164 @@
+import os
+import sys
+import time
+import threading
+import argparse
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import cv2
+import grpc
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'edge'))
+
+import edge_agent_pb2 as pb2
+from edge_agent_pb2_grpc import EdgeAgentStub
+
+'''
+This script is the edge counterpart of tps.py. It will:
+1. Read list of images from a base path and convert them to raw RGB bitmaps
+2. Run step load against the local Edge Agent DetectAnomalies endpoint
+3. Print throughput, latency percentiles and client CPU per frame for each step
+4. Stop runs when failures are observed or throughput stops increasing
+5. Use the best step to report the maximum TPS of the device
+
+Images can be sent in the protobuf message or, with --shared-memory, through
+POSIX shared memory segments. Run against edge/fake_edge_agent.py to test the
+benchmark itself without a device.
+'''
+
+DEFAULT_SOCKET = 'unix:///tmp/aws.iot.lookoutvision.EdgeAgent.sock'
+
+
+def load_requests(image_base_path, model_component, use_shared_memory):
+    """
+    Builds one DetectAnomaliesRequest per image up front so that image
+    decoding isn't part of the measured path. Returns the requests and the
+    shared memory segments backing them, if any.
+    """
+    requests = []
+    segments = []
+    for (dirpath, dirnames, filenames) in os.walk(image_base_path):
+        for filename in sorted(filenames):
+            img = cv2.imread(str(Path(image_base_path) / filename))
+            if img is None:
+                continue
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            h, w, c = img.shape
+            data = img.tobytes()
+            if use_shared_memory:
+                segment = shared_memory.SharedMemory(create=True, size=len(data))
+                segment.buf[:len(data)] = data
+                segments.append(segment)
+                bitmap = pb2.Bitmap(width=w, height=h, shared_memory_handle=pb2.SharedMemoryHandle(
+                    name='/' + segment.name, size=len(data), offset=0))
+            else:
+                bitmap = pb2.Bitmap(width=w, height=h, byte_data=data)
+            requests.append(pb2.DetectAnomaliesRequest(model_component=model_component, bitmap=bitmap))
+        break
+    return requests, segments
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def run_load(stub, requests, concurrency, duration):
+    """
+    Runs concurrency client threads calling DetectAnomalies back to back for
+    duration seconds and returns the step statistics.
+    """
+    latencies = [[] for _ in range(concurrency)]
+    failures = [0] * concurrency
+    stop_time = time.time() + duration
+
+    def worker(index):
+        count = index
+        while time.time() < stop_time:
+            start_time = time.perf_counter()
+            try:
+                stub.DetectAnomalies(requests[count % len(requests)])
+            except grpc.RpcError:
+                failures[index] += 1
+            else:
+                latencies[index].append((time.perf_counter() - start_time) * 1000)
+            count += concurrency
+
+    cpu_start = time.process_time()
+    wall_start = time.time()
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.time() - wall_start
+    cpu_time = time.process_time() - cpu_start
+
+    all_latencies = [latency for worker_latencies in latencies for latency in worker_latencies]
+    frames = len(all_latencies)
+    stats = {
+        'concurrency': concurrency,
+        'tps': frames / wall_time,
+        'failures': sum(failures),
+        'p50': percentile(all_latencies, 50),
+        'p95': percentile(all_latencies, 95),
+        'p99': percentile(all_latencies, 99),
+        'cpu_ms_per_frame': cpu_time * 1000 / frames if frames else 0,
+    }
+    print(f"Concurrency: {concurrency}, TPS: {stats['tps']:.2f}, failures: {stats['failures']}, "
+          f"latency p50/p95/p99: {stats['p50']:.1f}/{stats['p95']:.1f}/{stats['p99']:.1f} ms, "
+          f"client CPU per frame: {stats['cpu_ms_per_frame']:.2f} ms")
+    return stats
+
+
+def find_max_tps(stub, requests, duration, concurrency=1, max_iterations=6):
+    """
+    Doubles the number of concurrent clients until failures appear or the
+    throughput gain of a step is under 5%, and returns the best step.
+    """
+    best = None
+    while max_iterations > 0:
+        stats = run_load(stub, requests, concurrency, duration)
+        if stats['failures'] > 0:
+            break
+        if best is not None and stats['tps'] < best['tps'] * 1.05:
+            if stats['tps'] > best['tps']:
+                best = stats
+            break
+        best = stats
+        concurrency *= 2
+        max_iterations -= 1
+    return best
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Script to find the max TPS supported by a model on an edge device')
+    parser.add_argument('--images', type=str, help='path to folder with images', required=True)
+    parser.add_argument('--model-component', type=str, help='Greengrass model component to run loadtest against', required=True)
+    parser.add_argument('--socket', type=str, help='Edge Agent gRPC address', default=DEFAULT_SOCKET)
+    parser.add_argument('--shared-memory', action='store_true', help='send images through POSIX shared memory')
+    parser.add_argument('--duration', type=float, help='seconds per load step', default=30)
+    parser.add_argument('--concurrency', type=int, help='concurrent clients in the first load step', default=1)
+
+    args = parser.parse_args()
+
+    print(f'model component = {args.model_component}, socket = {args.socket}, image path = {args.images}')
+
+    requests, segments = load_requests(args.images, args.model_component, args.shared_memory)
+    try:
+        with grpc.insecure_channel(args.socket) as channel:
+            stub = EdgeAgentStub(channel)
+            best = find_max_tps(stub, requests, args.duration, args.concurrency)
+        if best:
+            print(f"Max supported TPS: {best['tps']:.2f} with {best['concurrency']} concurrent clients")
+            print(f"95th percentile response time: {best['p95']:.1f} ms")
+            print(f"Client CPU per frame: {best['cpu_ms_per_frame']:.2f} ms")
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
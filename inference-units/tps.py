@@ -2,11 +2,14 @@ from os import walk
 import inspect
 import time
 import functools
+import random
 
 import gevent.monkey
 
 gevent.monkey.patch_all()
 
+import gevent
+
 import argparse
 from pathlib import Path
 import boto3 as boto3
@@ -26,12 +29,18 @@ This script will:
 3. Print the stats
 4. Stop runs when non-zero faliure rate is observed
 5. Use last run to calculate maximum TPS
+
+With --mode open-loop the step load is replaced by an open-loop generator:
+requests are issued on a fixed schedule (constant or Poisson arrivals) no
+matter how long earlier requests take, and latency is measured from the
+intended send time so queueing delay is not hidden (coordinated omission).
 '''
 
 image_base_path = None
 project_name = None
 aws_region = None
 model_version = None
+endpoint_url = None
 
 class WebserviceUser(User):
 
@@ -52,6 +61,7 @@ class WebserviceUser(User):
         self.client = boto3.client(
             'lookoutvision',
             aws_region,
+            endpoint_url=endpoint_url,
             config=config
         )
 
@@ -72,6 +82,121 @@ class WebserviceUser(User):
 
         self.tasks = [functools.partial(detection_tests, image) for image in self.images]
 
+
+def parse_rate_schedule(schedule):
+    """
+    Parses a rate schedule such as "10:60,20:60" into a list of
+    (requests per second, duration in seconds) steps.
+    """
+    steps = []
+    for step in schedule.split(','):
+        rate, duration = step.split(':')
+        steps.append((float(rate), float(duration)))
+    return steps
+
+
+def arrival_offsets(steps, arrival='constant', seed=None):
+    """
+    Yields intended send times, in seconds from the start of the run, for
+    each step of the rate schedule. Arrivals are either evenly spaced or
+    Poisson (exponentially distributed gaps) at the step's rate.
+    """
+    rng = random.Random(seed)
+    step_start = 0.0
+    for rate, duration in steps:
+        step_end = step_start + duration
+        offset = step_start
+        while rate > 0:
+            if arrival == 'poisson':
+                offset += rng.expovariate(rate)
+            else:
+                offset += 1.0 / rate
+            if offset >= step_end:
+                break
+            yield offset
+        step_start = step_end
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def run_open_loop(steps, arrival='constant', max_in_flight=1000, seed=None):
+    """
+    Issues detect_anomalies calls at the scheduled arrival rate, independent
+    of response time. Latency is measured from the intended send time, so a
+    saturated model shows up as growing latency instead of a falling offered
+    load. Requests that would exceed max_in_flight are counted as failures
+    rather than delayed.
+    """
+    for (dirpath, dirnames, filenames) in walk(image_base_path):
+        images = []
+        for filename in filenames:
+            with open(Path(image_base_path) / filename, 'rb') as image:
+                images.append(image.read())
+        break
+    config = Config(
+        retries={
+            'max_attempts': 1,
+            'mode': 'standard'
+        },
+        max_pool_connections=max_in_flight
+    )
+    client = boto3.client('lookoutvision', aws_region, endpoint_url=endpoint_url, config=config)
+
+    results = []
+    in_flight = [0]
+
+    def detect(body, intended_time):
+        send_time = time.time()
+        try:
+            client.detect_anomalies(ProjectName=project_name, ContentType='image/jpeg', Body=body, ModelVersion=model_version)
+            success = True
+        except Exception:
+            success = False
+        finally:
+            in_flight[0] -= 1
+        end_time = time.time()
+        results.append((intended_time, (end_time - intended_time) * 1000,
+                        (end_time - send_time) * 1000, success))
+
+    greenlets = []
+    start_time = time.time()
+    for count, offset in enumerate(arrival_offsets(steps, arrival, seed)):
+        intended_time = start_time + offset
+        delay = intended_time - time.time()
+        if delay > 0:
+            gevent.sleep(delay)
+        if in_flight[0] >= max_in_flight:
+            results.append((intended_time, 0, 0, False))
+            continue
+        in_flight[0] += 1
+        greenlets.append(gevent.spawn(detect, images[count % len(images)], intended_time))
+    gevent.joinall(greenlets)
+
+    # Report each step of the schedule separately.
+    step_start = start_time
+    step_stats = []
+    for rate, duration in steps:
+        step_results = [r for r in results if step_start <= r[0] < step_start + duration]
+        step_start += duration
+        latencies = [r[1] for r in step_results if r[3]]
+        service_times = [r[2] for r in step_results if r[3]]
+        failures = len(step_results) - len(latencies)
+        achieved_tps = len(latencies) / duration
+        p95_latency = percentile(latencies, 95)
+        print(f'Offered TPS: {rate}, achieved TPS: {achieved_tps:.2f}, failures: {failures}')
+        print(f'Latency from intended send time p50/p95/p99: {percentile(latencies, 50):.0f}/'
+              f'{p95_latency:.0f}/{percentile(latencies, 99):.0f} ms')
+        print(f'Service time p50/p95/p99: {percentile(service_times, 50):.0f}/'
+              f'{percentile(service_times, 95):.0f}/{percentile(service_times, 99):.0f} ms')
+        step_stats.append((rate, achieved_tps, p95_latency, failures))
+    return step_stats
+
 def run_load(user_count, spawn_rate):
     # setup Environment and Runner
     env = Environment(user_classes=[WebserviceUser])
@@ -114,22 +239,36 @@ if __name__ == '__main__':
     parser.add_argument('--project-name', type=str, help='Project Version arn to run loadtest against', required=True)
     parser.add_argument('--region', type=str, help='Project Version arn to run loadtest against', required=True)
     parser.add_argument('--model-version', type=str, help='Project Version arn to run loadtest against', required=True)
+    parser.add_argument('--mode', choices=['step', 'open-loop'], default='step',
+                        help='step: closed-loop step load to find max TPS, open-loop: fixed arrival rate')
+    parser.add_argument('--rate-schedule', type=str, default='1:60',
+                        help='open-loop only, comma separated <requests per second>:<seconds> steps, e.g. 5:60,10:60')
+    parser.add_argument('--arrival', choices=['constant', 'poisson'], default='constant',
+                        help='open-loop only, distribution of request arrivals')
+    parser.add_argument('--max-in-flight', type=int, default=1000,
+                        help='open-loop only, requests beyond this many outstanding are counted as failures')
+    parser.add_argument('--endpoint-url', type=str,
+                        help='lookoutvision endpoint to use instead of AWS, such as local-service/mock_lookoutvision.py')
 
     args = parser.parse_args()
     image_base_path = args.images
     project_name = args.project_name
     aws_region = args.region
     model_version = args.model_version
+    endpoint_url = args.endpoint_url
 
     print(f'project name ={project_name}, region = {aws_region}, image path = {image_base_path}')
 
-    user_count = 10
-    failure_tps = 0
-    # NOTE: If max TPS is not reached in 3 iterations the customer might be running with >1 IU
-    max_iterations = 3
-    # NOTE: Advanced users can replace with custom shape & LocalRunner to find maxima
-    # https://docs.locust.io/en/stable/generating-custom-load-shape.html
-    while failure_tps <= 0 and max_iterations >= 0:
-        max_tps, p95_latency, failure_tps = run_load(user_count, user_count/10)
-        user_count *= 2
-        max_iterations -= 1
+    if args.mode == 'open-loop':
+        run_open_loop(parse_rate_schedule(args.rate_schedule), args.arrival, args.max_in_flight)
+    else:
+        user_count = 10
+        failure_tps = 0
+        # NOTE: If max TPS is not reached in 3 iterations the customer might be running with >1 IU
+        max_iterations = 3
+        # NOTE: Advanced users can replace with custom shape & LocalRunner to find maxima
+        # https://docs.locust.io/en/stable/generating-custom-load-shape.html
+        while failure_tps <= 0 and max_iterations >= 0:
+            max_tps, p95_latency, failure_tps = run_load(user_count, user_count/10)
+            user_count *= 2
+            max_iterations -= 1
@@ -0,0 +1,174 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+A local stand-in for the Amazon Augmented AI (A2I) runtime API, so human
+review flows such as A2I/review_router.py can run without a work team.
+Point a boto3 sagemaker-a2i-runtime client at it with endpoint_url.
+
+Human loops complete after a configurable delay. The reviewer's answer,
+Normal or Anomaly, is derived from a hash of the task object, and the output
+is written as JSON in the A2I output format to a local folder. The
+OutputS3Uri of a completed loop is a file:// URI of that file.
+"""
+
+import logging
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from mock_lookoutvision import MockError, TokenBucket, serve
+
+DEFAULT_PORT = 8081
+REGION = "us-east-1"
+ACCOUNT = "123456789012"
+PAGE_SIZE = 100
+
+
+logger = logging.getLogger(__name__)
+
+
+class MockA2I:
+    """
+    The human loops of the mock service. Statuses move on when they are read.
+    """
+    def __init__(self, output_dir, review_seconds=5, anomaly_rate=0.5, tps=10):
+        self.output_dir = Path(output_dir)
+        self.review_seconds = review_seconds
+        self.anomaly_rate = anomaly_rate
+        self.limiter = TokenBucket(tps)
+        self.loops = {}
+        self.lock = threading.Lock()
+
+    def throttle(self):
+        if not self.limiter.take():
+            raise MockError(429, "ThrottlingException", "Rate exceeded")
+
+    def update_loop(self, loop):
+        if loop["HumanLoopStatus"] != "InProgress" or time.time() - loop["created"] < self.review_seconds:
+            return
+        input_content = json.loads(loop["input"]["InputContent"])
+        digest = hashlib.sha256(input_content.get("taskObject", "").encode("utf-8")).digest()
+        label = "Anomaly" if digest[0] / 256 < self.anomaly_rate else "Normal"
+        output = {
+            "flowDefinitionArn": loop["FlowDefinitionArn"],
+            "humanAnswers": [{
+                "answerContent": {"crowd-image-classifier": {"label": label}},
+                "submissionTime": datetime.now(timezone.utc).isoformat(),
+                "workerId": "mock-worker",
+            }],
+            "humanLoopName": loop["HumanLoopName"],
+            "inputContent": input_content,
+        }
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        output_file = self.output_dir / f"{loop['HumanLoopName']}.json"
+        output_file.write_text(json.dumps(output))
+        loop["HumanLoopStatus"] = "Completed"
+        loop["HumanLoopOutput"] = {"OutputS3Uri": output_file.resolve().as_uri()}
+
+    def loop(self, name):
+        if name not in self.loops:
+            raise MockError(404, "ResourceNotFoundException", f"Human loop {name} not found")
+        loop = self.loops[name]
+        self.update_loop(loop)
+        return loop
+
+    @staticmethod
+    def loop_arn(name):
+        return f"arn:aws:sagemaker:{REGION}:{ACCOUNT}:human-loop/{name}"
+
+    def start_human_loop(self, body):
+        self.throttle()
+        name = body["HumanLoopName"]
+        with self.lock:
+            if name in self.loops:
+                raise MockError(409, "ConflictException", f"Human loop {name} already exists")
+            self.loops[name] = {"HumanLoopName": name, "FlowDefinitionArn": body["FlowDefinitionArn"],
+                                "input": body["HumanLoopInput"], "created": time.time(),
+                                "HumanLoopStatus": "InProgress"}
+        return {"HumanLoopArn": self.loop_arn(name)}
+
+    def describe_human_loop(self, body, name):
+        self.throttle()
+        loop = self.loop(name)
+        response = {"CreationTime": loop["created"], "HumanLoopStatus": loop["HumanLoopStatus"],
+                     "HumanLoopName": name, "HumanLoopArn": self.loop_arn(name),
+                     "FlowDefinitionArn": loop["FlowDefinitionArn"]}
+        if "HumanLoopOutput" in loop:
+            response["HumanLoopOutput"] = loop["HumanLoopOutput"]
+        return response
+
+    def list_human_loops(self, body):
+        self.throttle()
+        loops = sorted(self.loops.values(), key=lambda loop: loop["created"])
+        loops = [loop for loop in loops if loop["FlowDefinitionArn"] == body["FlowDefinitionArn"]]
+        if "CreationTimeAfter" in body:
+            after = body["CreationTimeAfter"]
+            try:
+                after = float(after)
+            except ValueError:
+                after = datetime.fromisoformat(after.replace("Z", "+00:00")).timestamp()
+            loops = [loop for loop in loops if loop["created"] > after]
+        start = int(body.get("NextToken", 0))
+        page_size = int(body.get("MaxResults", PAGE_SIZE))
+        page = loops[start:start + page_size]
+        for loop in page:
+            self.update_loop(loop)
+        response = {"HumanLoopSummaries": [
+            {"HumanLoopName": loop["HumanLoopName"], "HumanLoopStatus": loop["HumanLoopStatus"],
+             "CreationTime": loop["created"], "FlowDefinitionArn": loop["FlowDefinitionArn"]}
+            for loop in page]}
+        if start + page_size < len(loops):
+            response["NextToken"] = str(start + page_size)
+        return response
+
+    def stop_human_loop(self, body):
+        self.throttle()
+        loop = self.loop(body["HumanLoopName"])
+        if loop["HumanLoopStatus"] == "InProgress":
+            loop["HumanLoopStatus"] = "Stopped"
+        return {}
+
+
+ROUTES = [
+    ("POST", r"/human-loops", "start_human_loop"),
+    ("GET", r"/human-loops", "list_human_loops"),
+    ("GET", r"/human-loops/([^/]+)", "describe_human_loop"),
+    ("POST", r"/human-loops/stop", "stop_human_loop"),
+]
+ROUTES = [(method, re.compile(pattern + "$"), operation) for method, pattern, operation in ROUTES]
+
+
+def main():
+    """
+    Entry point for the mock A2I service.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Runs a local stand-in for the Amazon A2I runtime API.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="The port to listen on.")
+    parser.add_argument("--host", default="localhost", help="The address to listen on.")
+    parser.add_argument("--output-dir", default="a2i-output", help="The folder for human loop outputs.")
+    parser.add_argument("--review-seconds", type=float, default=5, help="The time a review takes.")
+    parser.add_argument("--anomaly-rate", type=float, default=0.5,
+                        help="The fraction of reviews answered Anomaly.")
+    parser.add_argument("--tps", type=float, default=10, help="API calls per second before throttling.")
+    args = parser.parse_args()
+
+    server = serve(MockA2I(args.output_dir, args.review_seconds, args.anomaly_rate, args.tps),
+                   args.port, args.host, ROUTES)
+    logger.info("Mock A2I runtime listening on http://%s:%d", args.host, args.port)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Purpose
+
+A local stand-in for the Amazon Lookout for Vision API, so the notebooks,
+scripts and benchmarks in this repository can run on a laptop without AWS.
+Point a boto3 client at it with endpoint_url:
+
+    client = boto3.client("lookoutvision", "us-east-1",
+                          endpoint_url="http://localhost:8080",
+                          aws_access_key_id="mock", aws_secret_access_key="mock")
+
+Implements the projects, datasets, models and DetectAnomalies operations used
+in this repository. Datasets, training, starting and stopping complete after
+configurable delays. DetectAnomalies adds a configurable latency, throttles
+requests above the throughput of the hosted inference units, and returns a
+result and a synthetic anomaly mask derived from a hash of the image, so the
+same image always gets the same result.
+"""
+
+import logging
+import argparse
+import base64
+import hashlib
+import json
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, unquote, parse_qsl
+
+DEFAULT_PORT = 8080
+API_VERSION = "2020-11-20"
+REGION = "us-east-1"
+ACCOUNT = "123456789012"
+MASK_SIZE = 64
+ANOMALY_CLASSES = [("crack", "#23A436"), ("scratch", "#FF0000")]
+
+
+logger = logging.getLogger(__name__)
+
+
+class MockError(Exception):
+    """
+    An API error, returned with the status code and error type the real service uses.
+    """
+    def __init__(self, status, error_type, message):
+        super().__init__(message)
+        self.status = status
+        self.error_type = error_type
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second, with bursts of up to one second of requests.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def png_bytes(pixels, width, height):
+    """
+    Encodes RGB pixels (bytes, row by row) as a PNG image.
+    """
+    def chunk(chunk_type, data):
+        return (struct.pack(">I", len(data)) + chunk_type + data +
+                struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+    rows = b"".join(b"\x00" + pixels[row * width * 3:(row + 1) * width * 3] for row in range(height))
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(rows)) +
+            chunk(b"IEND", b""))
+
+
+def synthetic_result(image, anomaly_rate, segmentation):
+    """
+    Gets a deterministic result for an image from a hash of its bytes.
+    Returns (is_anomalous, confidence, anomalies, mask) where anomalies is a
+    list of (name, color, area) and mask is MASK_SIZE x MASK_SIZE RGB bytes,
+    or None for classification models.
+    """
+    digest = hashlib.sha256(image).digest()
+    is_anomalous = digest[0] / 256 < anomaly_rate
+    confidence = 0.5 + digest[1] / 512
+    if not segmentation:
+        return is_anomalous, confidence, [], None
+
+    pixels = bytearray(MASK_SIZE * MASK_SIZE * 3)
+    anomalies = [("background", "#000000", 1.0)]
+    if is_anomalous:
+        name, color = ANOMALY_CLASSES[digest[2] % len(ANOMALY_CLASSES)]
+        rgb = bytes.fromhex(color.lstrip("#"))
+        # A rectangle at a position and size taken from the hash.
+        left, top = digest[3] % (MASK_SIZE // 2), digest[4] % (MASK_SIZE // 2)
+        width, height = 4 + digest[5] % (MASK_SIZE // 4), 4 + digest[6] % (MASK_SIZE // 4)
+        for row in range(top, top + height):
+            start = (row * MASK_SIZE + left) * 3
+            pixels[start:start + width * 3] = rgb * width
+        area = width * height / (MASK_SIZE * MASK_SIZE)
+        anomalies = [("background", "#000000", 1.0 - area), (name, color, area)]
+    return is_anomalous, confidence, anomalies, bytes(pixels)
+
+
+class MockLookoutVision:
+    """
+    The state of the mock service: projects, datasets and models.
+    Statuses move on when they are read, after the configured delays.
+    """
+    def __init__(self, latency_ms=50, tps_per_inference_unit=5, anomaly_rate=0.3,
+                 train_seconds=10, host_seconds=5, dataset_seconds=1, segmentation=True):
+        self.latency_ms = latency_ms
+        self.tps_per_inference_unit = tps_per_inference_unit
+        self.anomaly_rate = anomaly_rate
+        self.train_seconds = train_seconds
+        self.host_seconds = host_seconds
+        self.dataset_seconds = dataset_seconds
+        self.segmentation = segmentation
+        self.projects = {}
+        self.lock = threading.Lock()
+
+    def project(self, project_name):
+        if project_name not in self.projects:
+            raise MockError(404, "ResourceNotFoundException", f"Project {project_name} not found")
+        return self.projects[project_name]
+
+    def model(self, project_name, model_version):
+        models = self.project(project_name)["models"]
+        if model_version not in models:
+            raise MockError(404, "ResourceNotFoundException", f"Model {project_name}/{model_version} not found")
+        model = models[model_version]
+        self.update_model(model)
+        return model
+
+    def update_model(self, model):
+        now = time.time()
+        transitions = {
+            "TRAINING": (self.train_seconds, "TRAINED"),
+            "STARTING_HOSTING": (self.host_seconds, "HOSTED"),
+            "STOPPING_HOSTING": (self.host_seconds, "TRAINED"),
+        }
+        if model["Status"] in transitions:
+            delay, next_status = transitions[model["Status"]]
+            if now - model["changed"] >= delay:
+                model["Status"] = next_status
+                model["changed"] = now
+                if next_status == "HOSTED":
+                    model["limiter"] = TokenBucket(self.tps_per_inference_unit * model["MinInferenceUnits"])
+
+    def update_dataset(self, dataset):
+        if dataset["Status"].endswith("IN_PROGRESS") and time.time() - dataset["changed"] >= self.dataset_seconds:
+            dataset["Status"] = dataset["Status"].replace("IN_PROGRESS", "COMPLETE")
+
+    def add_model(self, project_name, model_version, status, description="", output_config=None,
+                  inference_units=0):
+        """
+        Adds a model version with a status, creating the project if needed.
+        """
+        now = time.time()
+        project = self.projects.setdefault(project_name, {"CreationTimestamp": now, "datasets": {}, "models": {}})
+        model = {"ModelVersion": model_version, "CreationTimestamp": now, "changed": now,
+                 "Description": description, "Status": status, "OutputConfig": output_config or {},
+                 "MinInferenceUnits": inference_units, "MaxInferenceUnits": inference_units,
+                 "limiter": TokenBucket(self.tps_per_inference_unit * inference_units) if status == "HOSTED" else None,
+                 "Performance": {"F1Score": 0.95, "Recall": 0.94, "Precision": 0.96}}
+        project["models"][model_version] = model
+        return model
+
+    @staticmethod
+    def project_arn(project_name):
+        return f"arn:aws:lookoutvision:{REGION}:{ACCOUNT}:project/{project_name}"
+
+    @staticmethod
+    def model_metadata(project_name, model):
+        return {
+            "CreationTimestamp": model["CreationTimestamp"],
+            "ModelVersion": model["ModelVersion"],
+            "ModelArn": f"{MockLookoutVision.project_arn(project_name)}/model/{model['ModelVersion']}",
+            "Description": model["Description"],
+            "Status": model["Status"],
+            "StatusMessage": model["Status"].replace("_", " ").capitalize(),
+            "Performance": model["Performance"],
+        }
+
+    # Operations. Each takes the path parameters and the JSON body and returns the JSON response.
+
+    def create_project(self, body):
+        name = body["ProjectName"]
+        with self.lock:
+            if name in self.projects:
+                raise MockError(409, "ConflictException", f"Project {name} already exists")
+            self.projects[name] = {"CreationTimestamp": time.time(), "datasets": {}, "models": {}}
+        return {"ProjectMetadata": {"ProjectArn": self.project_arn(name), "ProjectName": name,
+                                    "CreationTimestamp": self.projects[name]["CreationTimestamp"]}}
+
+    def list_projects(self, body):
+        return {"Projects": [{"ProjectArn": self.project_arn(name), "ProjectName": name,
+                              "CreationTimestamp": project["CreationTimestamp"]}
+                             for name, project in sorted(self.projects.items())]}
+
+    def describe_project(self, body, project_name):
+        project = self.project(project_name)
+        return {"ProjectDescription": {
+            "ProjectArn": self.project_arn(project_name), "ProjectName": project_name,
+            "CreationTimestamp": project["CreationTimestamp"],
+            "Datasets": [{"DatasetType": dataset_type, "CreationTimestamp": dataset["CreationTimestamp"],
+                          "Status": dataset["Status"], "StatusMessage": dataset["Status"]}
+                         for dataset_type, dataset in project["datasets"].items()]}}
+
+    def delete_project(self, body, project_name):
+        with self.lock:
+            self.project(project_name)
+            del self.projects[project_name]
+        return {"ProjectArn": self.project_arn(project_name)}
+
+    def create_dataset(self, body, project_name):
+        dataset_type = body["DatasetType"]
+        with self.lock:
+            datasets = self.project(project_name)["datasets"]
+            if dataset_type in datasets:
+                raise MockError(409, "ConflictException", f"Dataset {dataset_type} already exists")
+            now = time.time()
+            datasets[dataset_type] = {"CreationTimestamp": now, "changed": now,
+                                      "Status": "CREATE_IN_PROGRESS", "source": body.get("DatasetSource")}
+        return {"DatasetMetadata": {"DatasetType": dataset_type, "CreationTimestamp": now,
+                                    "Status": "CREATE_IN_PROGRESS", "StatusMessage": "Creating"}}
+
+    def describe_dataset(self, body, project_name, dataset_type):
+        datasets = self.project(project_name)["datasets"]
+        if dataset_type not in datasets:
+            raise MockError(404, "ResourceNotFoundException", f"Dataset {dataset_type} not found")
+        dataset = datasets[dataset_type]
+        self.update_dataset(dataset)
+        return {"DatasetDescription": {
+            "ProjectName": project_name, "DatasetType": dataset_type,
+            "CreationTimestamp": dataset["CreationTimestamp"], "LastUpdatedTimestamp": dataset["changed"],
+            "Status": dataset["Status"], "StatusMessage": dataset["Status"],
+            "ImageStats": {"Total": 0, "Labeled": 0, "Normal": 0, "Anomaly": 0}}}
+
+    def delete_dataset(self, body, project_name, dataset_type):
+        with self.lock:
+            self.project(project_name)["datasets"].pop(dataset_type, None)
+        return {}
+
+    def create_model(self, body, project_name):
+        with self.lock:
+            project = self.project(project_name)
+            if "train" not in project["datasets"]:
+                raise MockError(400, "ValidationException", "The project has no training dataset")
+            model = self.add_model(project_name, str(len(project["models"]) + 1), "TRAINING",
+                                   body.get("Description", ""), body.get("OutputConfig", {}))
+        return {"ModelMetadata": self.model_metadata(project_name, model)}
+
+    def list_models(self, body, project_name):
+        project = self.project(project_name)
+        models = []
+        for model in project["models"].values():
+            self.update_model(model)
+            models.append(self.model_metadata(project_name, model))
+        return {"Models": models}
+
+    def describe_model(self, body, project_name, model_version):
+        model = self.model(project_name, model_version)
+        description = self.model_metadata(project_name, model)
+        description.update({
+            "OutputConfig": model["OutputConfig"],
+            "EvaluationEndTimestamp": model["CreationTimestamp"] + self.train_seconds,
+            "MinInferenceUnits": model["MinInferenceUnits"],
+            "MaxInferenceUnits": model["MaxInferenceUnits"],
+        })
+        return {"ModelDescription": description}
+
+    def delete_model(self, body, project_name, model_version):
+        with self.lock:
+            self.model(project_name, model_version)
+            del self.project(project_name)["models"][model_version]
+        return {"ModelArn": f"{self.project_arn(project_name)}/model/{model_version}"}
+
+    def start_model(self, body, project_name, model_version):
+        with self.lock:
+            model = self.model(project_name, model_version)
+            if model["Status"] not in ("TRAINED", "HOSTING_FAILED"):
+                raise MockError(409, "ConflictException", f"Can't start a model with status {model['Status']}")
+            model["Status"] = "STARTING_HOSTING"
+            model["changed"] = time.time()
+            model["MinInferenceUnits"] = body["MinInferenceUnits"]
+            model["MaxInferenceUnits"] = body.get("MaxInferenceUnits", body["MinInferenceUnits"])
+        return {"Status": "STARTING_HOSTING"}
+
+    def stop_model(self, body, project_name, model_version):
+        with self.lock:
+            model = self.model(project_name, model_version)
+            if model["Status"] != "HOSTED":
+                raise MockError(409, "ConflictException", f"Can't stop a model with status {model['Status']}")
+            model["Status"] = "STOPPING_HOSTING"
+            model["changed"] = time.time()
+            model["limiter"] = None
+        return {"Status": "STOPPING_HOSTING"}
+
+    def detect_anomalies(self, image, project_name, model_version):
+        model = self.model(project_name, model_version)
+        if model["Status"] != "HOSTED":
+            raise MockError(409, "ConflictException", f"Model {project_name}/{model_version} isn't hosted")
+        if not model["limiter"].take():
+            raise MockError(429, "ThrottlingException", "Rate exceeded")
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        is_anomalous, confidence, anomalies, mask = synthetic_result(image, self.anomaly_rate, self.segmentation)
+        result = {"Source": {"Type": "direct"}, "IsAnomalous": is_anomalous, "Confidence": confidence}
+        if mask is not None:
+            result["AnomalyMask"] = base64.b64encode(png_bytes(mask, MASK_SIZE, MASK_SIZE)).decode("ascii")
+            result["Anomalies"] = [{"Name": name, "PixelAnomaly": {"TotalPercentageArea": area, "Color": color}}
+                                   for name, color, area in anomalies]
+        return {"DetectAnomalyResult": result}
+
+
+PREFIX = f"/{API_VERSION}"
+ROUTES = [
+    ("POST", r"/projects", "create_project"),
+    ("GET", r"/projects", "list_projects"),
+    ("GET", r"/projects/([^/]+)", "describe_project"),
+    ("DELETE", r"/projects/([^/]+)", "delete_project"),
+    ("POST", r"/projects/([^/]+)/datasets", "create_dataset"),
+    ("GET", r"/projects/([^/]+)/datasets/([^/]+)", "describe_dataset"),
+    ("DELETE", r"/projects/([^/]+)/datasets/([^/]+)", "delete_dataset"),
+    ("POST", r"/projects/([^/]+)/models", "create_model"),
+    ("GET", r"/projects/([^/]+)/models", "list_models"),
+    ("GET", r"/projects/([^/]+)/models/([^/]+)", "describe_model"),
+    ("DELETE", r"/projects/([^/]+)/models/([^/]+)", "delete_model"),
+    ("POST", r"/projects/([^/]+)/models/([^/]+)/start", "start_model"),
+    ("POST", r"/projects/([^/]+)/models/([^/]+)/stop", "stop_model"),
+    ("POST", r"/detect/([^/]+)/models/([^/]+)/detect", "detect_anomalies"),
+]
+ROUTES = [(method, re.compile(PREFIX + pattern + "$"), operation) for method, pattern, operation in ROUTES]
+
+
+def make_handler(service, routes=ROUTES):
+    """
+    Creates a request handler class that dispatches REST-JSON requests to service.
+    routes is a list of (method, compiled path pattern, operation name). Query
+    string parameters are passed to the operation with the JSON body.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+        def send_json(self, status, body, headers=()):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def dispatch(self, method):
+            url = urlparse(self.path)
+            path = url.path
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            try:
+                for route_method, pattern, operation in routes:
+                    match = pattern.match(path)
+                    if match and route_method == method:
+                        params = [unquote(group) for group in match.groups()]
+                        if operation == "detect_anomalies":
+                            # The image is the raw request body.
+                            response = service.detect_anomalies(body, *params)
+                        else:
+                            request = dict(parse_qsl(url.query))
+                            request.update(json.loads(body or b"{}"))
+                            response = getattr(service, operation)(request, *params)
+                        self.send_json(200, response)
+                        return
+                raise MockError(404, "ResourceNotFoundException", f"No operation for {method} {path}")
+            except MockError as error:
+                self.send_json(error.status, {"message": str(error)},
+                               [("x-amzn-ErrorType", error.error_type)])
+            except (KeyError, ValueError) as error:
+                self.send_json(400, {"message": f"Invalid request: {error}"},
+                               [("x-amzn-ErrorType", "ValidationException")])
+
+        def do_GET(self):
+            self.dispatch("GET")
+
+        def do_POST(self):
+            self.dispatch("POST")
+
+        def do_DELETE(self):
+            self.dispatch("DELETE")
+
+    return Handler
+
+
+def serve(service, port=DEFAULT_PORT, host="localhost", routes=ROUTES):
+    """
+    Starts the mock service on a background thread and returns the server.
+    Call shutdown() on the server to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(service, routes))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    """
+    Entry point for the mock service.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Runs a local stand-in for the Lookout for Vision API.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="The port to listen on.")
+    parser.add_argument("--host", default="localhost", help="The address to listen on.")
+    parser.add_argument("--latency-ms", type=float, default=50,
+                        help="The time each DetectAnomalies call takes, in milliseconds.")
+    parser.add_argument("--tps-per-inference-unit", type=float, default=5,
+                        help="DetectAnomalies calls per second each inference unit serves before throttling.")
+    parser.add_argument("--anomaly-rate", type=float, default=0.3,
+                        help="The fraction of images reported as anomalous.")
+    parser.add_argument("--train-seconds", type=float, default=10, help="The time training takes.")
+    parser.add_argument("--host-seconds", type=float, default=5, help="The time starting or stopping a model takes.")
+    parser.add_argument("--classification", action="store_true",
+                        help="Return classification results without anomaly masks.")
+    parser.add_argument("--preset", metavar="PROJECT/VERSION", action="append", default=[],
+                        help="Create a hosted model at startup, e.g. circuitproject/1. Repeat for more models.")
+    args = parser.parse_args()
+
+    service = MockLookoutVision(args.latency_ms, args.tps_per_inference_unit, args.anomaly_rate,
+                                args.train_seconds, args.host_seconds,
+                                segmentation=not args.classification)
+    for preset in args.preset:
+        project_name, model_version = preset.split("/")
+        service.add_model(project_name, model_version, "HOSTED", "Preset", inference_units=1)
+
+    server = serve(service, args.port, args.host)
+    logger.info("Mock Lookout for Vision listening on http://%s:%d", args.host, args.port)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()